@@ -0,0 +1,52 @@
+"""
+Expand abbreviated long options with specs of many long options, as
+generated from config schemas.
+
+Usage:
+    abbreviation.py [--options=<n>] [--number=<n>]
+
+Options:
+    -o, --options=<n>    long options of each spec, comma separated
+                         [default: 100,1000,5000]
+    -n, --number=<n>     times to expand [default: 20]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+
+abbreviated = 50
+
+
+def make(size):
+    names = ['--config-key-%s-value' % x for x in range(size)]
+    doc = 'Usage: prog [options]\n\nOptions:\n%s\n' % '\n'.join(
+        '    %s=<v>' % x for x in names)
+    # the last ones, abbreviated as `--config-key-<n>-val`
+    argv = ['prog']
+    for name in names[-abbreviated:]:
+        argv.extend((name[:-2], 'v'))
+    return doc, argv
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    sizes = [int(x) for x in args['--options'].split(',')]
+    number = int(args['--number'])
+
+    row = '%8s %12s %11s'
+    print(row % ('options', 'abbreviated', 'expand(ms)'))
+    for size in sizes:
+        doc, argv = make(size)
+        pie = Docpie(doc, help=False, version=None)
+        cost = min(timeit.repeat(lambda: pie._prepare_token(argv),
+                                 number=number, repeat=3))
+        print(row % (size, abbreviated, '%.3f' % (cost / number * 1000)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure the peak memory allocated by one parse with `tracemalloc`, and
+time it.
+
+Usage:
+    allocations.py [--tokens=<n>] [--number=<n>]
+
+Options:
+    -t, --tokens=<n>    tokens of the long argvs [default: 2000]
+    -n, --number=<n>    times to parse for the time [default: 20]
+"""
+
+import os
+import sys
+import ast
+import timeit
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+define = """
+Usage: prog [-D <kv>]... <file>...
+
+Options:
+    -D <kv>    define a variable
+"""
+
+
+def cases(tokens):
+    yield ('naval_fate', example('naval_fate.py'), None,
+           'naval_fate.py ship a move 1 2 --speed=3'.split())
+    yield ('git remote', example(os.path.join('git', 'git_remote.py')),
+           'git.py', 'git.py remote -v update -p origin'.split())
+    yield ('<file>...', 'Usage: prog [-v] <file>...', None,
+           ['prog'] + ['file%s' % x for x in range(tokens)])
+    yield ('-D <kv> <file>...', define, None,
+           ['prog'] + ['-D', 'k=v', 'file'] * (tokens // 3))
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    tokens = int(args['--tokens'])
+    number = int(args['--number'])
+
+    row = '%-20s %7s %10s %10s'
+    print(row % ('spec', 'tokens', 'peak(kB)', 'time(ms)'))
+    for name, doc, prog, argv in cases(tokens):
+        pie = Docpie(doc, help=False, version=None, name=prog)
+        pie.docpie(argv)
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        pie.docpie(argv)
+        peak = tracemalloc.get_traced_memory()[1] - start
+        tracemalloc.stop()
+        cost = min(timeit.repeat(lambda: pie.docpie(argv),
+                                 number=number, repeat=3)) / number
+        print(row % (name, len(argv) - 1, '%.1f' % (peak / 1024.),
+                     '%.2f' % (cost * 1000)))
+
+
+if __name__ == '__main__':
+    main()
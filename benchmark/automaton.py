@@ -0,0 +1,69 @@
+"""
+Match argv without options with the automaton of the simple usages, and
+with `Unit.match` only.
+
+Usage:
+    automaton.py [--number=<n>] [--commands=<n>]
+
+Options:
+    -n, --number=<n>      times to match each argv [default: 200]
+    -c, --commands=<n>    subcommands of the synthetic spec [default: 200]
+"""
+
+import os
+import sys
+import ast
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+def synthetic(commands):
+    lines = ['prog cmd%s <x> [--flag]' % x for x in range(commands)]
+    lines.append('prog <src> <dst> <file>...')
+    return 'Usage:\n%s\n' % '\n'.join('    %s' % x for x in lines)
+
+
+def cases(commands):
+    yield ('naval_fate', example('naval_fate.py'),
+           ['ship new a b', 'ship a move 1 2', 'mine remove 1 2'])
+    yield ('%s commands' % commands, synthetic(commands),
+           ['cmd0 1', 'cmd%s 1' % (commands - 1),
+            'a b %s' % ' '.join(map(str, range(100)))])
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    commands = int(args['--commands'])
+
+    row = '%-15s %-24s %8s %14s %12s'
+    print(row % ('spec', 'argv', 'compiled', 'automaton(us)', 'match(us)'))
+    for name, doc, argvs in cases(commands):
+        pie = Docpie(doc, help=False, version=None)
+        plain = pie._clone_spec()
+        plain._match_simple = lambda token: None
+        compiled = len(pie._usage_automaton().plans)
+        for argv in argvs:
+            argv = ['prog'] + argv.split()
+            costs = [min(timeit.repeat(lambda: each.docpie(argv),
+                                       number=number, repeat=3)) /
+                     number * 1e6
+                     for each in (pie, plain)]
+            shown = ' '.join(argv[1:])
+            if len(shown) > 24:
+                shown = shown[:21] + '...'
+            print(row % (name, shown, '%s/%s' % (compiled, len(pie.usages)),
+                         '%.1f' % costs[0], '%.1f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
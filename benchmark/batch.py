@@ -0,0 +1,72 @@
+"""
+Parse many argv with `Docpie.docpie_many`, and with `Docpie.docpie` in a
+loop catching `DocpieExit`.
+
+Usage:
+    batch.py [--number=<n>] [--failed=<percent>]
+
+Options:
+    -n, --number=<n>        argv to parse [default: 20000]
+    -f, --failed=<percent>  failing argv in percent [default: 30]
+"""
+
+import os
+import sys
+import ast
+import time
+import random
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie, DocpieExit
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+good = ['ship new a b', 'ship a move 1 2 --speed=3', 'ship shoot 1 2',
+        'mine set 1 2 --moored', 'mine remove 1 2']
+bad = ['ship a move 1', 'mine 1 2', '--nothing', 'ship a move 1 2 --speed']
+
+
+def argvs(number, failed):
+    rand = random.Random(0)
+    for _ in range(number):
+        pool = bad if rand.random() * 100 < failed else good
+        yield ['naval_fate.py'] + rand.choice(pool).split()
+
+
+def loop(pie, all_argv):
+    results = []
+    for argv in all_argv:
+        try:
+            results.append(pie.docpie(argv))
+        except DocpieExit as e:
+            results.append(e)
+    return results
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    failed = float(args['--failed'])
+
+    pie = Docpie(example('naval_fate.py'), help=False, version=None)
+    all_argv = list(argvs(number, failed))
+
+    start = time.time()
+    loop(pie, all_argv)
+    loop_seconds = time.time() - start
+
+    batch = pie.docpie_many(all_argv)
+
+    print('%s argv, %s failed' % (len(batch), batch.failed))
+    print('docpie loop:  %8.0f argv/s' % (number / loop_seconds))
+    print('docpie_many:  %8.0f argv/s' % batch.throughput)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Make the result of a matched usage from the template of its default values,
+and by merging the default values of the other usages and the options.
+
+Usage:
+    defaults.py [--number=<n>] [--usages=<n>]
+
+Options:
+    -n, --number=<n>      times to parse each argv [default: 200]
+    -u, --usages=<n>      usages of the synthetic spec [default: 200]
+"""
+
+import os
+import sys
+import ast
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+def synthetic(usages):
+    lines = ['prog cmd%s <x> [--opt%s=<v>]' % (x, x) for x in range(usages)]
+    options = ['--opt%s=<v>  option [default: %s]' % (x, x)
+               for x in range(usages)]
+    return 'Usage:\n%s\n\nOptions:\n%s\n' % (
+        '\n'.join('    %s' % x for x in lines),
+        '\n'.join('    %s' % x for x in options))
+
+
+def cases(usages):
+    yield ('naval_fate', example('naval_fate.py'),
+           ['ship a move 1 2 --speed=3', 'mine remove 1 2 --drifting'])
+    yield ('%s usages' % usages, synthetic(usages),
+           ['cmd0 1 --opt0=1', 'cmd%s 1 --opt%s=1' % ((usages - 1,) * 2)])
+
+
+def merge(self, index, values):
+    # what's done for each parse without the templates
+    self._add_rest_value(values, self._rest_usages(index, self.usages))
+    self._add_option_value(values, self.options)
+    return values
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    usages = int(args['--usages'])
+
+    fill_template = Docpie._fill_template
+
+    row = '%-12s %-28s %13s %10s'
+    print(row % ('spec', 'argv', 'template(us)', 'merge(us)'))
+    for name, doc, argvs in cases(usages):
+        pie = Docpie(doc, help=False, version=None)
+        for argv in argvs:
+            argv = ['prog'] + argv.split()
+            costs = []
+            for each in (fill_template, merge):
+                Docpie._fill_template = each
+                assert pie.docpie(argv)
+                costs.append(min(timeit.repeat(
+                    lambda: pie.docpie(argv),
+                    number=number, repeat=3)) / number * 1e6)
+            Docpie._fill_template = fill_template
+            print(row % (name, ' '.join(argv[1:]),
+                         '%.1f' % costs[0], '%.1f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Match argv with the usages selected by the index of required commands, and
+with every usage tried in order.
+
+Usage:
+    dispatch.py [--number=<n>] [--commands=<n>]
+
+Options:
+    -n, --number=<n>      times to match each argv [default: 200]
+    -c, --commands=<n>    subcommands of the synthetic spec [default: 200]
+"""
+
+import os
+import sys
+import ast
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+from docpie.dispatch import UsageIndex
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+def synthetic(commands):
+    lines = ['prog cmd%s <x> [--flag]' % x for x in range(commands)]
+    return 'Usage:\n%s\n' % '\n'.join('    %s' % x for x in lines)
+
+
+def cases(commands):
+    yield ('naval_fate', example('naval_fate.py'), None,
+           ['ship new a', 'ship a move 1 2 --speed=3',
+            'mine remove 1 2 --drifting'])
+    yield ('git remote', example(os.path.join('git', 'git_remote.py')),
+           'git.py', ['remote rm origin', 'remote set-url --delete origin url'])
+    yield ('%s commands' % commands, synthetic(commands), None,
+           ['cmd0 1', 'cmd%s 1 --flag' % (commands - 1)])
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    commands = int(args['--commands'])
+
+    candidates = UsageIndex.candidates
+
+    def try_all(self, argv):
+        return range(len(self.usages))
+
+    row = '%-15s %-36s %6s %10s %10s'
+    print(row % ('spec', 'argv', 'tried', 'index(us)', 'all(us)'))
+    for name, doc, prog, argvs in cases(commands):
+        pie = Docpie(doc, help=False, version=None, name=prog)
+        for argv in argvs:
+            argv = ['prog'] + argv.split()
+            costs = []
+            for each in (candidates, try_all):
+                UsageIndex.candidates = each
+                costs.append(min(timeit.repeat(
+                    lambda: pie.docpie(argv),
+                    number=number, repeat=3)) / number * 1e6)
+            UsageIndex.candidates = candidates
+            tried = '%s/%s' % (
+                len(pie._usage_index().candidates(pie._prepare_token(argv))),
+                len(pie.usages))
+            print(row % (name, ' '.join(argv[1:]), tried,
+                         '%.1f' % costs[0], '%.1f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
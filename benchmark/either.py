@@ -0,0 +1,61 @@
+"""
+Build and match a usage of k independent `(aN|bN)` groups, with the groups
+folded into one usage and expanded to 2^k usages.
+
+Usage:
+    either.py [--groups=<k>] [--max-expanded=<k>] [--number=<n>]
+
+Options:
+    -g, --groups=<k>          numbers of groups, comma separated
+                              [default: 2,4,8,12,100]
+    -m, --max-expanded=<k>    the most groups to try expanded [default: 12]
+    -n, --number=<n>          times to match [default: 20]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+from docpie.parser import UsageParser
+
+fold_choice = UsageParser.__dict__['fold_choice']
+
+
+def make(groups):
+    doc = 'Usage: prog %s <x>' % ' '.join('(a%s|b%s)' % (x, x)
+                                          for x in range(groups))
+    # the last one tried when expanded
+    argv = ['prog'] + ['b%s' % x for x in range(groups)] + ['1']
+    return doc, argv
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    sizes = [int(x) for x in args['--groups'].split(',')]
+    max_expanded = int(args['--max-expanded'])
+    number = int(args['--number'])
+
+    row = '%-9s %7s %8s %10s %10s'
+    print(row % ('', 'groups', 'usages', 'build(ms)', 'match(ms)'))
+    for name, fold in (('folded', fold_choice),
+                       ('expanded', classmethod(lambda cls, usage: usage))):
+        UsageParser.fold_choice = fold
+        for size in sizes:
+            if fold is not fold_choice and size > max_expanded:
+                continue
+            doc, argv = make(size)
+            build = min(timeit.repeat(lambda: Docpie(doc),
+                                      number=1, repeat=3))
+            pie = Docpie(doc)
+            match = min(timeit.repeat(lambda: pie.docpie(argv),
+                                      number=number, repeat=3)) / number
+            print(row % (name, size, len(pie.usages),
+                         '%.2f' % (build * 1000), '%.3f' % (match * 1000)))
+    UsageParser.fold_choice = fold_choice
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Match argv with the usages left by the feasibility check (the number of
+commands/arguments and the options of each usage), and without it.
+
+Usage:
+    feasibility.py [--number=<n>] [--usages=<n>]
+
+Options:
+    -n, --number=<n>      times to match each argv [default: 200]
+    -u, --usages=<n>      usages of the synthetic spec [default: 100]
+"""
+
+import os
+import sys
+import ast
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+from docpie.dispatch import UsageIndex
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+def synthetic(usages):
+    # no command, so the index of required commands can't tell them apart
+    lines = ['prog %s [--opt%s]' % (
+        ' '.join('<x%s>' % y for y in range(x % 5 + 1)), x)
+        for x in range(usages)]
+    return 'Usage:\n%s\n' % '\n'.join('    %s' % x for x in lines)
+
+
+def cases(usages):
+    yield ('naval_fate', example('naval_fate.py'),
+           ['ship a move 1 2 --speed=3', 'mine remove 1 2 --drifting'])
+    yield ('%s usages' % usages, synthetic(usages),
+           ['1 --opt0', '1 2 3 --opt%s' % (usages - 3),
+            '1 2 3 4 5 6 --opt0'])
+
+
+def parse(pie, argv):
+    try:
+        pie.docpie(argv)
+    except SystemExit:
+        pass
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    usages = int(args['--usages'])
+
+    feasible = UsageIndex.feasible
+
+    def always(self, index, summary, argv):
+        return True
+
+    row = '%-12s %-28s %8s %12s %10s'
+    print(row % ('spec', 'argv', 'pruned', 'checked(us)', 'all(us)'))
+    for name, doc, argvs in cases(usages):
+        pie = Docpie(doc, help=False, version=None)
+        for argv in argvs:
+            argv = ['prog'] + argv.split()
+            costs = []
+            for each in (feasible, always):
+                UsageIndex.feasible = each
+                costs.append(min(timeit.repeat(
+                    lambda: parse(pie, argv),
+                    number=number, repeat=3)) / number * 1e6)
+            UsageIndex.feasible = feasible
+            parse(pie, argv)
+            pruned = '%s/%s' % (pie.usages_pruned, len(pie.usages))
+            print(row % (name, ' '.join(argv[1:]), pruned,
+                         '%.1f' % costs[0], '%.1f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Find the flags of the auto handlers in argv (`Docpie._find_flags`), with
+more and more handlers set by `set_auto_handler`, and the whole parse.
+
+Usage:
+    handlers.py [--handlers=<n>] [--number=<n>]
+
+Options:
+    -H, --handlers=<n>  handlers set, comma separated [default: 2,50,500]
+    -n, --number=<n>    times to run each case [default: 2000]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+
+
+def spec(handlers):
+    names = ['--flag%s' % x for x in range(handlers)]
+    return """
+Usage:
+    prog [options] <file>...
+
+Options:
+    -o, --output=<file>    output
+    -a                     flag a
+    -b                     flag b
+    -c                     flag c
+%s
+""" % '\n'.join('    %s    flag' % x for x in names), names
+
+
+def handler(pie, flag):
+    pass
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    counts = [int(x) for x in args['--handlers'].split(',')]
+    number = int(args['--number'])
+
+    argv = ['prog', '-abc', '-ofile', 'x', 'y', '--flag0']
+    row = '%8s %12s %10s'
+    print(row % ('handlers', 'prescan(us)', 'parse(us)'))
+    for count in counts:
+        doc, names = spec(count)
+        pie = Docpie(doc, help=False, version=None)
+        for name in names:
+            pie.set_auto_handler(name, handler)
+        token = pie._prepare_token(argv)
+        prescan = min(timeit.repeat(
+            lambda: pie.check_flag_and_handler(token),
+            number=number, repeat=3)) / number * 1e6
+        parse_number = max(1, number // 10)
+        parse = min(timeit.repeat(
+            lambda: pie.docpie(argv),
+            number=parse_number, repeat=3)) / parse_number * 1e6
+        print(row % (count, '%.1f' % prescan, '%.1f' % parse))
+
+
+if __name__ == '__main__':
+    main()
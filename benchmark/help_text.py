@@ -0,0 +1,84 @@
+"""
+Fail to parse argv, with the help message of the error formatted once for
+each help style, and formatted for each error.
+
+Usage:
+    help_text.py [--number=<n>] [--options=<n>]
+
+Options:
+    -n, --number=<n>      times to parse each argv [default: 2000]
+    -o, --options=<n>     options of the synthetic spec [default: 300]
+"""
+
+import os
+import sys
+import ast
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+def synthetic(options):
+    return '''
+    Usage:
+        prog [options] <file>
+
+    Options:
+%s
+    ''' % '\n'.join('        --opt%s=<v>    option %s [default: %s]' % (
+        x, x, x) for x in range(options))
+
+
+def cases(options):
+    yield ('naval_fate', example('naval_fate.py'), ['ship', 'mine'])
+    yield ('%s options' % options, synthetic(options), ['a b', '--opt0'])
+
+
+def fail(pie, argv):
+    try:
+        pie.docpie(argv)
+    except SystemExit:
+        pass
+    else:
+        raise AssertionError('%s should fail' % argv)
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    options = int(args['--options'])
+
+    help_text = Docpie._help_text
+
+    def uncached(self, kind):
+        self.__dict__.pop('_helps', None)
+        return help_text(self, kind)
+
+    row = '%-12s %-8s %-8s %10s %12s'
+    print(row % ('spec', 'style', 'argv', 'cached(us)', 'uncached(us)'))
+    for name, doc, argvs in cases(options):
+        for style in ('python', 'dedent'):
+            pie = Docpie(doc, helpstyle=style)
+            for argv in argvs:
+                argv = ['prog'] + argv.split()
+                costs = []
+                for each in (help_text, uncached):
+                    Docpie._help_text = each
+                    costs.append(min(timeit.repeat(
+                        lambda: fail(pie, argv),
+                        number=number, repeat=3)) / number * 1e6)
+                Docpie._help_text = help_text
+                print(row % (name, style, ' '.join(argv[1:]),
+                             '%.1f' % costs[0], '%.1f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
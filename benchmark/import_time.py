@@ -0,0 +1,105 @@
+"""
+Measure `import docpie` with `python -X importtime` (python 3.7+) in fresh
+interpreters, and fail if the median is over the budget.
+
+The first run compiles the bytecode into a temporary directory so the other
+runs measure an installed docpie, even if PYTHONDONTWRITEBYTECODE is set.
+
+Usage:
+    import_time.py [--number=<n>] [--budget=<ms>]
+
+Options:
+    -n, --number=<n>    times to import docpie [default: 10]
+    -b, --budget=<ms>   the median import time allowed [default: 20]
+"""
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+
+# should never be imported by `import docpie`
+unwanted = ('docpie.complete', 'docpie.bashlog', 'docpie.tracemore',
+            'docpie.codegen', 'docpie.binary',
+            'logging', 'hashlib', 'tempfile', 'pickle', 'ast', 'pprint',
+            'textwrap', 're')
+
+line_re = re.compile(r'^import time:\s*(\d+) \|\s*(\d+) \|(\s*)(\S+)$')
+
+
+def run(env, code):
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.path.join(here, '..'), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        sys.exit(err)
+    return out, err
+
+
+def parse(err):
+    """Return {module: (self us, cumulative us)}"""
+    result = {}
+    for line in err.splitlines():
+        match = line_re.match(line)
+        if match is not None:
+            result[match.group(4)] = (int(match.group(1)),
+                                      int(match.group(2)))
+    return result
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    budget = float(args['--budget'])
+    if sys.version_info < (3, 7):
+        sys.exit('`-X importtime` needs python 3.7+')
+
+    code = ('import sys, docpie; '
+            'print(" ".join(x for x in %r if x in sys.modules))' %
+            (unwanted,))
+    prefix = tempfile.mkdtemp(prefix='docpie-bench-')
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=prefix)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    try:
+        run(env, code)
+        costs = []
+        for _ in range(number):
+            out, err = run(env, code)
+            costs.append(parse(err))
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+    totals = sorted(x['docpie'][1] / 1000.0 for x in costs)
+    median = totals[len(totals) // 2]
+    last = costs[-1]
+    row = '%-30s %9s %9s'
+    print(row % ('module', 'self(ms)', 'cum(ms)'))
+    for name in sorted(last, key=lambda x: -last[x][1])[:15]:
+        print(row % (name, '%.2f' % (last[name][0] / 1000.0),
+                     '%.2f' % (last[name][1] / 1000.0)))
+    print('')
+    print('import docpie: min %.2f ms, median %.2f ms, budget %.2f ms' %
+          (totals[0], median, budget))
+
+    failed = False
+    if out.strip():
+        print('unexpectedly imported: %s' % out.strip())
+        failed = True
+    if median > budget:
+        print('over budget')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
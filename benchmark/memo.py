@@ -0,0 +1,58 @@
+"""
+Match specs whose usages share the same sub-patterns, with and without
+the memo of sub-matches (`Docpie(memo=True)`).
+
+Usage:
+    memo.py [--tokens=<n>] [--number=<n>]
+
+Options:
+    -t, --tokens=<n>    files in argv [default: 1000]
+    -n, --number=<n>    times to match [default: 5]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+
+
+def make(pattern, size):
+    # `[-A | -B] [-C | -D] ...` expands to 2^size usages. With `-B` in
+    # argv, the first half fail after matching `pattern` with the same argv
+    flags = ' '.join('[-%s | -%s]' % (chr(65 + 2 * x), chr(66 + 2 * x))
+                     for x in range(size))
+    return 'Usage: prog %s %s' % (pattern, flags)
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    tokens = int(args['--tokens'])
+    number = int(args['--number'])
+
+    row = '%-26s %5s %7s %8s %10s %10s'
+    print(row % ('pattern', 'size', 'usages', 'skipped', 'memo(ms)',
+                 'plain(ms)'))
+    for pattern, files in (
+            ('[<file>...]', ['file%s' % x for x in range(tokens)]),
+            ('[(a|b) [<x> [<y>...]]]...',
+             ['a', '1'] + ['%s' % x for x in range(tokens)])):
+        for size in (1, 2, 3, 4):
+            doc = make(pattern, size)
+            argv = ['prog'] + files + ['-B']
+            costs = []
+            for memo in (True, False):
+                pie = Docpie(doc, help=False, version=None, memo=memo)
+                costs.append(min(timeit.repeat(
+                    lambda: pie.docpie(argv),
+                    number=number, repeat=3)) / number * 1000)
+                if memo:
+                    skipped = pie.memo_skipped
+            print(row % (pattern, size, len(pie.usages), skipped,
+                         '%.2f' % costs[0], '%.2f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Find options in long argvs: `Argv.break_for_option` alone, and whole
+matches of 1k-token argvs.
+
+Usage:
+    option_lookup.py [--tokens=<n>] [--number=<n>]
+
+Options:
+    -t, --tokens=<n>    tokens in each argv, comma separated
+                        [default: 1000]
+    -n, --number=<n>    times to run each case [default: 100]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+
+letters = 'abcdefghijklmn'
+
+doc = """
+Usage:
+    prog [options] [--define=<kv>]... <file>...
+
+Options:
+%s
+    -o, --output=<file>    output
+    -D, --define=<kv>      define a variable
+""" % '\n'.join('    -%s, --long-%s    flag %s' % (x, x, x) for x in letters)
+
+
+def files(size):
+    return ['file%s' % x for x in range(size)]
+
+
+def mixed(size):
+    # the flags, then attached values and files in turn
+    result = ['-%s' % x for x in letters]
+    while len(result) < size:
+        index = len(result)
+        if index % 4:
+            result.append('file%s' % index)
+        elif index % 8:
+            result.append('--define=k%s' % index)
+        else:
+            result.append('-Dk%s' % index)
+    return result
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    sizes = [int(x) for x in args['--tokens'].split(',')]
+    number = int(args['--number'])
+
+    pie = Docpie(doc, help=False, version=None)
+    row = '%-14s %7s %12s'
+    print(row % ('case', 'tokens', 'time(ms)'))
+    for size in sizes:
+        # lookups of absent and last options
+        argv = pie._prepare_token(['prog'] + files(size) + ['-ofile'])
+        for name, names in (('miss', ('-D', '--define')),
+                            ('last', ('-o', '--output'))):
+            def lookup():
+                # the found one is popped
+                argv.clone().break_for_option(names)
+            cost = min(timeit.repeat(lookup, number=number, repeat=3))
+            print(row % ('lookup %s' % name, size,
+                         '%.3f' % (cost / number * 1000)))
+
+        for name, make in (('files', files), ('mixed', mixed)):
+            tokens = ['prog'] + make(size)
+            cost = min(timeit.repeat(lambda: pie.docpie(tokens),
+                                     number=1, repeat=3))
+            print(row % ('match %s' % name, size, '%.3f' % (cost * 1000)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Parse many argv with `docpie.parallel.parse_all` in worker processes,
+compared with `Docpie.docpie_many` in this process.
+
+Usage:
+    parallel.py [--number=<n>] [--processes=<list>] [--chunksize=<n>]
+
+Options:
+    -n, --number=<n>        argv to parse [default: 100000]
+    -p, --processes=<list>  comma separated numbers of processes
+                            [default: 1,2,4]
+    -c, --chunksize=<n>     argv sent in each task [default: 1000]
+"""
+
+import os
+import sys
+import ast
+import time
+import random
+import multiprocessing
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie
+from docpie.parallel import parse_all
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+pool = ['ship new a b', 'ship a move 1 2 --speed=3', 'ship shoot 1 2',
+        'mine set 1 2 --moored', 'mine remove 1 2', 'ship a move 1',
+        'mine 1 2', '--nothing']
+
+
+def argvs(number):
+    rand = random.Random(0)
+    for _ in range(number):
+        yield ['naval_fate.py'] + rand.choice(pool).split()
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    chunksize = int(args['--chunksize'])
+    processes = [int(x) for x in args['--processes'].split(',')]
+
+    pie = Docpie(example('naval_fate.py'), help=False, version=None)
+    all_argv = list(argvs(number))
+
+    print('%s argv, %s CPUs' % (number, multiprocessing.cpu_count()))
+    start = time.time()
+    pie.docpie_many(all_argv)
+    base = time.time() - start
+    print('%-14s %10.0f argv/s' % ('docpie_many', number / base))
+
+    for each in processes:
+        start = time.time()
+        for _ in parse_all(pie, all_argv, each, chunksize):
+            pass
+        cost = time.time() - start
+        print('%-14s %10.0f argv/s  x%.2f' % (
+            '%s processes' % each, number / cost, base / cost))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measure the pickle size and the load time of compiled `Docpie` instances
+of the bundled examples, after one parse.
+
+Usage:
+    pickling.py [--number=<n>] [--protocol=<p>]
+
+Options:
+    -n, --number=<n>      times to load each pickle [default: 200]
+    -p, --protocol=<p>    pickle protocol, -1 for the highest [default: -1]
+"""
+
+import os
+import sys
+import timeit
+import logging
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+from serialization import examples
+
+logging.getLogger('docpie').setLevel(logging.CRITICAL)
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    protocol = int(args['--protocol'])
+
+    row = '%-46s %9s %9s'
+    print(row % ('example', 'size(B)', 'load(us)'))
+    total_size = total_time = 0
+    for name, pie in examples():
+        # leave a result and the matching state (if any) in it
+        try:
+            pie.docpie(['prog'])
+        except SystemExit:
+            pass
+        data = pickle.dumps(pie, protocol)
+        cost = min(timeit.repeat(lambda: pickle.loads(data),
+                                 number=number, repeat=3)) / number * 1e6
+        total_size += len(data)
+        total_time += cost
+        print(row % (name, len(data), '%.1f' % cost))
+
+    print(row % ('total', total_size, '%.1f' % total_time))
+
+
+if __name__ == '__main__':
+    main()
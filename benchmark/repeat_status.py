@@ -0,0 +1,48 @@
+"""
+Match repeated arguments with growing argvs. The time per token should
+stay flat as argv grows.
+
+Usage:
+    repeat_status.py [--tokens=<n>]
+
+Options:
+    -t, --tokens=<n>    tokens in each argv, comma separated
+                        [default: 2000,4000,8000]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+
+specs = (
+    ('<file>...', 'Usage: prog <file>...', ['file%s']),
+    ('(<src> <dst>)...', 'Usage: prog (<src> <dst>)...', ['src%s', 'dst%s']),
+    ('(<file> [-v])...', 'Usage: prog (<file> [-v])...', ['file%s', '-v']),
+)
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    sizes = [int(x) for x in args['--tokens'].split(',')]
+
+    row = '%-18s %7s %10s %14s'
+    print(row % ('usage', 'tokens', 'match(ms)', 'per token(us)'))
+    for name, doc, patterns in specs:
+        pie = Docpie(doc, help=False, version=None)
+        for size in sizes:
+            argv = ['prog']
+            for index in range(size):
+                pattern = patterns[index % len(patterns)]
+                argv.append(pattern % index if '%' in pattern else pattern)
+            cost = min(timeit.repeat(lambda: pie.docpie(argv),
+                                     number=1, repeat=3))
+            print(row % (name, size, '%.1f' % (cost * 1000),
+                         '%.2f' % (cost / size * 1e6)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Build specs with custom section titles, with and without the shared
+section regex cache of the parser.
+
+Usage:
+    section_regex.py [--number=<n>]
+
+Options:
+    -n, --number=<n>    specs to build [default: 500]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+from docpie.parser import section_re_cache
+
+titles = [('SYNOPSIS', 'OPTIONS'), ('Usage:', 'Options:'),
+          ('Usage:', 'Flags:'), ('Commands:', 'Options:')]
+
+doc = """
+%s
+    prog [options] <file>...
+
+%s
+    -q, --quiet      be quiet
+    -o <out>         output [default: -]
+"""
+
+
+def build(number):
+    for index in range(number):
+        usage_name, option_name = titles[index % len(titles)]
+
+        class Pie(Docpie):
+            pass
+        Pie.usage_name = usage_name
+        Pie.option_name = option_name
+        Pie(doc % (usage_name, option_name))
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+
+    maxsize = section_re_cache.maxsize
+    for name, size in (('no cache', 0), ('cached', maxsize)):
+        section_re_cache.clear()
+        section_re_cache.maxsize = size
+        before = section_re_cache.info()
+        cost = min(timeit.repeat(lambda: build(number), number=1, repeat=3))
+        info = section_re_cache.info()
+        print('%-9s %8.2f ms  compiles saved: %s, compiled: %s' % (
+            name, cost * 1000, info.hits - before.hits,
+            info.misses - before.misses))
+
+
+if __name__ == '__main__':
+    main()
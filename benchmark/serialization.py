@@ -0,0 +1,78 @@
+"""
+Compare loading a compiled `Docpie` from JSON (`to_dict`/`from_dict`) and
+from the binary format (`dumps`/`loads`) on the bundled examples.
+
+Usage:
+    serialization.py [--number=<n>]
+
+Options:
+    -n, --number=<n>    times to load each spec [default: 200]
+"""
+
+import os
+import sys
+import ast
+import json
+import timeit
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie, DocpieError
+
+logging.getLogger('docpie').setLevel(logging.CRITICAL)
+
+
+def examples():
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = []
+    for root, _, files in os.walk(os.path.join(here, '..', 'docpie',
+                                               'example')):
+        paths.extend(os.path.join(root, x)
+                     for x in files if x.endswith('.py'))
+    for path in sorted(paths):
+        with open(path) as f:
+            doc = ast.get_docstring(ast.parse(f.read()), clean=False)
+        if not doc:
+            continue
+        try:
+            pie = Docpie(doc)
+        except (DocpieError, TypeError):
+            continue
+        yield os.path.relpath(path, os.path.join(here, '..')), pie
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+
+    row = '%-46s %8s %8s %9s %9s %9s'
+    print(row % ('example', 'json(B)', 'bin(B)',
+                 'parse(us)', 'json(us)', 'bin(us)'))
+    total_json = total_bin = 0
+    for name, pie in examples():
+        doc = pie.doc
+        json_text = json.dumps(pie.to_dict())
+        data = pie.dumps()
+
+        def parse():
+            Docpie(doc)
+
+        def from_json():
+            Docpie.from_dict(json.loads(json_text))
+
+        def from_binary():
+            Docpie.loads(data)
+
+        cost = [min(timeit.repeat(x, number=number, repeat=3)) / number * 1e6
+                for x in (parse, from_json, from_binary)]
+        total_json += cost[1]
+        total_bin += cost[2]
+        print(row % ((name, len(json_text), len(data)) +
+                     tuple('%.1f' % x for x in cost)))
+
+    print('binary / json load time: %.2f' % (total_bin / total_json))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Validate argv with `Docpie.try_parse`, and with `Docpie.docpie` catching
+the `DocpieExit`.
+
+Usage:
+    try_parse.py [--number=<n>] [--options=<n>]
+
+Options:
+    -n, --number=<n>      times to parse each argv [default: 2000]
+    -o, --options=<n>     options of the synthetic spec [default: 300]
+"""
+
+import os
+import sys
+import ast
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from docpie import Docpie, DocpieExit
+
+
+def example(path):
+    with open(os.path.join(here, '..', 'docpie', 'example', path)) as f:
+        return ast.get_docstring(ast.parse(f.read()), clean=False)
+
+
+def synthetic(options):
+    return '''
+    Usage:
+        prog [options] <file>
+
+    Options:
+%s
+    ''' % '\n'.join('        --opt%s=<v>    option %s [default: %s]' % (
+        x, x, x) for x in range(options))
+
+
+def cases(options):
+    yield ('naval_fate', example('naval_fate.py'),
+           ['ship new a', 'ship a move 1', '--speed=3 mine'])
+    yield ('%s options' % options, synthetic(options),
+           ['a', 'a b', '--opt0', '--bad a'])
+
+
+def catch(pie, argv):
+    try:
+        return pie.docpie(argv)
+    except DocpieExit as e:
+        return e
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    number = int(args['--number'])
+    options = int(args['--options'])
+
+    row = '%-12s %-15s %-6s %13s %10s'
+    print(row % ('spec', 'argv', 'ok', 'try_parse(us)', 'catch(us)'))
+    for name, doc, argvs in cases(options):
+        pie = Docpie(doc, helpstyle='dedent')
+        for argv in argvs:
+            argv = ['prog'] + argv.split()
+            costs = [min(timeit.repeat(lambda: func(argv),
+                                       number=number, repeat=3)) /
+                     number * 1e6
+                     for func in (pie.try_parse,
+                                  lambda argv: catch(pie, argv))]
+            print(row % (name, ' '.join(argv[1:]), pie.try_parse(argv).ok,
+                         '%.1f' % costs[0], '%.1f' % costs[1]))
+
+
+if __name__ == '__main__':
+    main()
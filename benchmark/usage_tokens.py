@@ -0,0 +1,68 @@
+"""
+Parse synthetic usages with thousands of tokens: long alternatives, long
+flat lines, deep nesting and usages continued on many lines.
+
+Usage:
+    usage_tokens.py [--sizes=<n>]
+
+Options:
+    -s, --sizes=<n>    elements in each usage, comma separated
+                       [default: 1000,4000]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docpie import Docpie
+from docpie.parser import UsageParser
+from docpie.tokens import Token
+
+sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+
+def alternatives(size):
+    return 'prog (%s)' % ' | '.join('c%s' % x for x in range(size))
+
+
+def flat(size):
+    return 'prog %s' % ' '.join('[<a%s>]' % x for x in range(size))
+
+
+def nested(size):
+    size = min(size, 500)    # recursion of the parser
+    return 'prog %s%s' % (''.join('[c%s ' % x for x in range(size)),
+                          ']' * size)
+
+
+def lines(size):
+    return 'prog c0\n%s' % '\n'.join('     c%s' % x
+                                     for x in range(1, size))
+
+
+def parse(parser, usage):
+    for line in parser.split_line_by_indent(usage):
+        parser.parse_pattern(Token(parser.parse_line_to_lis(line)))
+
+
+def main():
+    args = Docpie(__doc__).docpie()
+    sizes = [int(x) for x in args['--sizes'].split(',')]
+
+    parser = UsageParser('Usage:', False, True, True, True, False)
+    row = '%-14s %7s %9s %10s'
+    print(row % ('usage', 'size', 'tokens', 'parse(ms)'))
+    for make in (alternatives, flat, nested, lines):
+        for size in sizes:
+            usage = make(size)
+            tokens = sum(len(parser.parse_line_to_lis(x))
+                         for x in parser.split_line_by_indent(usage))
+            cost = min(timeit.repeat(lambda: parse(parser, usage),
+                                     number=1, repeat=3))
+            print(row % (make.__name__, size, tokens, '%.2f' % (cost * 1000)))
+
+
+if __name__ == '__main__':
+    main()
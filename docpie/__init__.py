@@ -7,13 +7,14 @@ An easy and Pythonic command-line interface parser.
  * Copyright (c) 2015-2016 TylerTemp, tylertempdev@gmail.com
 """
 
+import sys
 from docpie.pie import Docpie
+from docpie.cache import SpecCache
 from docpie.error import DocpieException, DocpieExit, DocpieError, \
                          UnknownOptionExit, ExceptNoArgumentExit, \
                          ExpectArgumentExit, \
                          ExpectArgumentHitDoubleDashesExit, \
                          AmbiguousPrefixExit
-from logging import getLogger
 import warnings
 
 __all__ = ['docpie', 'Docpie',
@@ -21,6 +22,7 @@ __all__ = ['docpie', 'Docpie',
            'UnknownOptionExit', 'ExceptNoArgumentExit',
            'ExpectArgumentExit', 'ExpectArgumentHitDoubleDashesExit',
            'AmbiguousPrefixExit',
+           'cache_info', 'cache_clear', 'compile_to_module',
            'logger']
 
 # it's not a good idea but it can avoid loop importing
@@ -28,7 +30,55 @@ __version__ = Docpie._version
 
 __timestamp__ = 1517191473.190732  # last sumbit
 
-logger = getLogger('docpie')
+
+def __getattr__(name):
+    # `compile_to_module` and `logger` are loaded on first access, so the
+    # common `import docpie` doesn't import `ast`, `pprint` and `logging`
+    if name == 'compile_to_module':
+        from docpie.codegen import compile_to_module as value
+    elif name == 'logger':
+        from logging import getLogger
+        value = getLogger('docpie')
+    else:
+        raise AttributeError('module %r has no attribute %r' %
+                             (__name__, name))
+    globals()[name] = value
+    return value
+
+
+# module `__getattr__` needs python 3.7+
+if sys.version_info < (3, 7):
+    from docpie.codegen import compile_to_module
+    from logging import getLogger
+    logger = getLogger('docpie')
+    del getLogger
+
+# compiled `doc` used by `docpie` function.
+# set `spec_cache.maxsize = 0` to disable it
+spec_cache = SpecCache(128)
+
+
+def cache_info():
+    """Return hits/misses/evictions/maxsize/currsize of the compiled `doc`
+    cache used by `docpie` function"""
+    return spec_cache.info()
+
+
+def cache_clear():
+    """Drop all the compiled `doc` cached by `docpie` function"""
+    spec_cache.clear()
+
+
+def _spec_key(kwargs):
+    extra = kwargs['extra']
+    return (
+        kwargs['doc'], kwargs['help'], kwargs['version'],
+        kwargs['stdopt'], kwargs['attachopt'], kwargs['attachvalue'],
+        kwargs['helpstyle'], kwargs['auto2dashes'], kwargs['name'],
+        kwargs['case_sensitive'], kwargs['optionsfirst'],
+        kwargs['appearedonly'], kwargs['namedoptions'],
+        None if extra is None else frozenset(extra.items()),
+    )
 
 
 def docpie(doc, argv=None, help=True, version=None,
@@ -36,7 +86,7 @@ def docpie(doc, argv=None, help=True, version=None,
            helpstyle='python',
            auto2dashes=True, name=None, case_sensitive=False,
            optionsfirst=False, appearedonly=False, namedoptions=False,
-           extra=None):
+           extra=None, cache_dir=None):
     """
     Parse `argv` based on command-line interface described in `doc`.
 
@@ -84,6 +134,9 @@ def docpie(doc, argv=None, help=True, version=None,
         customize pre-handled options. See
         http://docpie.comes.today/document/advanced-apis/
         for more infomation.
+    cache_dir: str (default: None)
+        if set, the compiled `doc` will be cached in this directory, and
+        loaded from it next time when `doc` and the config are the same.
     Returns
     -------
     args : dict
@@ -116,6 +169,11 @@ def docpie(doc, argv=None, help=True, version=None,
      '<port>': '80',
      'serial': False,
      'tcp': True}
+    Note
+    ----
+    The compiled `doc` is kept in a process-wide cache, so calling `docpie`
+    again with the same `doc` and config does not parse `doc` again.
+    See `cache_info` and `cache_clear`.
     See also
     --------
     * Full documentation is available in README.md as well as online
@@ -128,7 +186,21 @@ def docpie(doc, argv=None, help=True, version=None,
 
     kwargs = locals()
     argv = kwargs.pop('argv')
-    pie = Docpie(**kwargs)
+
+    try:
+        key = _spec_key(kwargs)
+        hash(key)
+    except TypeError:    # e.g. `version` is a list
+        key = None
+
+    spec = None if key is None else spec_cache.get(key)
+    if spec is None:
+        pie = Docpie(**kwargs)
+        if key is not None:
+            spec_cache.put(key, pie._clone_spec())
+    else:
+        pie = spec._clone_spec()
+
     pie.docpie(argv)
     return pie
 
@@ -0,0 +1,64 @@
+"""
+Usage:
+    docpie compile [options] <file>
+
+Generate a module parsing argv like the `Docpie` of the `doc` in <file>.
+The `doc` is the module docstring if <file> ends with ".py",
+otherwise the whole content of <file>.
+
+Options:
+    -o, --output=<out>       write the module into <out> instead of stdout
+    --name=<name>            the "name" of your program in "Usage"
+    --version=<version>      version to print on `--version`
+    --no-help                don't handle `-h`/`--help`
+    --helpstyle=<style>      "python", "dedent" or "raw" [default: python]
+    --optionsfirst           see `docpie.docpie`
+    --appearedonly           see `docpie.docpie`
+    --namedoptions           see `docpie.docpie`
+    -h, --help               print this message
+"""
+
+import ast
+import io
+import sys
+
+from docpie import Docpie
+from docpie.codegen import compile_to_module
+
+
+def read_doc(path):
+    with io.open(path, encoding='utf-8') as f:
+        content = f.read()
+
+    if not path.endswith('.py'):
+        return content
+
+    doc = ast.get_docstring(ast.parse(content.encode('utf-8')), clean=False)
+    if doc is None:
+        sys.exit('%s has no module docstring' % path)
+    return doc
+
+
+def main(argv=None):
+    args = Docpie(__doc__).docpie(argv)
+
+    pie = Docpie(read_doc(args['<file>']),
+                 help=not args['--no-help'],
+                 version=args['--version'],
+                 helpstyle=args['--helpstyle'],
+                 name=args['--name'],
+                 optionsfirst=args['--optionsfirst'],
+                 appearedonly=args['--appearedonly'],
+                 namedoptions=args['--namedoptions'])
+    source = compile_to_module(pie)
+
+    output = args['--output']
+    if output is None:
+        sys.stdout.write(source)
+    else:
+        with io.open(output, 'w', encoding='utf-8') as f:
+            f.write(source)
+
+
+if __name__ == '__main__':
+    main()
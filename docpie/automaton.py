@@ -0,0 +1,300 @@
+"""
+Match the simple usages of a `Docpie` with an automaton, in one pass over
+argv.
+
+A usage is "simple" when it is a sequence of commands and arguments,
+optionally ending with one repeated argument (`<name>...`), plus groups of
+options. Such a usage is a regular language over the argv without options:
+a command token, or any token for an argument, at each position. The
+automaton runs all the simple usages at once. A state is the usages still
+alive and the position, the states are made on demand and the moves are
+cached by the token (a command name at that position, or `None` for any
+other token). The usage with the lowest index accepting the whole argv is
+the result.
+
+It's only tried when argv has no option (nothing starts with `-`), and
+only the usages before the first non-simple one are compiled, so the
+usages are still tried in order. Otherwise `Docpie` matches the usages
+with `Unit.match`, so the result is always the same.
+
+The result of each usage is precomputed as a template of entries:
+    ('value', value)        the value as it is
+    ('token', index)        argv[index]
+    ('list', index)         [argv[index]]
+    ('tail', index)         argv[index:]
+    ('is', index, name)     argv[index] == name
+"""
+
+from docpie.element import Option, Command, Choice, Argument
+from docpie.element import Optional, Required
+from docpie.lazy import get_logger
+
+__all__ = ['Automaton', 'plan_usages']
+
+logger = get_logger('docpie.automaton')
+
+# `argv` won't contain it
+_placeholder = '\0docpie-slot-%s\0'
+
+
+def _option_only(element):
+    if isinstance(element, Option):
+        return True
+    if isinstance(element, (Optional, Required)):
+        return all(_option_only(x) for x in element)
+    return False
+
+
+def _option_state(element):
+    """For an option-only element, return True if it always matches an
+    argv without options, False if it never does, None if unknown"""
+    if isinstance(element, Option):
+        return False
+    if isinstance(element, Optional):
+        return True
+    # A `Required` of `Optional` depends on whether argv is empty
+    if any(_option_state(x) is False for x in element):
+        return False
+    return None
+
+
+def _plan(usage):
+    """Return None if `usage` can not be specialized, False if it never
+    matches an argv without options, otherwise
+    (positional atoms, repeated argument or None)"""
+    # `prog`, `prog [options]`
+    if isinstance(usage, Optional):
+        if not usage.repeat and _option_only(usage):
+            return [], None
+        return None
+
+    if usage.repeat:
+        # `prog <file>...`
+        if len(usage) == 1 and isinstance(usage[0], Argument):
+            return [], usage[0]
+        return None
+
+    positional = []
+    tail = None
+    never = False
+    for each in usage:
+        if _option_only(each):
+            state = _option_state(each)
+            if state is None:
+                return None
+            never = never or not state
+        elif tail is not None:
+            # positional after `<name>...` needs value balancing
+            return None
+        elif isinstance(each, (Command, Argument)):
+            positional.append(each)
+        elif (isinstance(each, Required) and each.repeat and
+                len(each) == 1 and isinstance(each[0], Argument)):
+            tail = each[0]
+        else:
+            # nested units match their elements in their own order
+            return None
+
+    if never:
+        return False
+
+    names = []
+    for each in positional + ([tail] if tail is not None else []):
+        names.extend(each.names)
+    if len(names) != len(set(names)):
+        return None
+
+    return positional, tail
+
+
+def _template(pie, index, positional, tail, usages, options):
+    """Get the result of `usages[index]` matched, with placeholders as the
+    value of arguments. Return {key: entry} or None"""
+    usage = usages[index]
+    slots = {}
+    # {name: entry} of `Choice`, the value depends on which one is given
+    chosen = {}
+    for pos, each in enumerate(positional):
+        if isinstance(each, Choice):
+            each.value = True
+            for name in each.choices:
+                chosen[name] = ('is', pos, name)
+        elif isinstance(each, Command):
+            each.value = True
+        else:
+            each.value = _placeholder % pos
+            slots[each.value] = pos
+    if tail is not None:
+        tail.value = [_placeholder % 'tail']
+        slots[_placeholder % 'tail'] = None
+
+    try:
+        values = pie._collect_value(index, False, usages, options)
+    except Exception as e:
+        # leave it to `Unit.match`, which raises it when matched
+        logger.debug('%s can not be collected: %r', usage, e)
+        return None
+    finally:
+        usage.reset()
+
+    result = {}
+    for key, value in values.items():
+        if key in chosen:
+            if value is not False:
+                logger.debug('%s of %s is merged as %r', key, usage, value)
+                return None
+            result[key] = chosen[key]
+        elif isinstance(value, str) and slots.get(value) is not None:
+            result[key] = ('token', slots[value])
+        elif (isinstance(value, list) and len(value) == 1 and
+                isinstance(value[0], str) and value[0] in slots):
+            pos = slots[value[0]]
+            if pos is None:
+                result[key] = ('tail', len(positional))
+            else:
+                result[key] = ('list', pos)
+        elif _has_placeholder(value):
+            logger.debug('%s of %s has unknown value %r', key, usage, value)
+            return None
+        else:
+            result[key] = ('value', value)
+    return result
+
+
+def _has_placeholder(value):
+    if isinstance(value, list):
+        return any(_has_placeholder(x) for x in value)
+    return isinstance(value, str) and value.startswith(_placeholder[:-3])
+
+
+def plan_usages(pie, usages, options):
+    """Return [(usage index, tests, tail, template)] of the simple usages
+    of `pie`, where `tests` has the sorted command names, or None for an
+    argument, at each position and `tail` is True if it ends with
+    `<name>...`. `usages`/`options` are taken by `Docpie._take_spec`."""
+    plans = []
+    if pie.options_first:
+        return plans
+    for index, usage in enumerate(usages):
+        plan = _plan(usage)
+        if plan is None:
+            logger.debug('stop compiling at %s', usage)
+            break
+        if plan is False:
+            logger.debug('%s never matches argv without option', usage)
+            continue
+        positional, tail = plan
+        template = _template(pie, index, positional, tail, usages, options)
+        if template is None:
+            break
+        tests = [None if isinstance(x, Argument) else sorted(x.names)
+                 for x in positional]
+        plans.append((index, tests, tail is not None, template))
+    return plans
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [_copy(x) for x in value]
+    return value
+
+
+class Automaton(object):
+
+    def __init__(self, plans):
+        self.plans = plans
+        # [(frozenset of command names or None, ...)] of each plan
+        self._tests = [tuple(None if x is None else frozenset(x)
+                             for x in tests)
+                       for _, tests, _, _ in plans]
+        # the positions after the longest plan are all the same
+        self._limit = max([len(x) for x in self._tests] or [0]) + 1
+        self._start = (frozenset(range(len(plans))), 0)
+        # {state: ({token or None: state or None}, names to tell apart)}
+        self._moves = {}
+        # {state: plan index or None}
+        self._accepts = {}
+
+    def to_data(self):
+        return [list(x) for x in self.plans]
+
+    @classmethod
+    def from_data(cls, data):
+        return cls([tuple(x) for x in data])
+
+    def _names(self, state):
+        alive, pos = state
+        names = set()
+        for each in alive:
+            tests = self._tests[each]
+            if pos < len(tests) and tests[pos] is not None:
+                names.update(tests[pos])
+        return names
+
+    def _next(self, state, token):
+        alive, pos = state
+        result = []
+        for each in alive:
+            tests = self._tests[each]
+            if pos < len(tests):
+                if tests[pos] is None or token in tests[pos]:
+                    result.append(each)
+            elif self.plans[each][2]:
+                result.append(each)
+        if not result:
+            return None
+        return (frozenset(result), min(pos + 1, self._limit))
+
+    def _accept(self, state):
+        alive, pos = state
+        for each in sorted(alive):
+            num = len(self._tests[each])
+            if self.plans[each][2]:
+                if pos > num:
+                    return each
+            elif pos == num:
+                return each
+        return None
+
+    def match(self, argv):
+        """Return the result of the first simple usage matching `argv`
+        (a list without options), or None"""
+        if not self.plans:
+            return None
+        state = self._start
+        moves = self._moves
+        for token in argv:
+            try:
+                table, names = moves[state]
+            except KeyError:
+                table, names = moves[state] = ({}, self._names(state))
+            key = token if token in names else None
+            try:
+                state = table[key]
+            except KeyError:
+                state = table[key] = self._next(state, key)
+            if state is None:
+                return None
+
+        try:
+            accepted = self._accepts[state]
+        except KeyError:
+            accepted = self._accepts[state] = self._accept(state)
+        if accepted is None:
+            return None
+
+        num = len(self._tests[accepted])
+        result = {}
+        for key, entry in self.plans[accepted][3].items():
+            kind = entry[0]
+            if kind == 'token':
+                result[key] = argv[entry[1]]
+            elif kind == 'list':
+                result[key] = [argv[entry[1]]]
+            elif kind == 'tail':
+                result[key] = list(argv[num:])
+            elif kind == 'is':
+                result[key] = argv[entry[1]] == entry[2]
+            else:
+                result[key] = _copy(entry[1])
+        return result
@@ -0,0 +1,121 @@
+"""
+The results of `Docpie.docpie_many` and `Docpie.try_parse`.
+
+Parsing many argv with one `Docpie` reuses the things `Docpie.docpie`
+prepares for each call: the option tables, the handler checking, the
+automaton and one copy of the compiled spec to match in. A failure is
+kept as the error raised by the matching, without the help message
+`Docpie.exception_handler` adds, and nothing is raised.
+"""
+
+from docpie.error import DocpieExit, UnknownOptionExit, AmbiguousPrefixExit
+
+__all__ = ['ParseResult', 'TryResult', 'BatchResult']
+
+
+class ParseResult(object):
+    """The result of one argv.
+
+    `value` is the dict `Docpie.docpie` returns, or None if failed.
+    `error` is the `DocpieExit` of the failure, whose message does not
+    have the help message.
+    `flag` is the option of `extra` found in argv, e.g. `--help`. The
+    handler is not called, and `value` is None.
+    """
+    __slots__ = ('argv', 'value', 'error', 'flag')
+
+    def __init__(self, argv, value=None, error=None, flag=None):
+        self.argv = argv
+        self.value = value
+        self.error = error
+        self.flag = flag
+
+    @property
+    def ok(self):
+        return self.value is not None
+
+    @property
+    def error_class(self):
+        return None if self.error is None else type(self.error)
+
+    @property
+    def option(self):
+        """The option of the error: the unknown one of
+        `UnknownOptionExit`, the names of the option of `ArgumentExit`, or
+        the prefix of `AmbiguousPrefixExit`"""
+        if isinstance(self.error, AmbiguousPrefixExit):
+            return self.error.prefix
+        return getattr(self.error, 'option', None)
+
+    @property
+    def token(self):
+        """The token of argv causing the error: the one having the unknown
+        option of `UnknownOptionExit`, or the argument hit by
+        `ArgumentExit`"""
+        if isinstance(self.error, UnknownOptionExit):
+            return self.error.inside
+        return getattr(self.error, 'hit', None)
+
+    def message(self, pie=None):
+        """The message of the error (None if not failed), with the help
+        message `Docpie.docpie` raises it with if `pie` is given"""
+        if self.error is None:
+            return None
+        message = self.error.args[0] if self.error.args else None
+        if pie is None:
+            return message
+        return pie._error_message(message)
+
+    def __repr__(self):
+        name = type(self).__name__
+        if self.flag is not None:
+            return '<%s %r flag=%r>' % (name, self.argv, self.flag)
+        if self.error is not None:
+            return '<%s %r error=%r>' % (name, self.argv, self.error)
+        return '<%s %r ok>' % (name, self.argv)
+
+
+class TryResult(ParseResult):
+    """The result of `Docpie.try_parse`.
+
+    `furthest` is the index (of `Docpie.usages`) of the usage raising the
+    error, or the one matching the most tokens of argv in order if none
+    matches, which is found when it's first asked. It's None if not
+    failed, or failed before matching the usages.
+    """
+    __slots__ = ('_pie', '_furthest')
+
+    def __init__(self, result, pie, furthest=None):
+        super(TryResult, self).__init__(
+            result.argv, result.value, result.error, result.flag)
+        self._pie = pie
+        self._furthest = furthest
+
+    @property
+    def furthest(self):
+        # only the plain `DocpieExit` is raised for none matched
+        if self._furthest is None and type(self.error) is DocpieExit:
+            self._furthest = self._pie._furthest(self.argv)
+        return self._furthest
+
+
+class BatchResult(list):
+    """A list of `ParseResult` in the order of the argv, with the time
+    taken (`seconds`) and `throughput` (argv per second)"""
+
+    seconds = 0.0
+
+    @property
+    def throughput(self):
+        if not self.seconds:
+            return float('inf') if self else 0.0
+        return len(self) / self.seconds
+
+    @property
+    def failed(self):
+        return sum(1 for x in self if not x.ok)
+
+    def __repr__(self):
+        return '<BatchResult %s argv, %s failed, %.1f/s>' % (
+            len(self), self.failed, self.throughput)
+
@@ -0,0 +1,237 @@
+"""
+A compact binary format of the compiled `Docpie`, see `Docpie.dumps`.
+
+The layout is a header (magic + format version) followed by a `marshal`ed
+tuple. All the names are stored once in a string table and referred by
+index. `Option` instances (and the `ref` of them) are stored once in a
+table and referred by index wherever they appear, so the instances shared
+in the compiled `Docpie` are still shared after loading.
+
+Element encoding:
+
+    (COMMAND, (name_index, ...), default)
+    (CHOICE, (name_index, ...))    # in the order of `choices`
+    (ARGUMENT, (name_index, ...), default)
+    (OPTION, option_index)
+    (REQUIRED, repeat, (element, ...))
+    (OPTIONAL, repeat, (element, ...))
+
+Option table entry: ((name_index, ...), default, ref_index or -1)
+
+The payload ends with the `Automaton` of the simple usages, as
+(config, plans), see `docpie.automaton`.
+"""
+
+import sys
+import struct
+import marshal
+
+from docpie.element import Command, Choice, Argument, Option
+from docpie.element import Required, Optional
+from docpie.automaton import Automaton
+
+__all__ = ['dumps', 'loads']
+
+MAGIC = b'DOCPIE'
+# bump it when the layout changes
+FORMAT_VERSION = 3
+_header = struct.Struct('>6sH')
+# marshal version 2 is supported by all the python docpie supports
+_marshal_version = 2
+
+COMMAND, ARGUMENT, OPTION, REQUIRED, OPTIONAL, CHOICE = range(6)
+
+try:
+    _intern = sys.intern
+except AttributeError:    # python 2
+    def _intern(string):
+        try:
+            return intern(string)
+        except TypeError:    # unicode
+            return string
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        self.strings = []
+        self.string_index = {}
+        self.options = []
+        self.option_index = {}    # id(option): index
+        self.refs = []
+        self.ref_index = {}    # id(ref): index
+        # keep the objects alive so the ids are not reused
+        self.seen = []
+
+    def string(self, value):
+        index = self.string_index.get(value)
+        if index is None:
+            index = self.string_index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def names(self, names):
+        return tuple(self.string(x) for x in sorted(names))
+
+    def option(self, option):
+        index = self.option_index.get(id(option))
+        if index is not None:
+            return index
+
+        ref = option.ref
+        if ref is None:
+            ref_index = -1
+        else:
+            ref_index = self.ref_index.get(id(ref))
+            if ref_index is None:
+                encoded = self.element(ref)
+                ref_index = self.ref_index[id(ref)] = len(self.refs)
+                self.refs.append(encoded)
+                self.seen.append(ref)
+
+        index = self.option_index[id(option)] = len(self.options)
+        self.options.append(
+            (self.names(option.names), option.default, ref_index))
+        self.seen.append(option)
+        return index
+
+    def element(self, element):
+        if isinstance(element, Option):
+            return (OPTION, self.option(element))
+        elif isinstance(element, Choice):
+            return (CHOICE, tuple(self.string(x) for x in element.choices))
+        elif isinstance(element, Command):
+            return (COMMAND, self.names(element.names), element.default)
+        elif isinstance(element, Argument):
+            return (ARGUMENT, self.names(element.names), element.default)
+        elif isinstance(element, (Required, Optional)):
+            return (REQUIRED if isinstance(element, Required) else OPTIONAL,
+                    element.repeat,
+                    tuple(self.element(x) for x in element))
+        raise ValueError('can not dump %r' % element)
+
+
+class _Decoder(object):
+
+    def __init__(self, strings, options, refs):
+        self.strings = strings
+        self.option_table = options
+        self.ref_table = refs
+        self.options = [None] * len(options)
+        self.refs = [None] * len(refs)
+
+    def names(self, indexes):
+        strings = self.strings
+        return [strings[x] for x in indexes]
+
+    def option(self, index):
+        option = self.options[index]
+        if option is None:
+            names, default, ref_index = self.option_table[index]
+            if ref_index == -1:
+                ref = None
+            else:
+                ref = self.refs[ref_index]
+                if ref is None:
+                    ref = self.refs[ref_index] = self.element(
+                        self.ref_table[ref_index])
+            option = self.options[index] = Option(
+                *self.names(names), **{'default': default, 'ref': ref})
+        return option
+
+    def element(self, encoded):
+        kind = encoded[0]
+        if kind == OPTION:
+            return self.option(encoded[1])
+        elif kind == COMMAND:
+            return Command(*self.names(encoded[1]),
+                           **{'default': encoded[2]})
+        elif kind == ARGUMENT:
+            return Argument(*self.names(encoded[1]),
+                            **{'default': encoded[2]})
+        elif kind == CHOICE:
+            return Choice(*self.names(encoded[1]))
+        cls = Required if kind == REQUIRED else Optional
+        element = self.element
+        return cls(*[element(x) for x in encoded[2]],
+                   **{'repeat': encoded[1]})
+
+
+def dumps(pie):
+    """Return the compiled `pie` as bytes"""
+    encoder = _Encoder()
+    config = (
+        pie.stdopt, pie.attachopt, pie.attachvalue, pie.auto2dashes,
+        pie.case_sensitive, pie.namedoptions, pie.appeared_only,
+        pie.options_first, pie.option_name, pie.usage_name, pie.name,
+        pie.help, pie.version, pie.helpstyle,
+    )
+    text = (pie.doc, pie.usage_text,
+            tuple(pie.option_sections.items()))
+    sections = tuple(
+        (title, tuple(encoder.element(x) for x in options))
+        for title, options in pie.options.items())
+    usages = tuple(encoder.element(x) for x in pie.usages)
+    opt_names = tuple(encoder.names(x) for x in pie.opt_names)
+    max_args = tuple((encoder.string(name), num) for name, num in
+                     pie.opt_names_required_max_args.items())
+
+    automaton = pie._usage_automaton()
+
+    payload = (tuple(encoder.strings), config, text,
+               tuple(encoder.refs), tuple(encoder.options),
+               sections, usages, opt_names, max_args,
+               (pie._automaton_config(), automaton.to_data()))
+    try:
+        body = marshal.dumps(payload, _marshal_version)
+    except ValueError:
+        raise ValueError('the config of %r can not be dumped, '
+                         'e.g. `version` is not a str' % pie)
+    return _header.pack(MAGIC, FORMAT_VERSION) + body
+
+
+def loads(data, cls):
+    """Return a `cls` instance from the bytes generated by `dumps`"""
+    if len(data) < _header.size:
+        raise ValueError('Not a docpie data')
+    magic, version = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a docpie data')
+    if version != FORMAT_VERSION:
+        raise ValueError('Not support docpie data format %s' % version)
+
+    (strings, config, text, refs, option_table,
+     sections, usages, opt_names, max_args,
+     (automaton_config, plans)) = marshal.loads(data[_header.size:])
+    strings = [_intern(x) for x in strings]
+
+    (stdopt, attachopt, attachvalue, auto2dashes, case_sensitive,
+     namedoptions, appearedonly, optionsfirst, option_name, usage_name,
+     name, help, version, helpstyle) = config
+
+    self = cls(None, stdopt=stdopt, attachopt=attachopt,
+               attachvalue=attachvalue, auto2dashes=auto2dashes,
+               case_sensitive=case_sensitive, namedoptions=namedoptions,
+               appearedonly=appearedonly, optionsfirst=optionsfirst,
+               name=name, helpstyle=helpstyle)
+    self.option_name = option_name
+    self.usage_name = usage_name
+
+    self.doc, self.usage_text, option_sections = text
+    self.option_sections = dict(option_sections)
+
+    decoder = _Decoder(strings, option_table, refs)
+    element = decoder.element
+    self.options = dict(
+        (title, [element(x) for x in options])
+        for title, options in sections)
+    self.usages = [element(x) for x in usages]
+    self.opt_names = [set(decoder.names(x)) for x in opt_names]
+    self.opt_names_required_max_args = dict(
+        (strings[index], num) for index, num in max_args)
+
+    if automaton_config == self._automaton_config():
+        self._set_automaton(Automaton.from_data(plans))
+
+    self.set_config(help=help, version=version)
+    return self
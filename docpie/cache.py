@@ -0,0 +1,231 @@
+"""
+Caches of the compiled part of a `Docpie` instance.
+
+`SpecCache` keeps compiled specs in memory for the `docpie` function.
+
+The on-disk cache stores the compiled usages/options as the plain data
+produced by `Docpie._dump_compiled` (the same data `Docpie.to_dict` uses),
+pickled instead of JSONlized. Each entry is keyed by a hash of the `doc`,
+the config and the docpie version, so changing any of them simply misses
+the cache.
+
+Unpickling runs code, so the cache directory is created private to the
+user, and a file that someone else could have written is never loaded.
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+from docpie.lazy import get_logger
+
+__all__ = ['spec_key', 'load', 'dump', 'SpecCache', 'CacheInfo']
+
+logger = get_logger('docpie.cache')
+
+# bump it when the layout of the cached data changes
+_format = 2
+
+
+def spec_key(pie):
+    """Return a hex digest identifying the compiled spec of `pie`"""
+    config = (
+        ('stdopt', pie.stdopt),
+        ('attachopt', pie.attachopt),
+        ('attachvalue', pie.attachvalue),
+        ('auto2dashes', pie.auto2dashes),
+        ('name', pie.name),
+        ('case_sensitive', pie.case_sensitive),
+        ('optionsfirst', pie.options_first),
+        ('appearedonly', pie.appeared_only),
+        ('namedoptions', pie.namedoptions),
+        ('help', pie.help),
+        ('version', pie.version),
+        ('option_name', pie.option_name),
+        ('usage_name', pie.usage_name),
+    )
+    source = '\0'.join((
+        str(_format),
+        pie._version,
+        repr(config),
+        pie.doc,
+    ))
+    import hashlib
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+# only the on-disk cache needs them, don't slow down `import docpie`
+def _pickle():
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    return pickle
+
+
+def _path(cache_dir, key):
+    return os.path.join(cache_dir, 'docpie-%s.pickle' % key)
+
+
+def _trusted(f):
+    """Whether the opened cache file `f` can only be written by us"""
+    if not hasattr(os, 'getuid'):    # windows, no owner/mode to check
+        return True
+    stat = os.fstat(f.fileno())
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def load(cache_dir, key):
+    """Return the cached data of `key`, or None if it's not cached.
+
+    A file not owned by the current user, or writable by group/others, is
+    refused (treated as not cached) because unpickling it can run any
+    code."""
+    path = _path(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            if not _trusted(f):
+                logger.warning('refuse to load untrusted cache %s', path)
+                return None
+            stored = _pickle().load(f)
+    except (IOError, OSError):
+        logger.debug('%s not cached', key)
+        return None
+    # truncated/corrupted/foreign file, just treat as a miss
+    except Exception as e:
+        logger.debug('failed to load cache %s: %r', path, e)
+        return None
+
+    if not isinstance(stored, dict) or stored.get('key') != key:
+        logger.debug('%s is not a valid cache of %s', path, key)
+        return None
+
+    logger.debug('load %s from %s', key, path)
+    return stored['data']
+
+
+def dump(cache_dir, key, data):
+    """Save `data` as `key` in `cache_dir`.
+
+    `cache_dir` is created with mode 0700 if it doesn't exist. The file is
+    written to a temporary file then renamed, so other processes never see
+    a half-written cache. Any error is logged and ignored: a cache that can
+    not be written should never break the program."""
+    try:
+        os.makedirs(cache_dir, 0o700)
+    except OSError:    # exists, or will fail below anyway
+        pass
+
+    import tempfile
+    pickle = _pickle()
+    stored = {'key': key, 'data': data}
+    try:
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.docpie-', suffix='.tmp', dir=cache_dir)
+    except (IOError, OSError) as e:
+        logger.debug('can not write cache in %s: %r', cache_dir, e)
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(stored, f, pickle.HIGHEST_PROTOCOL)
+        _replace(temp_path, _path(cache_dir, key))
+    except (IOError, OSError) as e:
+        logger.debug('can not write cache %s: %r', key, e)
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        return False
+
+    logger.debug('cache %s in %s', key, cache_dir)
+    return True
+
+
+try:
+    _replace = os.replace
+except AttributeError:    # python < 3.3
+    def _replace(src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # windows can not rename to an existing file. Someone else
+            # has written the same cache, so just drop ours.
+            if not os.path.exists(dst):
+                raise
+            os.unlink(src)
+
+
+CacheInfo = namedtuple('CacheInfo',
+                       ('hits', 'misses', 'evictions', 'maxsize', 'currsize'))
+
+
+class SpecCache(object):
+    """A bounded least-recently-used mapping of key -> compiled `Docpie`
+
+    The `docpie` function use it to avoid parsing the same `doc` again.
+    Set `maxsize` to 0 to disable caching."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key: link. A link is [prev, next, key, spec] in a circular list
+        # starting from `_root`, the least recently used first
+        self._data = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self.hits = self.misses = self.evictions = 0
+
+    def _unlink(self, link):
+        prev, next_ = link[0], link[1]
+        prev[1] = next_
+        next_[0] = prev
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0], link[1] = last, root
+        last[1] = root[0] = link
+
+    def get(self, key):
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+
+    def put(self, key, spec):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            data = self._data
+            link = data.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[3] = spec
+            else:
+                while len(data) >= self.maxsize:
+                    oldest = self._root[1]
+                    self._unlink(oldest)
+                    del data[oldest[2]]
+                    logger.debug('evict compiled spec %r', oldest[2])
+                    self.evictions += 1
+                link = [None, None, key, spec]
+                data[key] = link
+            self._append(link)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             self.maxsize, len(self._data))
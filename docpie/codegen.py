@@ -0,0 +1,181 @@
+"""
+Generate a plain Python module from a compiled `Docpie`.
+
+The generated module matches the simple usages with straight-line code,
+and falls back to the `Docpie` interpreter (built from the embedded
+`Docpie.to_dict` data) for everything else, so the result is always the
+same as `Docpie.docpie`.
+
+A usage is "simple" when it is a sequence of commands and arguments,
+optionally ending with one repeated argument (`<name>...`), plus groups of
+options. It's only tried when `argv` has no option (nothing starts with
+`-`), and only the usages before the first non-simple one are specialized,
+so the usages are still tried in order. The usages are planned by
+`docpie.automaton`, which matches them the same way inside `Docpie`.
+"""
+
+import ast
+import pprint
+
+try:
+    from io import StringIO
+except ImportError:
+    try:
+        from StringIO import cStringIO as StringIO
+    except ImportError:
+        from StringIO import StringIO
+
+__all__ = ['compile_to_module']
+
+_inf = float('inf')
+
+
+class _Literal(object):
+    """Written by `pprint` as `source`"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def __repr__(self):
+        return self.source
+
+
+def _literal_inf(data):
+    """Return `data` with the infinity (e.g. the max args of
+    `--retry=<n>...`) replaced, because `pprint` writes it as `inf`,
+    which is not a literal. `1e999` overflows back to infinity"""
+    if isinstance(data, float) and data in (_inf, -_inf):
+        return _Literal('1e999' if data > 0 else '-1e999')
+    if isinstance(data, dict):
+        return dict((key, _literal_inf(value))
+                    for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return type(data)(_literal_inf(value) for value in data)
+    return data
+
+
+def _source(entry, num):
+    """Return the source of a template entry, see `docpie.automaton`"""
+    kind = entry[0]
+    if kind == 'token':
+        return 'argv[%s]' % entry[1]
+    if kind == 'list':
+        return '[argv[%s]]' % entry[1]
+    if kind == 'tail':
+        return 'argv[%s:]' % num
+    if kind == 'is':
+        return 'argv[%s] == %r' % (entry[1], entry[2])
+    return repr(entry[1])
+
+
+def write_header(pie, stream):
+    from docpie import __version__
+    stream.write(
+        '# -*- coding: utf-8 -*-\n'
+        '# Generated by docpie %s. Do not edit.\n'
+        '#\n'
+        '# `docpie(argv=None)` returns the same dict as\n'
+        '# `Docpie(doc).docpie(argv)`. `get_pie()` returns the `Docpie`\n'
+        '# instance used when the generated code can not handle `argv`,\n'
+        '# e.g. to `set_auto_handler` on it.\n\n'
+        'import sys\n\n'
+        "__all__ = ['docpie', 'get_pie']\n\n"
+        'try:\n'
+        '    StrType = basestring\n'
+        'except NameError:\n'
+        '    StrType = str\n\n' % __version__)
+
+
+def write_spec(pie, stream):
+    spec = pie.to_dict()
+    source = pprint.pformat(_literal_inf(spec))
+    try:
+        same = (ast.literal_eval(source) == spec)
+    except (ValueError, SyntaxError):
+        same = False
+    if not same:
+        raise ValueError('the config of %r can not be written as literal, '
+                         'e.g. `version` is not a str' % pie)
+
+    stream.write('_spec = %s\n\n' % source)
+    stream.write('_helpstyle = %r\n\n' % pie.helpstyle)
+    stream.write(
+        '_pie = None\n\n\n'
+        'def get_pie():\n'
+        '    global _pie\n'
+        '    if _pie is None:\n'
+        '        from docpie import Docpie\n'
+        '        _pie = Docpie.from_dict(_spec)\n'
+        '        _pie.helpstyle = _helpstyle\n'
+        '    return _pie\n\n\n')
+
+
+def write_usage_method(index, usage, tests, tail, template, stream):
+    num = len(tests)
+    checks = ['len(argv) %s %s' % ('<=' if tail else '!=', num)]
+    for pos, names in enumerate(tests):
+        if names is None:
+            continue
+        if len(names) == 1:
+            checks.append('argv[%s] != %r' % (pos, names[0]))
+        else:
+            checks.append('argv[%s] not in %r' % (pos, tuple(names)))
+
+    stream.write('# %s\n' % usage)
+    stream.write('def _match_%s(argv):\n' % index)
+    stream.write('    if (%s):\n' % (' or\n            '.join(checks)))
+    stream.write('        return None\n')
+    stream.write('    return {\n')
+    for key in sorted(template):
+        stream.write('        %r: %s,\n' % (key, _source(template[key], num)))
+    stream.write('    }\n\n\n')
+
+
+def write_main(indexes, stream):
+    stream.write('_matchers = (%s%s)\n\n\n' % (
+        ', '.join('_match_%s' % x for x in indexes),
+        ',' if len(indexes) == 1 else ''))
+    stream.write(
+        'def docpie(argv=None):\n'
+        '    if argv is None:\n'
+        '        argv = sys.argv\n'
+        '    elif isinstance(argv, StrType):\n'
+        '        argv = argv.split()\n\n'
+        '    rest = argv[1:]\n'
+        '    for each in rest:\n'
+        "        if each.startswith('-'):\n"
+        '            break\n'
+        '    else:\n'
+        '        for matcher in _matchers:\n'
+        '            result = matcher(rest)\n'
+        '            if result is not None:\n'
+        '                return result\n\n'
+        '    return get_pie().docpie(argv)\n')
+
+
+def compile_to_module(pie, stream=None):
+    """Generate the source of a module parsing argv like `pie.docpie`.
+
+    Write it into `stream` if given, otherwise return it as a str.
+    `extra` is not kept because a function can not be written into the
+    module. Set it on `get_pie()` of the generated module instead.
+    """
+    if stream is None:
+        the_stream = StringIO()
+    else:
+        the_stream = stream
+
+    write_header(pie, the_stream)
+    write_spec(pie, the_stream)
+
+    indexes = []
+    for index, tests, tail, template in pie._usage_automaton().plans:
+        write_usage_method(index, pie.usages[index], tests, tail, template,
+                           the_stream)
+        indexes.append(index)
+
+    write_main(indexes, the_stream)
+
+    if stream is None:
+        the_stream.seek(0)
+        return the_stream.read()
@@ -1,6 +1,6 @@
 import logging
 import warnings
-from docpie.element import Unit, Option, Required
+from docpie.element import Unit, Option, Command, Required
 try:
     from io import StringIO
 except ImportError:
@@ -233,9 +233,15 @@ def extract(unit, repeat=False, required=False):
             else:
                 min_arg_count = max_arg_count = 0
 
+            # `Choice` completes as any of its commands
+            if isinstance(each, Command):
+                type_name = 'Command'
+            else:
+                type_name = each.__class__.__name__
+
             for name in each.names:
                 result.append(Element(name,
-                              type=each.__class__.__name__,
+                              type=type_name,
                               repeat=repeat or each.repeat,
                               min_arg_count=min_arg_count,
                               max_arg_count=max_arg_count))
@@ -0,0 +1,243 @@
+"""
+An index of the usages by the commands and options they require, so
+`Docpie._match` only tries (clones argv, matches and resets) the usages
+which may match.
+
+A usage requires the commands and options which are not inside `[...]`,
+and one name of a `Choice`. The usages are still tried in order. A usage
+missing a required one is skipped only when it can't raise an error
+either, i.e. none of its options which may raise is found in argv.
+
+A usage is skipped for the same reason when argv has too many or too few
+commands/arguments for it, or has an option it can't take. The range of
+commands/arguments is counted from the usage, and argv has the tokens not
+looking like an option, less the ones the options may take as arguments.
+"""
+
+from docpie.element import Unit, Optional, Option, Command, Argument
+from docpie.element import Atom, Either, OptionsShortcut
+
+__all__ = ['UsageIndex']
+
+
+def _walk(element, required, commands, options, required_options):
+    for each in element:
+        if isinstance(each, Unit):
+            _walk(each, required and not isinstance(each, Optional),
+                  commands, options, required_options)
+        elif isinstance(each, Either):
+            _walk(each, False, commands, options, required_options)
+        elif isinstance(each, OptionsShortcut):
+            _walk(each.options, False, commands, options, required_options)
+        elif isinstance(each, Option):
+            for name in each.names:
+                options[name] = options.get(name) or each.ref is not None
+            if required:
+                required_options.append(frozenset(each.names))
+        # `--` can be skipped to match the next one, and `-`/`--` can be
+        # inserted back to argv by the options
+        elif (required and isinstance(each, Command) and
+                not each.names.intersection(('-', '--'))):
+            commands.append(frozenset(each.names))
+
+
+def _positional(element, names):
+    """Return (min, max) commands/arguments `element` takes from argv,
+    with their names added to `names`"""
+    if isinstance(element, (Option, OptionsShortcut)):
+        return 0, 0
+    if isinstance(element, (Command, Argument)):
+        names.extend(element.names)
+        return 1, 1
+    ranges = [_positional(x, names) for x in element]
+    if isinstance(element, Either):
+        return (min(x[0] for x in ranges) if ranges else 0,
+                max(x[1] for x in ranges) if ranges else 0)
+    least = sum(x[0] for x in ranges)
+    most = sum(x[1] for x in ranges)
+    if isinstance(element, Optional):
+        least = 0
+    if element.repeat and most:
+        most = float('inf')
+    return least, most
+
+
+def _feasible(usage):
+    """Return (min, max) commands/arguments of `usage`, the most tokens
+    each option of it may take as arguments, and the option names it
+    takes (None for any)"""
+    names = []
+    least, most = _positional(usage, names)
+    if len(names) != len(set(names)):
+        # `prog <a> <a>`, the second one takes nothing as matched
+        least = 0
+    if set(names).intersection(('-', '--')):
+        return 0, float('inf'), 0, None
+
+    args = 0
+    options = []
+    _options(usage, options)
+    for each in options:
+        if each.ref is not None:
+            args = max([args] + each.ref.arg_range())
+    return (least, most, args,
+            frozenset(name for each in options for name in each.names))
+
+
+def _options(element, result):
+    for each in element:
+        if isinstance(each, Option):
+            result.append(each)
+        elif isinstance(each, OptionsShortcut):
+            _options(each.options, result)
+        elif isinstance(each, (Unit, Either)):
+            _options(each, result)
+
+
+class ArgvSummary(object):
+    """What `UsageIndex.feasible` checks of an argv, found in one pass.
+
+    `positional` is the tokens which are commands/arguments, plus
+    `loose` of the ones which may also be (e.g. `-x.txt`). `matches` is
+    the most times the options may match, each may take the arguments.
+    `flags` has the names each option of argv may be (its prefixes). It's
+    None if argv has `--`, or `-` in a short option, which change the
+    counting.
+    """
+
+    def __init__(self, argv):
+        self.positional = 0
+        self.loose = 0
+        self.matches = 0
+        self.flags = set()
+        prefixes = argv._option_names().prefixes
+        for each in argv:
+            if each == '-' or not each.startswith('-'):
+                self.positional += 1
+            elif each == '--' or (each[1] != '-' and '-' in each[2:]):
+                self.flags = None
+                return
+            elif each.startswith('--'):
+                self.matches += 1
+                option = each.partition('=')[0]
+                if Atom.get_class(option)[0] is Option:
+                    self.flags.add(prefixes(option))
+                else:
+                    self.loose += 1
+            else:
+                self.matches += len(each) - 1
+                if Atom.get_class(each)[0] is Option:
+                    self.flags.add(prefixes(each))
+                else:
+                    self.loose += 1
+
+
+class UsageIndex(object):
+
+    def __init__(self, usages):
+        self.usages = usages
+        # the required commands and options of each usage,
+        # [((names, ...), (names, ...))]
+        self.required = []
+        # the usages requiring nothing
+        self.always = []
+        # {name: [index]} of the first required command
+        self.by_command = {}
+        # {name: [index]} of the first required option, if no command
+        self.by_required_option = {}
+        # {option name: [index]}
+        self.by_option = {}
+        # {option name: has ref}
+        self.option_ref = {}
+        # [(min, max commands/arguments, most arguments of an option,
+        #   option names or None)]
+        self.feasibility = []
+
+        for index, usage in enumerate(usages):
+            commands = []
+            options = {}
+            required_options = []
+            _walk(usage, not isinstance(usage, Optional),
+                  commands, options, required_options)
+            self.feasibility.append(_feasible(usage))
+            self.required.append((tuple(commands), tuple(required_options)))
+            if commands:
+                for name in commands[0]:
+                    self.by_command.setdefault(name, []).append(index)
+            elif required_options:
+                for name in required_options[0]:
+                    self.by_required_option.setdefault(name, []).append(index)
+            else:
+                self.always.append(index)
+            for name, has_ref in options.items():
+                self.by_option.setdefault(name, []).append(index)
+                self.option_ref[name] = self.option_ref.get(name) or has_ref
+
+    def candidates(self, argv):
+        """Return the indexes of the usages to try for `argv` (an `Argv`),
+        in order"""
+        tokens = set(argv)
+        found, raising = self.find_options(argv)
+
+        indexes = set(self.always)
+        for name in tokens.intersection(self.by_command):
+            indexes.update(self.by_command[name])
+        for name in found.intersection(self.by_required_option):
+            indexes.update(self.by_required_option[name])
+
+        required = self.required
+        result = set(
+            index for index in indexes
+            if all(not tokens.isdisjoint(x) for x in required[index][0]) and
+            all(not found.isdisjoint(x) for x in required[index][1]))
+        if result:
+            summary = ArgvSummary(argv)
+            if summary.flags is not None:
+                result = set(x for x in result
+                             if self.feasible(x, summary, argv))
+        for name in raising:
+            result.update(self.by_option[name])
+        return sorted(result)
+
+    def feasible(self, index, summary, argv):
+        """Whether the usage of `index` may take argv of `summary` (an
+        `ArgvSummary`)"""
+        least, most, args, options = self.feasibility[index]
+        if summary.positional + summary.loose < least:
+            return False
+        taken = summary.matches and summary.matches * args
+        if summary.positional - taken > most:
+            return False
+        if options is None:
+            return True
+        known = argv._option_names()
+        if not all(x in known for x in options):
+            return True
+        return all(not options.isdisjoint(x) for x in summary.flags)
+
+    def find_options(self, argv):
+        """Return the option names which may be found in `argv`, and the
+        ones of them which may raise an error when matched"""
+        found = set()
+        raising = set()
+        flags = [x for x in argv if x.startswith('-') and x not in ('-', '--')]
+        if not flags:
+            return found, raising
+
+        stdopt = argv.stdopt
+        for name, has_ref in self.option_ref.items():
+            for flag in flags:
+                if flag == name:
+                    found.add(name)
+                    # it's fine unless the arguments mismatch
+                    if has_ref:
+                        raising.add(name)
+                        break
+                elif (flag.startswith(name) or
+                        # `-abc` -> `-a -bc` -> `-b -c`
+                        (stdopt and len(name) == 2 and name[1] != '-' and
+                         not flag.startswith('--') and name[1] in flag[2:])):
+                    found.add(name)
+                    raising.add(name)
+                    break
+        return found, raising
@@ -1,5 +1,7 @@
-import logging
-import re
+try:
+    from copyreg import __newobj__
+except ImportError:    # python 2
+    from copy_reg import __newobj__
 from docpie.error import ExceptNoArgumentExit,\
                          ExpectArgumentExit, ExpectArgumentHitDoubleDashesExit
 try:
@@ -16,13 +18,14 @@ except ImportError:
         for prod in result:
             yield tuple(prod)
 
-__all__ = ('Atom', 'Command', 'Argument', 'Option',
+__all__ = ('Atom', 'Command', 'Choice', 'Argument', 'Option',
            'Unit', 'Required', 'Optional', 'OptionsShortcut', 'Either',
            'convert_2_dict', 'convert_2_object')
 
 from docpie.tokens import Argv
+from docpie.lazy import regex, get_logger
 
-logger = logging.getLogger('docpie.element')
+logger = get_logger('docpie.element')
 
 try:
     StrType = basestring
@@ -33,10 +36,14 @@ NoneType = type(None)
 
 class Atom(object):
 
-    flag_or_upper_re = re.compile(r'^(?P<hyphen>-{0,2})'
-                                  r'($|[\da-zA-Z_][\da-zA-Z_\-]*$)')
-    angular_bracket_re = re.compile(r'^<.*?>$')
-    options_re = re.compile('\[(?P<title>[^\s\]]*)options\]', re.IGNORECASE)
+    flag_or_upper_re = regex(r'^(?P<hyphen>-{0,2})'
+                             r'($|[\da-zA-Z_][\da-zA-Z_\-]*$)')
+    angular_bracket_re = regex(r'^<.*?>$')
+    options_re = regex(r'(?i)\[(?P<title>[^\s\]]*)options\]')
+
+    # initial state, see `__reduce__`
+    default = None
+    value = None
 
     def __init__(self, *names, **kwargs):
         self.names = set(names)
@@ -115,12 +122,14 @@ class Atom(object):
     def convert_2_object(cls, dic, options, namedoptions):
         names = dic['names']
         cls_name = dic['__class__']
-        assert cls_name in ('Option', 'Command', 'Argument')
+        assert cls_name in ('Option', 'Command', 'Choice', 'Argument')
         if cls_name == 'Option':
             # raise NotImplementedError('call Option.convert_2_object instead')
             return Option.convert_2_object(dic, options, namedoptions)
         elif cls_name == 'Command':
             cls = Command
+        elif cls_name == 'Choice':
+            cls = Choice
         elif cls_name == 'Argument':
             cls = Argument
         default = dic['default']
@@ -131,6 +140,14 @@ class Atom(object):
     def copy(self):
         return self.__class__(*self.names)
 
+    def __reduce__(self):
+        # only the compiled spec. The matching value is left to the class
+        # attribute, so is `default`/`ref` if it's None
+        state = {'names': self.names}
+        if self.default is not None:
+            state['default'] = self.default
+        return (__newobj__, (self.__class__,), state)
+
     def __str__(self):
         return '/'.join(self.names)
 
@@ -146,7 +163,8 @@ class Atom(object):
 
 
 class Option(Atom):
-    long_re = re.compile(r'(?P<name>--[0-9a-zA-Z]*)(?P<eq>=?)(?P<value>.*)')
+    long_re = regex(r'(?P<name>--[0-9a-zA-Z]*)(?P<eq>=?)(?P<value>.*)')
+    ref = None
 
     def __init__(self, *names, **kwargs):
         # assert all(x.startswith('-') for x in names)
@@ -251,6 +269,10 @@ class Option(Atom):
             logger.debug('no argv left')
             return False
 
+        if not argv.has_option(self.names):
+            logger.debug('not found matching %s in %s', self, argv)
+            return False
+
         # self_value = self.dump_value()
         argv_value = argv.dump_value()
         # saver.save(self, argv)
@@ -308,17 +330,19 @@ class Option(Atom):
                 option=self.names
             )
 
-        to_match_ref_argv = argv.clone()
         if attached_value is None:
             # --force=[<val>] <arg>
             # --force -- value
             if argv.current(index) == '--' and argv.auto_dashes:
-                del to_match_ref_argv[:]
+                to_match_ref_argv = argv.take(index, 0)
             else:
-                to_match_ref_argv[:] = argv[index:]
-                del argv[index:]
+                # the ref can't take more than these
+                most = max(self.ref.arg_range())
+                to_match_ref_argv = argv.take(
+                    index, None if most == float('inf') else most)
         else:
-            to_match_ref_argv[:] = [attached_value]
+            to_match_ref_argv = argv.take(0, 0)
+            to_match_ref_argv.append(attached_value)
 
         to_match_ref_argv.auto_dashes = False
         result = self.ref.match(to_match_ref_argv, repeat_match)
@@ -345,7 +369,7 @@ class Option(Atom):
             # return False
         # merge argv
         if attached_value is None:
-            argv.extend(to_match_ref_argv)
+            argv.put(index, to_match_ref_argv)
         logger.debug('%s matched %s / %s', self, self.value, argv)
         return True
 
@@ -395,6 +419,13 @@ class Option(Atom):
     def copy(self):
         return self.__class__(*self.names, **{'ref': self.ref})
 
+    def __reduce__(self):
+        func, args, state = super(Option, self).__reduce__()
+        # `ref` is pickled once if it's shared
+        if self.ref is not None:
+            state['ref'] = self.ref
+        return func, args, state
+
     @classmethod
     def convert_2_dict(cls, obj):
         ref = obj.ref
@@ -438,6 +469,7 @@ class Option(Atom):
 
 
 class Command(Atom):
+    value = False
 
     def __init__(self, *names, **kwargs):
         # assert all(self.type(x) == self.COMMAND for x in names)
@@ -445,12 +477,8 @@ class Command(Atom):
         self.value = False
 
     def reset(self):
-        value = self.value
-        if isinstance(value, bool):
-            self.value = False
-        else:
-            self.value = 0
-        # self.value = False
+        # back to the value before matched, even if it's counted
+        self.value = False
 
     def match(self, argv, repeat_match):
 
@@ -528,6 +556,67 @@ class Command(Atom):
         return self.value
 
 
+class Choice(Command):
+    '''
+    `(a | b | c)` or `[a | b | c]` of single commands, which matches one of
+    them. The usage keeps it instead of being expanded to one for each
+    command, see `UsageParser.fold_choice`. `choices` keeps the order of
+    the names.
+    '''
+    # the name matched
+    choice = None
+
+    def __init__(self, *names, **kwargs):
+        super(Choice, self).__init__(*names, **kwargs)
+        self.choices = names
+        self.choice = None
+
+    def reset(self):
+        super(Choice, self).reset()
+        self.choice = None
+
+    def match(self, argv, repeat_match):
+        current = argv.current()
+        if current == '--':
+            current = argv.current(1)
+        matched = super(Choice, self).match(argv, repeat_match)
+        if matched and self.choice is None:
+            self.choice = current
+        return matched
+
+    def dump_value(self):
+        return self.value, self.choice
+
+    def load_value(self, value):
+        self.value, self.choice = value
+
+    def get_value(self, appeared_only, in_repeat):
+        result = {}
+        for name in self.choices:
+            result[name] = bool(self.value) and name == self.choice
+        return result
+
+    @classmethod
+    def convert_2_dict(cls, obj):
+        result = super(Choice, cls).convert_2_dict(obj)
+        result['names'] = obj.choices
+        return result
+
+    def copy(self):
+        return self.__class__(*self.choices)
+
+    def __reduce__(self):
+        func, args, state = super(Choice, self).__reduce__()
+        state['choices'] = self.choices
+        return func, args, state
+
+    def __str__(self):
+        return ' | '.join(self.choices)
+
+    def __repr__(self):
+        return 'Choice(%s)' % ', '.join(self.choices)
+
+
 class Argument(Atom):
 
     def __init__(self, *names, **kwargs):
@@ -535,10 +624,9 @@ class Argument(Atom):
         self.value = None
 
     def reset(self):
-        if isinstance(self.value, list):
-            del self.value[:]
-        else:
-            self.value = None
+        # back to the value before matched. Don't clear the list in place,
+        # it may have been returned as result
+        self.value = None
 
     def dump_value(self):
         value = self.value
@@ -667,6 +755,7 @@ class Argument(Atom):
 
 
 class Unit(list):
+    repeat = False
 
     def __init__(self, *atoms, **kwargs):
         super(Unit, self).__init__(atoms)
@@ -676,6 +765,11 @@ class Unit(list):
         for each in self:
             each.reset()
 
+    def match(self, argv, repeat_match):
+        if argv.memo is None:
+            return self.match_unit(argv, repeat_match)
+        return argv.memo.match(self, argv, repeat_match)
+
     def get_value(self, appeared_only, in_repeat):
         result = {}
         for each in self:
@@ -1210,10 +1304,71 @@ class Unit(list):
     def matched(self):
         return all(x.matched() for x in self)
 
+    def find_choices(self):
+        '''The `Choice` of a folded usage, see `UsageParser.fold_choice`'''
+        return [each for each, _ in self._find_choices()]
+
+    def _find_choices(self):
+        '''Yield (`Choice`, whether it's in `[...]`)'''
+        for each in self:
+            optional = False
+            if isinstance(each, Unit) and len(each) == 1:
+                optional = isinstance(each, Optional)
+                each = each[0]
+            if isinstance(each, Choice):
+                yield each, optional
+
+    def ambiguous_choices(self, names):
+        '''
+        The `Choice` of a folded usage which may match differently from the
+        expanded usages when argv has `names`: `(a | b)` with more than one
+        of its names in `names`, or `[a | b]` with any. For the others only
+        one expanded usage can match, or they all match the same way.
+        '''
+        return [each for each, optional in self._find_choices()
+                if len(names.intersection(each.names)) > (0 if optional
+                                                          else 1)]
+
+    def pick_choices(self, choices):
+        '''
+        Yield a copy of `self` for each combination of the `choices` in it,
+        with `Command` instead of `Choice`. They are in the order
+        `expand` would have returned them without folding. The other
+        `Choice` are kept.
+        '''
+        for names in product(*(x.choices for x in choices)):
+            yield self._pick(dict(zip(map(id, choices), names)))
+
+    def _pick(self, picked):
+        atoms = []
+        for each in self:
+            if isinstance(each, Unit):
+                atoms.append(each._pick(picked))
+            elif id(each) in picked:
+                atoms.append(Command(picked[id(each)]))
+            else:
+                atoms.append(each.copy())
+        return self.__class__(*atoms, **{'repeat': self.repeat})
+
+    def load_picked(self, picked):
+        '''Take the matched value of a copy from `pick_choices`'''
+        for each, other in zip(self, picked):
+            if isinstance(each, Unit):
+                each.load_picked(other)
+            elif isinstance(each, Choice) and not isinstance(other, Choice):
+                name, = other.names
+                each.load_value((other.value, name if other.value else None))
+            else:
+                each.load_value(other.dump_value())
+
     def copy(self):
         return self.__class__(*(x.copy() for x in self),
                               **{'repeat': self.repeat})
 
+    def __reduce__(self):
+        state = {'repeat': True} if self.repeat else None
+        return (__newobj__, (self.__class__,), state, iter(self))
+
     @classmethod
     def convert_2_dict(cls, obj):
         return {
@@ -1254,7 +1409,7 @@ class Unit(list):
 
 class Required(Unit):
 
-    def match(self, argv, repeat_match):
+    def match_unit(self, argv, repeat_match):
 
         if not (repeat_match or self.repeat):
             logger.debug('try to match %s once, %s', self, argv)
@@ -1309,7 +1464,7 @@ class Optional(Unit):
         self._match_oneline(argv)
         return True
 
-    def match(self, argv, repeat_match):
+    def match_unit(self, argv, repeat_match):
         repeat = repeat_match or self.repeat
         logger.debug('matching %s with %s%s',
                       self, argv, ', repeatedly' if repeat else '')
@@ -1449,7 +1604,7 @@ class OptionsShortcut(object):
             'hide': tuple(obj._hide),
         }
 
-    formal_title_re = re.compile('[\-_]')
+    formal_title_re = regex(r'[\-_]')
 
     @classmethod
     def convert_2_object(cls, dic, options, namedoptions):
@@ -1550,7 +1705,7 @@ def convert_2_dict(obj):
     return obj.convert_2_dict(obj)
 
 
-formal_title_re = re.compile('[\-_]')
+formal_title_re = regex(r'[\-_]')
 
 
 def convert_2_object(dic, options, namedoptions):
@@ -1559,6 +1714,7 @@ def convert_2_object(dic, options, namedoptions):
     name_to_method = {
         'Argument': Atom.convert_2_object,
         'Command': Atom.convert_2_object,
+        'Choice': Atom.convert_2_object,
         'Option': Atom.convert_2_object,
 
         'Optional': Unit.convert_2_object,
@@ -0,0 +1,81 @@
+"""
+Keep `import docpie` cheap: the regexes are compiled on first use, and the
+loggers don't import `logging` until someone uses it.
+"""
+
+import sys
+
+__all__ = ['regex', 'get_logger']
+
+
+class LazyRegex(object):
+    """A compiled regex which is compiled when first used.
+
+    Put the flags inline, e.g. `(?i)`, so `re` is not needed to create it.
+    """
+
+    def __init__(self, pattern):
+        self._pattern = pattern
+
+    def _compile(self):
+        import re
+        compiled = re.compile(self._pattern)
+        # later access won't go through `__getattr__`
+        self.__dict__.update(
+            (name, getattr(compiled, name))
+            for name in ('match', 'search', 'split', 'sub',
+                         'findall', 'finditer'))
+        self.__dict__['_compiled'] = compiled
+        return compiled
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._compile(), name)
+
+    def __repr__(self):
+        return 'LazyRegex(%r)' % self._pattern
+
+
+def regex(pattern):
+    return LazyRegex(pattern)
+
+
+class LazyLogger(object):
+    """Works like `logging.getLogger(name)`.
+
+    Nothing can be configured to receive `debug`/`info` records before
+    `logging` is imported, so they are dropped until then. Any other use
+    imports `logging` and binds the real logger.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def _bind(self):
+        import logging
+        logger = logging.getLogger(self.name)
+        self.__dict__.update(debug=logger.debug, info=logger.info,
+                             _logger=logger)
+        return logger
+
+    def debug(self, *args, **kwargs):
+        if 'logging' in sys.modules:
+            self._bind().debug(*args, **kwargs)
+
+    def info(self, *args, **kwargs):
+        if 'logging' in sys.modules:
+            self._bind().info(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        logger = self.__dict__.get('_logger') or self._bind()
+        return getattr(logger, name)
+
+    def __repr__(self):
+        return 'LazyLogger(%r)' % self.name
+
+
+def get_logger(name):
+    return LazyLogger(name)
@@ -0,0 +1,78 @@
+"""
+A memo of the sub-matches of one parse, on with `Docpie(memo=True)`.
+
+When a `Required`/`Optional` is matched again with the same argv (by
+`Argv.status`), the same flags and the same values, the first match is
+replayed: its result, its values, and the changes it made to argv, which
+are taken from the undo log of argv. The usages expanded from one line
+share the shape of their elements, so the key is the shape of a unit
+instead of the unit itself.
+"""
+
+from docpie.element import Unit, Option, Choice, Atom
+
+__all__ = ['MatchMemo']
+
+
+def _shape(element):
+    if isinstance(element, Unit):
+        return (type(element), element.repeat,
+                tuple(_shape(x) for x in element))
+    if isinstance(element, Option):
+        return (Option, frozenset(element.names),
+                None if element.ref is None else _shape(element.ref))
+    if isinstance(element, Choice):
+        return (Choice, element.choices)
+    if isinstance(element, Atom):
+        return (type(element), frozenset(element.names))
+    # `[options]` hides the options found in its usage
+    return (type(element), id(element))
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [_copy(x) for x in value]
+    if isinstance(value, tuple):
+        return tuple(_copy(x) for x in value)
+    return value
+
+
+class MatchMemo(object):
+
+    def __init__(self):
+        # {(shape, status, repeat, option_only, dashes):
+        #  [(value before, result, value after, argv changes)]}
+        self.table = {}
+        # {id(unit): (unit, shape)}, the unit is kept so the id is not
+        # reused, e.g. by the usages of `Unit.pick_choices`
+        self.shapes = {}
+        # sub-matches replayed instead of matched
+        self.skipped = 0
+
+    def shape(self, unit):
+        key = id(unit)
+        try:
+            return self.shapes[key][1]
+        except KeyError:
+            result = _shape(unit)
+            self.shapes[key] = (unit, result)
+            return result
+
+    def match(self, unit, argv, repeat_match):
+        key = (self.shape(unit), argv.status(), repeat_match,
+               argv.option_only, argv.dashes)
+        before = unit.dump_value()
+        entries = self.table.setdefault(key, [])
+        for value, result, after, changes in entries:
+            if value == before:
+                self.skipped += 1
+                argv.redo(changes)
+                unit.load_value(_copy(after))
+                return result
+
+        argv_value = argv.dump_value()
+        before = _copy(before)
+        result = unit.match_unit(argv, repeat_match)
+        entries.append((before, result, _copy(unit.dump_value()),
+                        argv.changes(argv_value)))
+        return result
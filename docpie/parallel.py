@@ -0,0 +1,82 @@
+"""
+Parse many argv in worker processes, see `parse_all`.
+
+The compiled spec is pickled once and loaded by each worker when it
+starts, and the argv are sent in chunks. Each chunk is parsed with
+`Docpie.docpie_many`, so the results are the same `ParseResult`.
+"""
+
+import pickle
+import itertools
+import multiprocessing
+
+from docpie.pie import Docpie
+
+__all__ = ['parse_all']
+
+try:
+    StrType = basestring
+except NameError:
+    StrType = str
+
+# the `Docpie` of this worker process
+_pie = None
+
+
+def _flag(pie, flag):
+    """Stands for a handler of `extra` in the workers. The handlers are
+    never called by `docpie_many`, and may not be picklable"""
+
+
+def _init_worker(data):
+    global _pie
+    _pie = pickle.loads(data)
+
+
+def _parse_chunk(chunk):
+    return list(_pie._parse_many(chunk))
+
+
+def _chunks(argvs, chunksize):
+    argvs = iter(argvs)
+    while True:
+        chunk = list(itertools.islice(argvs, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_all(spec, argvs, processes=None, chunksize=1000, ordered=True):
+    """Parse each argv of `argvs` with `spec` (a `Docpie`, or the doc of
+    it) in `processes` worker processes (default: the number of CPUs).
+
+    Yield the `docpie.batch.ParseResult` of each argv. They're in the
+    order of `argvs` if `ordered`, otherwise in the order they're done,
+    and `ParseResult.argv` tells which argv it is. `argvs` is read
+    lazily, `chunksize` argv for each task.
+    """
+    if isinstance(spec, StrType):
+        spec = Docpie(spec)
+
+    if processes == 1:
+        for chunk in _chunks(argvs, chunksize):
+            for each in spec._parse_many(chunk):
+                yield each
+        return
+
+    shipped = spec._clone_spec()
+    shipped.extra = dict((flag, _flag) for flag, handler in
+                         spec.extra.items() if callable(handler))
+    data = pickle.dumps(shipped, pickle.HIGHEST_PROTOCOL)
+
+    pool = multiprocessing.Pool(processes, _init_worker, (data,))
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for results in imap(_parse_chunk, _chunks(argvs, chunksize)):
+            for each in results:
+                yield each
+        pool.close()
+    finally:
+        # stopped early, or failed
+        pool.terminate()
+        pool.join()
@@ -1,15 +1,31 @@
 from docpie.element import Atom, Option, Command, Argument
 from docpie.element import Optional, Required, OptionsShortcut
-from docpie.element import Either
+from docpie.element import Either, Choice
 from docpie.tokens import Token
 from docpie.error import DocpieError
+from docpie.lazy import regex, get_logger
+from docpie.cache import SpecCache
 
-import logging
-import re
-import textwrap
 import warnings
 
-logger = logging.getLogger('docpie.parser')
+logger = get_logger('docpie.parser')
+
+# the patterns depend on the section title, shared by all the parsers.
+# `section_re_cache.info()` tells how many compiling were saved (hits)
+section_re_cache = SpecCache(256)
+
+
+def section_re(template, name, case_sensitive):
+    """Return the compiled `template.format(name)`, in DOTALL mode and
+    case insensitive unless `case_sensitive`"""
+    key = (template, name, case_sensitive)
+    compiled = section_re_cache.get(key)
+    if compiled is None:
+        import re
+        flags = re.DOTALL if case_sensitive else (re.DOTALL | re.IGNORECASE)
+        compiled = re.compile(template.format(name), flags)
+        section_re_cache.put(key, compiled)
+    return compiled
 
 
 class Parser(object):
@@ -37,12 +53,10 @@ class Parser(object):
         start = token.next()
         instance_type = Required if start == '(' else Optional
 
-        lis = token.till_end_bracket(start)
+        bracket_token = token.till_end_bracket(start)
 
         repeat = token.check_ellipsis_and_drop()
 
-        bracket_token = Token(lis)
-
         instances = self.parse_pattern(bracket_token)
 
         return instance_type(*instances, **{'repeat': repeat})
@@ -104,7 +118,7 @@ class Parser(object):
             return (ins,)
 
         if prepended:
-            token.pop(0)
+            token.next()
 
     def get_long_option_with_arg(self, current, token):
         flag, arg = current.split('=', 1)
@@ -159,7 +173,7 @@ class Parser(object):
             flag = current[:2]
             # -abc<sth>
             if lt_index > 2:
-                token.insert(0, '-' + current[2:])
+                token.push('-' + current[2:])
                 prepended = True
             # -a<sth>
             else:
@@ -196,7 +210,7 @@ class Parser(object):
                             ("You can't write %s while it requires "
                              "argument and attachopt=False") % current)
 
-                    token.insert(0, '-' + rest)
+                    token.push('-' + rest)
                     prepended = True
             # In Options it requires argument
             else:
@@ -227,7 +241,7 @@ class Parser(object):
                     "You can't write %s while it requires argument "
                     "and attachopt=False" % current)
             # -asth -> -a -sth
-            token.insert(0, '-' + rest)
+            token.push('-' + rest)
             prepended = True
 
         return arg_token, prepended
@@ -305,7 +319,7 @@ class Parser(object):
 
         return sum(title_opt_2_ins.values(), [])
 
-    formal_title_re = re.compile('[\-_]')
+    formal_title_re = regex(r'[\-_]')
 
     def formal_title(self, title):
         return self.formal_title_re.sub(' ', title.lower()).strip()
@@ -329,7 +343,7 @@ class Parser(object):
 
         return Either(*groups)
 
-    started_empty_lines = re.compile(r'^\s*?\n(?P<rest>.*)')
+    started_empty_lines = regex(r'^\s*?\n(?P<rest>.*)')
 
     @classmethod
     def drop_started_empty_lines(cls, text):
@@ -343,20 +357,18 @@ class Parser(object):
 
 
 class OptionParser(Parser):
-    split_re = re.compile(r'(<.*?>)|\s+')
-    wrap_symbol_re = re.compile(r'([\|\[\]\(\)]|\.\.\.)')
-    line_re = re.compile(r'^(?P<indent> *)'
-                         r'(?P<option>[\d\w=_, <>\-\[\]\.]+?)'
-                         r'(?P<separater>$| $| {2,})'
-                         r'(?P<description>.*?)'
-                         r' *$',
-                         flags=re.IGNORECASE)
+    split_re = regex(r'(<.*?>)|\s+')
+    wrap_symbol_re = regex(r'([\|\[\]\(\)]|\.\.\.)')
+    line_re = regex(r'(?i)^(?P<indent> *)'
+                    r'(?P<option>[\d\w=_, <>\-\[\]\.]+?)'
+                    r'(?P<separater>$| $| {2,})'
+                    r'(?P<description>.*?)'
+                    r' *$')
 
-    indent_re = re.compile(r'^(?P<indent> *)')
-    to_space_re = re.compile(r',\s?|=')
+    indent_re = regex(r'^(?P<indent> *)')
+    to_space_re = regex(r',\s?|=')
 
-    visible_empty_line_re = re.compile(r'^\s*?\n*|\r?\n(:?[\ \t]*\r?\n)+',
-                                       flags=re.DOTALL)
+    visible_empty_line_re = regex(r'(?s)^\s*?\n*|\r?\n(:?[\ \t]*\r?\n)+')
 
     option_split_re_str = (r'([^\r\n]*{0}[\ \t]*\r?\n?)')
 
@@ -371,8 +383,7 @@ class OptionParser(Parser):
     #                         r' *'
     #                         r'[\.\?\!]? *$',
     #                         flags=re.IGNORECASE)
-    default_re = re.compile(r'\[default: (?P<default>.*?)\] *$',
-                            flags=re.IGNORECASE)
+    default_re = regex(r'(?i)\[default: (?P<default>.*?)\] *$')
 
     def __init__(self, option_name, case_sensitive,
                  stdopt, attachopt, attachvalue, namedoptions):
@@ -382,10 +393,6 @@ class OptionParser(Parser):
         self.attachvalue = attachvalue
         self.case_sensitive = case_sensitive
         self.option_name = option_name
-        self.option_split_re = re.compile(
-            self.option_split_re_str.format(option_name),
-            flags= re.DOTALL if case_sensitive else (re.DOTALL | re.IGNORECASE)
-        )
 
         self.raw_content = {}
         self.formal_content = None
@@ -422,8 +429,11 @@ class OptionParser(Parser):
             except ValueError:  # python >= 3.5
                 split = [text]
 
-        option_split_re = self.option_split_re
-        name = re.compile(re.escape(self.option_name), re.IGNORECASE)
+        import re
+        option_split_re = section_re(self.option_split_re_str,
+                                     self.option_name, self.case_sensitive)
+        # always case insensitive
+        name = section_re('{0}', re.escape(self.option_name), False)
         for text in filter(lambda x: x and x.strip(), split):
 
             # logger.warning('get options group:\n%r', text)
@@ -464,7 +474,8 @@ class OptionParser(Parser):
 
         if formal_collect:
             for each_title, values in formal_collect.items():
-                value = '\n'.join(map(textwrap.dedent, values))
+                from textwrap import dedent
+                value = '\n'.join(map(dedent, values))
                 formal_collect[each_title] = value
 
         self.formal_content = formal_collect
@@ -514,22 +525,25 @@ class OptionParser(Parser):
 
         return result
 
-    spaces_re = re.compile(r'(\ \ \s*|\t\s*)')
+    spaces_re = regex(r'(\ \ \s*|\t\s*)')
 
     @classmethod
     def cut_first_spaces_outside_bracket(cls, string):
         right = cls.spaces_re.split(string)
         left = []
+        index = 0
         if right and right[0] == '':    # re matches the start of the string
-            right.pop(0)
-        if right and not right[0].strip():    # it is indent
-            left.append(right.pop(0))
+            index += 1
+        if index < len(right) and not right[index].strip():    # it is indent
+            left.append(right[index])
+            index += 1
         brackets = {'(': 0, '[': 0, '<': 0}
         close_brancket = {'(': ')', '[': ']', '<': '>'}
         cutted = ''
 
-        while right:
-            this = right.pop(0)
+        while index < len(right):
+            this = right[index]
+            index += 1
             for open_b in brackets:
                 brackets[open_b] += this.count(open_b)
                 brackets[open_b] -= this.count(close_brancket[open_b])
@@ -541,7 +555,7 @@ class OptionParser(Parser):
                 break
             else:
                 left.append(this)
-        return ''.join(left), cutted, ''.join(right)
+        return ''.join(left), cutted, ''.join(right[index:])
 
     @classmethod
     def parse_line_option_indent(cls, line):
@@ -585,6 +599,26 @@ class OptionParser(Parser):
 
         return result
 
+    def parse_names(self, title_of_name_and_default):
+        """Only get the names of each option, without building `Option`.
+        [({'-a', '--all'}, expects_argument), ...]"""
+        result = []
+        for name_and_default in title_of_name_and_default.values():
+            for opt_str, _ in name_and_default:
+                names = set()
+                expect_arg = False
+                for each in self.opt_str_to_list(opt_str):
+                    if each.startswith('-'):
+                        name, value = self.split_short_by_cfg(each)
+                        names.add(name)
+                        if value and value != '...':
+                            expect_arg = True
+                    elif each != '...':
+                        expect_arg = True
+                result.append((names, expect_arg))
+
+        return result
+
     def split_short_by_cfg(self, option_str):
         if self.stdopt:
             if (not option_str.startswith('--') and
@@ -702,16 +736,16 @@ class OptionParser(Parser):
 
 class UsageParser(Parser):
 
-    angle_bracket_re = re.compile(r'(<.*?>)')
-    wrap_symbol_re = re.compile(r'(\[[^\]\s]*?options\]|\.\.\.|\||\[|\]|\(|\))')
-    split_re = re.compile(r'(\[[^\]\s]*?options\]|\S*<.*?>\S*)|\s+')
+    angle_bracket_re = regex(r'(<.*?>)')
+    wrap_symbol_re = regex(r'(\[[^\]\s]*?options\]|\.\.\.|\||\[|\]|\(|\))')
+    split_re = regex(r'(\[[^\]\s]*?options\]|\S*<.*?>\S*)|\s+')
     # will match '-', '--', and
     # flag ::= "-" [ "-" ] chars "=<" chars ">"
     # it will also match '---flag', so use startswith('---') to check
-    std_flag_eq_arg_re = re.compile(r'(?P<flag>^-{1,2}[\da-zA-Z_\-]*)'
-                                    r'='
-                                    r'(?P<arg><.*?>)'
-                                    r'$')
+    std_flag_eq_arg_re = regex(r'(?P<flag>^-{1,2}[\da-zA-Z_\-]*)'
+                               r'='
+                               r'(?P<arg><.*?>)'
+                               r'$')
 
     usage_re_str = (r'(?:^|\n)'
                     r'(?P<raw>'
@@ -725,6 +759,7 @@ class UsageParser(Parser):
     def __init__(self, usage_name, case_sensitive,
                  stdopt, attachopt, attachvalue, namedoptions):
 
+        import re
         self.usage_name = re.escape(usage_name)
         self.case_sensitive = case_sensitive
         self.stdopt = stdopt
@@ -764,12 +799,8 @@ class UsageParser(Parser):
     def parse_content(self, text):
         """get Usage section and set to `raw_content`, `formal_content` of no
         title and empty-line version"""
-        match = re.search(
-            self.usage_re_str.format(self.usage_name),
-            text,
-            flags=(re.DOTALL
-                   if self.case_sensitive
-                   else (re.DOTALL | re.IGNORECASE)))
+        match = section_re(self.usage_re_str, self.usage_name,
+                           self.case_sensitive).search(text)
 
         if match is None:
             return
@@ -794,7 +825,7 @@ class UsageParser(Parser):
             result.append(chain)
         self.instances = result
 
-    indent_re = re.compile(r'^ *')
+    indent_re = regex(r'^ *')
 
     def split_line_by_indent(self, text):
         lines = text.splitlines()
@@ -802,12 +833,11 @@ class UsageParser(Parser):
             yield lines[0]
             return
 
-        first_line = lines.pop(0)
+        first_line = lines[0]
         line_to_join = [first_line]
         indent = len(
             self.indent_re.match(first_line.expandtabs()).group())
-        while lines:
-            this_line = lines.pop(0)
+        for this_line in lines[1:]:
             this_indent = len(
                 self.indent_re.match(this_line.expandtabs()).group())
 
@@ -890,6 +920,74 @@ class UsageParser(Parser):
 
         return opt_ouside, opt_cuts
 
+    @classmethod
+    def find_either_and_command_names(cls, lis):
+        eithers = []
+        names = []
+        for element in lis:
+            if isinstance(element, Either):
+                eithers.append(element)
+            if isinstance(element, list):
+                sub_eithers, sub_names = \
+                    cls.find_either_and_command_names(element)
+                eithers.extend(sub_eithers)
+                names.extend(sub_names)
+            elif isinstance(element, Command):
+                names.extend(element.names)
+
+        return eithers, names
+
+    @classmethod
+    def fold_choice(cls, usage):
+        '''
+        `prog (a | b) [c | d]` -> `prog Choice(a, b) [Choice(c, d)]`,
+        instead of expanding it to 4 usages.
+
+        Only when it gives the same result as the expanded ones: every
+        `Either` of the usage is a top level `(...)` or `[...]` of single
+        commands which are not used elsewhere in the usage. Otherwise, e.g.
+        a nested `Either` or one with an option or an argument in it, the
+        whole usage is still expanded. `Docpie._match` tries the expanded
+        ones of a `Choice` when argv may match them differently, see
+        `Unit.ambiguous_choices`.
+        '''
+        if not isinstance(usage, Required) or usage.repeat:
+            return usage
+
+        if len(usage) == 1 and isinstance(usage[0], Either):
+            wrappers = [usage]
+        else:
+            wrappers = [each for each in usage
+                        if isinstance(each, list) and len(each) == 1 and
+                        isinstance(each[0], Either)]
+
+        eithers, names = cls.find_either_and_command_names(usage)
+        if not wrappers or len(eithers) != len(wrappers):
+            return usage
+
+        folded = []
+        for wrapper in wrappers:
+            if (not isinstance(wrapper, (Required, Optional)) or
+                    wrapper.repeat):
+                return usage
+            choices = []
+            for branch in wrapper[0]:
+                if not (isinstance(branch, Required) and
+                        not branch.repeat and len(branch) == 1 and
+                        type(branch[0]) is Command and
+                        len(branch[0].names) == 1):
+                    return usage
+                name, = branch[0].names
+                if name.startswith('-') or names.count(name) != 1:
+                    return usage
+                choices.append(name)
+            folded.append(choices)
+
+        for wrapper, choices in zip(wrappers, folded):
+            wrapper[0] = Choice(*choices)
+        logger.debug('folded usage %r', usage)
+        return usage
+
     def fix_option_and_empty(self):
         result = []
         all_options = []
@@ -916,7 +1014,7 @@ class UsageParser(Parser):
 
             all_options.extend(outside_opts)
 
-            for usage in ins.expand():
+            for usage in self.fold_choice(ins).expand():
                 usage.push_option_ahead()
                 # [options] -a
                 # Options: -a
@@ -1,12 +1,22 @@
+import re
 import sys
-import logging
-
+import time
+import pickle
 import warnings
-import textwrap
+import threading
 from docpie.error import DocpieExit
 from docpie.parser import UsageParser, OptionParser
 from docpie.element import convert_2_object, convert_2_dict
-from docpie.tokens import Argv
+from docpie.tokens import Argv, OptionNames
+from docpie.dispatch import UsageIndex
+from docpie.automaton import Automaton, plan_usages
+from docpie import cache
+from docpie.lazy import get_logger
+
+try:
+    from copyreg import __newobj__
+except ImportError:    # python 2
+    from copy_reg import __newobj__
 
 __all__ = ['Docpie']
 
@@ -15,7 +25,13 @@ try:
 except NameError:
     StrType = str
 
-logger = logging.getLogger('docpie')
+logger = get_logger('docpie')
+
+
+def _copy_value(value):
+    if isinstance(value, list):
+        return [_copy_value(x) for x in value]
+    return value
 
 
 class Docpie(dict):
@@ -39,18 +55,24 @@ class Docpie(dict):
     attachvalue = True
     options_first = False
     appeared_only = False
-    extra = {}
+    _extra = {}
     namedoptions = False
 
     opt_names = []
     opt_names_required_max_args = {}
 
+    cache_dir = None
+    # replay the sub-matches tried again in a parse, see `docpie.memo`
+    memo = False
+    # True when `lazy` and `doc` is not compiled yet
+    _pending = False
+
     def __init__(self, doc=None, help=True, version=None,
                  stdopt=True, attachopt=True, attachvalue=True,
                  helpstyle='python',
                  auto2dashes=True, name=None, case_sensitive=False,
                  optionsfirst=False, appearedonly=False, namedoptions=False,
-                 extra=None):
+                 extra=None, cache_dir=None, lazy=False, memo=False):
 
         super(Docpie, self).__init__()
 
@@ -74,12 +96,73 @@ class Docpie(dict):
         self.helpstyle = helpstyle
         self.version = version
         self.extra = extra
+        self.cache_dir = cache_dir
+        self.memo = memo
+        # guard the last result kept in this instance
+        self._lock = threading.Lock()
+        # the copies of the compiled spec to match in, see `_take_spec`
+        self._spares = []
+        # the counters of the last parse, one for each thread
+        self._stats = threading.local()
 
         if doc is not None:
             self.doc = doc
-            self._init()
+            if lazy:
+                self._init_lazy()
+            else:
+                self._init()
 
     def _init(self):
+        self._pending = False
+        if self.cache_dir is None:
+            self._compile()
+        else:
+            key = cache.spec_key(self)
+            compiled = cache.load(self.cache_dir, key)
+            if compiled is None:
+                self._compile()
+                cache.dump(self.cache_dir, key, self._dump_compiled())
+            else:
+                logger.debug('load compiled spec from cache %s', key)
+                self._load_compiled(compiled)
+        self._usage_index()
+
+        self.set_config(help=self.help,
+                        version=self.version,
+                        extra=dict(self.extra))
+
+    def _init_lazy(self):
+        """Only find the sections and the option names, so the help/version
+        handlers can work. The usages/options are compiled on the first
+        `docpie` call or the first access of them."""
+        self._pending = True
+        for each in ('usages', 'options'):
+            self.__dict__.pop(each, None)
+
+        # the help/version handlers need the sections
+        uparser, oparser = self._parse_sections()
+        names = oparser.parse_names(oparser.parse_names_and_default())
+        self.opt_names = [each_names for each_names, _ in names]
+        self._opt_names_expect_arg = set(
+            name
+            for each_names, expect_arg in names if expect_arg
+            for name in each_names)
+        self.opt_names_required_max_args = {}
+
+        self.set_config(help=self.help,
+                        version=self.version,
+                        extra=dict(self.extra))
+
+    def __getattr__(self, name):
+        # only called when the attribute is missing, which means `doc` is
+        # not compiled yet in lazy mode
+        if self.__dict__.get('_pending') and name in ('usages', 'options'):
+            logger.debug('compile lazy doc for accessing %s', name)
+            self._init()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def _parse_sections(self):
         uparser = UsageParser(
             self.usage_name, self.case_sensitive,
             self.stdopt, self.attachopt, self.attachvalue, self.namedoptions)
@@ -92,8 +175,15 @@ class Docpie(dict):
         # avoid usage contains "Options:" word
         prefix, _, suffix = self.doc.partition(self.usage_text)
 
-        oparser.parse(prefix + suffix)
+        oparser.parse_content(prefix + suffix)
         self.option_sections = oparser.raw_content
+        return uparser, oparser
+
+    def _compile(self):
+        uparser, oparser = self._parse_sections()
+
+        oparser.instances = oparser.parse_to_instance(
+            oparser.parse_names_and_default())
         self.options = oparser.instances
 
         uparser.parse(None, self.name, self.options)
@@ -116,9 +206,110 @@ class Docpie(dict):
             for each_option in options:
                 self.opt_names.append(each_option[0].names)
 
-        self.set_config(help=self.help,
-                        version=self.version,
-                        extra=dict(self.extra))
+    def _dump_compiled(self):
+        """Return the compiled part as JSONlizable data. See `to_dict`"""
+        text = {
+            'doc': self.doc,
+            'usage_text': self.usage_text,
+            'option_sections': self.option_sections,
+        }
+
+        option = {}
+        for title, options in self.options.items():
+            option[title] = [convert_2_dict(x) for x in options]
+
+        usage = [convert_2_dict(x) for x in self.usages]
+
+        automaton = self._usage_automaton()
+
+        return {
+            '__text__': text,
+            'option': option,
+            'usage': usage,
+            'option_names': [list(x) for x in self.opt_names],
+            'opt_names_required_max_args': self.opt_names_required_max_args,
+            'automaton': {
+                'config': list(self._automaton_config()),
+                'plans': automaton.to_data(),
+            },
+        }
+
+    def _load_compiled(self, dic):
+        """Restore the data generated by `_dump_compiled`"""
+        text = dic['__text__']
+        self.doc = text['doc']
+        self.usage_text = text['usage_text']
+        self.option_sections = text['option_sections']
+
+        self.opt_names = [set(x) for x in dic['option_names']]
+        self.opt_names_required_max_args = dic['opt_names_required_max_args']
+        self.options = o = {}
+        for title, options in dic['option'].items():
+            opt_ins = [convert_2_object(x, {}, self.namedoptions)
+                       for x in options]
+            o[title] = opt_ins
+
+        self.usages = [convert_2_object(x, self.options, self.namedoptions)
+                       for x in dic['usage']]
+        # made with other config, or by an old version
+        automaton = dic.get('automaton')
+        if (automaton is not None and
+                tuple(automaton['config']) == self._automaton_config()):
+            self._set_automaton(Automaton.from_data(automaton['plans']))
+
+    def _clone_spec(self):
+        """Return a new instance sharing the compiled spec with this one.
+
+        The matching value is not copied. The config, e.g. `extra`, can be
+        changed without affecting this instance."""
+        # build them once for all the instances
+        if not self._pending:
+            self._usage_automaton()
+            self._value_templates()
+        new = self.__class__.__new__(self.__class__)
+        dict.__init__(new)
+        new.__dict__.update(self.__dict__)
+        # same flags, so the tables built from them are still right
+        new._extra = dict(self.extra)
+        # the copies to match in are never shared with the clones
+        new._lock = threading.Lock()
+        new._spares = []
+        new._stats = threading.local()
+        return new
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock', None)
+        state.pop('_index', None)
+        state.pop('_names', None)
+        state.pop('_templates', None)
+        state.pop('_flags', None)
+        state.pop('_helps', None)
+        state.pop('_spares', None)
+        state.pop('_stats', None)
+        return state
+
+    def __reduce__(self):
+        # the config and the compiled spec only, not the last result
+        return (__newobj__, (self.__class__,), self.__getstate__())
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._spares = []
+        self._stats = threading.local()
+
+    @property
+    def memo_skipped(self):
+        """Sub-matches replayed in the last parse of the current thread
+        with `memo`"""
+        return getattr(self._stats, 'memo_skipped', 0)
+
+    @property
+    def usages_pruned(self):
+        """Usages not tried in the last parse of the current thread, see
+        `docpie.dispatch`"""
+        return getattr(self._stats, 'usages_pruned', 0)
 
     def docpie(self, argv=None):
         """match the argv for each usages, return dict.
@@ -129,76 +320,289 @@ class Docpie(dict):
         Which means it may not try to match any usages because of the checking.
         """
 
+        handled = False
+        if self._pending:
+            handled = self._lazy_flag_and_handler(argv)
+            self._init()
+
         token = self._prepare_token(argv)
         # check first, raise after
         # so `-hwhatever` can trigger `-h` first
-        self.check_flag_and_handler(token)
+        if not handled:
+            self.check_flag_and_handler(token)
 
         if token.error is not None:
             # raise DocpieExit('%s\n\n%s' % (token.error, help_msg))
             self.exception_handler(token.error)
 
+        result = self._match_simple(token)
+        if result is None:
+            spec = self._take_spec()
+            try:
+                result = self._match_spec(token, spec[2], spec[3])
+            except DocpieExit:
+                self._put_spec(spec)
+                raise
+            # any other error may leave the copy matched, it's dropped
+            self._put_spec(spec)
+        else:
+            self._stats.memo_skipped = self._stats.usages_pruned = 0
+
+        # keep the last result like a dict, which is all the state
+        # shared by the threads parsing with this instance
+        with self._lock:
+            self.clear()
+            self.update(result)
+        return result
+
+    def docpie_many(self, argvs):
+        """Parse each argv of `argvs` (list or str, like `docpie`), return
+        a `docpie.batch.BatchResult`, a list of `ParseResult`.
+
+        Nothing is raised for a failure, and no handler of `extra` is
+        called. This instance is not updated. It's much faster than
+        calling `docpie` for each argv and catching `DocpieExit`.
+        """
+        from docpie.batch import BatchResult
+        result = BatchResult()
+        start = time.time()
+        result.extend(self._parse_many(argvs))
+        result.seconds = time.time() - start
+        return result
+
+    def try_parse(self, argv=None):
+        """Parse `argv` (None, list or str, like `docpie`), return a
+        `docpie.batch.ParseResult` instead of raising `DocpieExit`.
+
+        Like `docpie_many`, no handler of `extra` is called and this
+        instance is not updated. On failure the result has the error
+        without the help message, see `docpie.batch.TryResult`.
+        """
+        from docpie.batch import TryResult
+        raised = []
+        result, = self._parse_many([argv], raised)
+        return TryResult(result, self, raised[0] if raised else None)
+
+    def _parse_many(self, argvs, raised=None):
+        """Yield the `ParseResult` of each argv, see `docpie_many`. The
+        index of the usage raising the error is added to `raised` if
+        given"""
+        from docpie.batch import ParseResult
+        if self._pending:
+            self._init()
+
+        spec = None
+        try:
+            for argv in argvs:
+                token, error = self._make_token(argv)
+                if error is not None:
+                    yield ParseResult(argv, error=error)
+                    continue
+                for flag, _ in self._find_flags(token):
+                    yield ParseResult(argv, flag=flag)
+                    break
+                else:
+                    if token.error is not None:
+                        yield ParseResult(argv, error=token.error)
+                        continue
+                    value = self._match_simple(token)
+                    if value is not None:
+                        yield ParseResult(argv, value)
+                        continue
+                    if spec is None:
+                        spec = self._take_spec()
+                    try:
+                        value = self._match_spec(token, spec[2], spec[3],
+                                                 False, raised)
+                    except DocpieExit as e:
+                        yield ParseResult(argv, error=e)
+                    except BaseException:
+                        # it may be left matched, don't reuse it
+                        spec = None
+                        raise
+                    else:
+                        yield ParseResult(argv, value)
+        finally:
+            if spec is not None:
+                self._put_spec(spec)
+
+    def _take_spec(self):
+        """Return (usages, options, usages copy, options copy) to match
+        in. The matching value is kept in the elements, so each parse
+        takes its own copy from the spares, or makes a new one."""
+        usages = self.usages
+        options = self.options
+        spares = self._spares
+        while spares:
+            try:
+                spec = spares.pop()
+            except IndexError:    # taken by another thread
+                break
+            if spec[0] is usages and spec[1] is options:
+                return spec
+        # faster than `copy.deepcopy`, and keeps the shared options shared
+        return (usages, options) + pickle.loads(
+            pickle.dumps((usages, options), pickle.HIGHEST_PROTOCOL))
+
+    def _put_spec(self, spec):
+        """Give back the copy taken by `_take_spec`, whose usages must be
+        `reset` to the state before matched"""
+        self._spares.append(spec)
+
+    def _match_spec(self, token, usages, options, handle=True,
+                    raised=None):
+        """Match `token` with `usages`/`options` taken by `_take_spec`.
+        The `DocpieExit` is raised as it is if not `handle`. See `_match`
+        for `raised`"""
+        if self.memo:
+            from docpie.memo import MatchMemo
+            token.memo = MatchMemo()
         try:
-            result, dashed = self._match(token)
+            index, dashed = self._match(token, usages, raised)
         except DocpieExit as e:
+            if not handle:
+                raise
             self.exception_handler(e)
+        finally:
+            if token.memo is not None:
+                self._stats.memo_skipped = token.memo.skipped
 
-        # if error is not None:
-        #     self.exception_handler(error)
-
-        value = result.get_value(self.appeared_only, False)
-        self.clear()
-        self.update(value)
+        try:
+            return self._collect_value(index, dashed, usages, options)
+        finally:
+            # never leave the matched value in the copy for the next parse
+            usages[index].reset()
+
+    def _collect_value(self, index, dashed, usages, options):
+        """Return the result of `usages[index]` matched"""
+        result = usages[index]
+        values = result.get_value(self.appeared_only, False)
+        logger.debug('get all matched value %s', values)
         if self.appeared_only:
-            self._drop_non_appeared()
-
-        logger.debug('get all matched value %s', self)
-        rest = list(self.usages)  # a copy
-        rest.remove(result)
-        self._add_rest_value(rest)
-        logger.debug('merged rest values, now %s', self)
-        self._add_option_value()
-        self._dashes_value(dashed)
-
-        return dict(self)  # remove all other reference in this instance
+            self._drop_non_appeared(values)
+            self._add_rest_value(values, self._rest_usages(index, usages))
+            logger.debug('merged rest values, now %s', values)
+            self._add_option_value(values, options)
+        else:
+            values = self._fill_template(index, values)
+        self._dashes_value(values, dashed)
+
+        return values
+
+    def _rest_usages(self, index, usages):
+        """The usages whose default values are merged into the result of
+        `usages[index]`"""
+        result = usages[index]
+        rest = list(usages)  # a copy
+        # a folded usage also stands for the expanded usages of the other
+        # choices, which are the rest. See `UsageParser.fold_choice`
+        if not result.find_choices():
+            rest.remove(result)
+        return rest
+
+    def _value_templates(self):
+        """Return ([template or None of each usage], {option name:
+        [(order, option)]}), see `_value_template`. Built again if the
+        usages or the options change"""
+        cached = self.__dict__.get('_templates')
+        if (cached is None or cached[0] is not self.usages or
+                cached[1] is not self.options):
+            option_of = {}
+            order = 0
+            for section in self.options.values():
+                for each in section:
+                    for name in each[0].names:
+                        option_of.setdefault(name, []).append((order, each))
+                    order += 1
+            cached = self._templates = (self.usages, self.options,
+                                        [None] * len(self.usages), option_of)
+        return cached[2], cached[3]
+
+    def _value_template(self, index):
+        """Return (the result of `usages[index]` if nothing of it is
+        matched, {key: the default values its matched value is merged
+        with}), made once for each usage. Without `appearedonly` the
+        default values don't depend on what's matched"""
+        templates, _ = self._value_templates()
+        template = templates[index]
+        if template is None:
+            rest = self._rest_usages(index, self.usages)
+            values = {}
+            self._add_rest_value(values, rest)
+            self._add_option_value(values, self.options)
+            merged = {}
+            for each in rest:
+                for key, default in each.get_sys_default_value(
+                        False, False).items():
+                    if isinstance(default, (int, list)) and not (
+                            default is True or default is False):
+                        merged.setdefault(key, []).append(default)
+            template = templates[index] = (values, merged)
+        return template
+
+    def _fill_template(self, index, values):
+        """Return the result of `usages[index]` with the matched `values`
+        put into the copy of its template"""
+        template, merged = self._value_template(index)
+        option_of = self._templates[3]
+        result = {}
+        for key, value in values.items():
+            for default in merged.get(key, ()):
+                value = self._merge_rest_value(default, value)
+            result[key] = value
+        for key, value in template.items():
+            if key not in result:
+                result[key] = _copy_value(value)
+
+        picked = {}
+        for key in values:
+            for order, each in option_of.get(key, ()):
+                picked[order] = (each, key)
+        for order in sorted(picked):
+            each, key = picked[order]
+            final_value = self._option_value(each, result[key])
+            for name in each[0].names:
+                result[name] = final_value
+        return result
 
-    def _drop_non_appeared(self):
-        for key, _ in filter(lambda k_v: k_v[1] == -1, dict(self).items()):
-            self.pop(key)
+    def _drop_non_appeared(self, values):
+        for key, _ in filter(lambda k_v: k_v[1] == -1, dict(values).items()):
+            values.pop(key)
 
-    def _add_rest_value(self, rest):
+    def _add_rest_value(self, values, rest):
+        """Merge the default values of the `rest` usages into `values`"""
         for each in rest:
             default_values = each.get_sys_default_value(
                 self.appeared_only, False)
             logger.debug('get rest values %s -> %s', each, default_values)
-            common_keys = set(self).intersection(default_values)
+            common_keys = set(values).intersection(default_values)
 
             for key in common_keys:
-                default = default_values[key]
-                valued = self[key]
-                logger.debug('%s: default(%s), matched(%s)',
-                             key, default, valued)
-
-                if ((default is not True and default is not False) and
-                        isinstance(default, int)):
-                    valued = int(valued)
-                elif isinstance(default, list):
-                    if valued is None:
-                        valued = []
-                    elif isinstance(valued, list):
-                        pass
-                    else:
-                        valued = [valued]
-
-                logger.debug('set %s as %s', key, valued)
-                default_values[key] = valued
-
-            self.update(default_values)
+                default_values[key] = self._merge_rest_value(
+                    default_values[key], values[key])
+
+            values.update(default_values)
+
+    def _merge_rest_value(self, default, valued):
+        """Return the value `valued` as the type of the `default` value
+        of a rest usage"""
+        logger.debug('default(%s), matched(%s)', default, valued)
+        if ((default is not True and default is not False) and
+                isinstance(default, int)):
+            valued = int(valued)
+        elif isinstance(default, list):
+            if valued is None:
+                valued = []
+            elif isinstance(valued, list):
+                pass
+            else:
+                valued = [valued]
+        return valued
 
-    def _add_option_value(self):
+    def _add_option_value(self, values, options):
         # add left option, add default value
-        for options in self.options.values():
-            for each in options:
+        for section in options.values():
+            for each in section:
                 option = each[0]
                 names = option.names
                 default = option.default
@@ -206,25 +610,12 @@ class Docpie(dict):
 
                 logger.debug('%s/%s/%s', option, default, this_value)
 
-                name_in_value = names.intersection(self)
+                name_in_value = names.intersection(values)
                 if name_in_value:  # add default if necessary
                     one_name = name_in_value.pop()
-                    logger.debug('in names, pop %s, self %s', one_name, self)
-                    value_in_usage = self[one_name]
-                    if not value_in_usage:  # need default
-                        if default is None:  # no default, use old matched one
-                            final_value = value_in_usage
-                        elif (each.repeat or
-                                (value_in_usage is not True and
-                                 value_in_usage is not False and
-                                 isinstance(value_in_usage, (int, list)))):
-                            final_value = default.split()
-                        else:
-                            final_value = default
-                    else:
-                        final_value = value_in_usage
-                    if option.ref is None and each.repeat:
-                        final_value = int(final_value or 0)
+                    logger.debug('in names, pop %s, values %s', one_name,
+                                 values)
+                    final_value = self._option_value(each, values[one_name])
                 # just add this key-value. Note all option here never been matched
                 elif self.appeared_only:
                     continue
@@ -264,10 +655,31 @@ class Docpie(dict):
                 final = {}
                 for name in names:
                     final[name] = final_value
-                self.update(final)
+                values.update(final)
+
+    def _option_value(self, each, value_in_usage):
+        """Return the value of the option `each` (of `options`), whose
+        value in the usages is `value_in_usage`"""
+        option = each[0]
+        default = option.default
+        if not value_in_usage:  # need default
+            if default is None:  # no default, use old matched one
+                final_value = value_in_usage
+            elif (each.repeat or
+                    (value_in_usage is not True and
+                     value_in_usage is not False and
+                     isinstance(value_in_usage, (int, list)))):
+                final_value = default.split()
+            else:
+                final_value = default
+        else:
+            final_value = value_in_usage
+        if option.ref is None and each.repeat:
+            final_value = int(final_value or 0)
+        return final_value
 
-    def _dashes_value(self, dashes):
-        result = self['--'] if '--' in self else dashes
+    def _dashes_value(self, values, dashes):
+        result = values['--'] if '--' in values else dashes
         if self.options_first:
             if result is True:
                 result = False
@@ -279,109 +691,291 @@ class Docpie(dict):
         if self.auto2dashes:
             result = bool(result)
 
-        self['--'] = result
+        values['--'] = result
 
     def _prepare_token(self, argv):
+        token, none_or_error = self._make_token(argv)
+        if none_or_error is not None:
+            return self.exception_handler(none_or_error)
+        return token
+
+    def _make_token(self, argv):
+        """Return the formal `Argv` of `argv`, and the error of `formal`"""
         if argv is None:
             argv = sys.argv
         elif isinstance(argv, StrType):
             argv = argv.split()
 
-        # the things in extra may not be announced
-        all_opt_requried_max_args = dict.fromkeys(self.extra, 0)
-        all_opt_requried_max_args.update(self.opt_names_required_max_args)
+        known, names = self._option_names()
         token = Argv(argv[1:], self.auto2dashes or self.options_first,
                      self.stdopt, self.attachopt, self.attachvalue,
-                     all_opt_requried_max_args)
+                     known, names)
         none_or_error = token.formal(self.options_first)
         logger.debug('formal token: %s; error: %s', token, none_or_error)
-        if none_or_error is not None:
-            return self.exception_handler(none_or_error)
-        return token
+        return token, none_or_error
+
+    def _option_names(self):
+        """The `{name: max args}` of the options to find in argv, and the
+        `OptionNames` of them, built again if the options or `extra` change"""
+        names = self.__dict__.get('_names')
+        if (names is None or
+                names[0] is not self.opt_names_required_max_args):
+            # the things in extra may not be announced
+            all_opt_requried_max_args = dict.fromkeys(self.extra, 0)
+            all_opt_requried_max_args.update(
+                self.opt_names_required_max_args)
+            names = self._names = (
+                self.opt_names_required_max_args,
+                all_opt_requried_max_args,
+                OptionNames(all_opt_requried_max_args))
+        return names[1:]
+
+    def _usage_index(self):
+        """The `UsageIndex` of `usages`, built again if they're replaced"""
+        index = self.__dict__.get('_index')
+        if index is None or index.usages is not self.usages:
+            index = self._index = UsageIndex(self.usages)
+        return index
+
+    def _automaton_config(self):
+        return (self.appeared_only, self.auto2dashes, self.options_first)
+
+    def _set_automaton(self, automaton):
+        self._automaton = (self.usages, self.options,
+                           self._automaton_config(), automaton)
+
+    def _usage_automaton(self):
+        """The `Automaton` of the simple usages, built again if the usages,
+        the options or the config change"""
+        cached = self.__dict__.get('_automaton')
+        if (cached is None or cached[0] is not self.usages or
+                cached[1] is not self.options or
+                cached[2] != self._automaton_config()):
+            spec = self._take_spec()
+            try:
+                automaton = Automaton(plan_usages(self, spec[2], spec[3]))
+            finally:
+                self._put_spec(spec)
+            self._set_automaton(automaton)
+            return automaton
+        return cached[3]
+
+    def _match_simple(self, token):
+        """Return the result of `token` (an `Argv`) by the `Automaton` if
+        it has no option and matches a simple usage, otherwise None"""
+        if self.options_first:
+            return None
+        argv = list(token)
+        for each in argv:
+            if each.startswith('-'):
+                return None
+        return self._usage_automaton().match(argv)
+
+    def _match(self, token, usages, raised=None):
+        """Return (index of the usage matching `token`, whether `--` is
+        left). The index of the usage raising `DocpieExit` is added to
+        `raised` if given"""
+        names = None
+        indexes = self._usage_index().candidates(token)
+        self._stats.usages_pruned = len(usages) - len(indexes)
+        for index in indexes:
+            each = usages[index]
+            candidates = (each,)
+            if each.find_choices():
+                if names is None:
+                    names = set(token)
+                # which command is matched depends on the order, match the
+                # expanded usages of those choices as if not folded
+                choices = each.ambiguous_choices(names)
+                if choices:
+                    candidates = each.pick_choices(choices)
+
+            for usage in candidates:
+                logger.debug('matching usage %s', usage)
+                # undo the changes of a failed usage instead of a clone
+                argv_value = token.dump_value()
+                try:
+                    matched = usage.match(token, False)
+                except DocpieExit:
+                    usage.reset()
+                    if raised is not None:
+                        raised.append(index)
+                    raise
+                if matched:
+                    logger.debug('matched usage %s, checking rest argv %s',
+                                 usage, token)
+                    if (not token or
+                            (token.auto_dashes and list(token) == ['--'])):
+                        token.check_dash()
+                        logger.debug('matched usage %s / %s', usage, token)
+                        if usage is not each:
+                            each.load_picked(usage)
+                        return index, token.dashes
+
+                    logger.debug('matching %s left %s, checking failed',
+                                 usage, token)
+
+                usage.reset()
+                logger.debug('failed matching usage %s / %s', usage, token)
+                token.load_value(argv_value)
+
+        logger.debug('none matched')
+        raise DocpieExit(None)
+
+    def _furthest(self, argv):
+        """Return the index of the usage whose elements match the most
+        tokens of `argv` in order, the first one if more than one. A usage
+        matches its elements in any order, which is not how far it goes"""
+        if self._pending:
+            self._init()
+        token, _ = self._make_token(argv)
+        spec = self._take_spec()
+        furthest = self._furthest_in(token, spec[2])
+        # any error may leave the copy matched, it's dropped then
+        self._put_spec(spec)
+        return furthest
 
-    def _match(self, token):
-        for each in self.usages:
-            logger.debug('matching usage %s', each)
-            argv_clone = token.clone()
-            if each.match(argv_clone, False):
-                logger.debug('matched usage %s, checking rest argv %s',
-                             each, argv_clone)
-                if (not argv_clone or
-                        (argv_clone.auto_dashes and
-                         list(argv_clone) == ['--'])):
-                    argv_clone.check_dash()
-                    logger.debug('matched usage %s / %s', each, argv_clone)
-                    return each, argv_clone.dashes
-
-                logger.debug('matching %s left %s, checking failed',
-                            each, argv_clone)
-
-            each.reset()
-            logger.debug('failed matching usage %s / %s', each, argv_clone)
+    @staticmethod
+    def _furthest_in(token, usages):
+        furthest = None
+        most = -1
+        size = len(token)
+        for index, usage in enumerate(usages):
+            argv_value = token.dump_value()
+            try:
+                for each in usage:
+                    # as `Unit._match_oneline` does for the elements
+                    # after the last matched one
+                    token.option_only = False
+                    if not each.match(token, False):
+                        break
+            except DocpieExit:
+                pass
+            if size - len(token) > most:
+                furthest, most = index, size - len(token)
+            usage.reset()
+            token.load_value(argv_value)
+        return furthest
+
+    def _lazy_flag_and_handler(self, argv):
+        """Handle the argv that is exactly one flag in `extra`, e.g.
+        `prog --help`, before compiling `doc`. Return True if handled.
+
+        Any other argv, or a short flag that may expect an argument
+        (which `check_flag_and_handler` treats differently), is left to
+        `check_flag_and_handler` after compiling."""
+        if argv is None:
+            argv = sys.argv
+        elif isinstance(argv, StrType):
+            argv = argv.split()
 
-        else:
-            logger.debug('none matched')
-            raise DocpieExit(None)
+        if len(argv) != 2:
+            return False
+        flag = argv[1]
+        handler = self.extra.get(flag)
+        if not callable(handler):
+            return False
+
+        if (self.stdopt and not flag.startswith('--') and
+                (len(flag) != 2 or self._short_flag_may_expect_arg(flag))):
+            return False
+
+        logger.debug('find %s before compiling, auto handle it', flag)
+        handler(self, flag)
+        return True
+
+    def _short_flag_may_expect_arg(self, flag):
+        if flag in self._opt_names_expect_arg:
+            return True
+        if self.usage_text is None:
+            return False
+        # `-f<sth>`, `-f=<sth>` or stacked `-abf<sth>` in "Usage"
+        return re.search(
+            r'(?:^|[\s\[\(\|])-[^\s\-\[\]\(\)\|<=]*%s[<=]' % (
+                re.escape(flag[1:])),
+            self.usage_text) is not None
 
     def check_flag_and_handler(self, token):
-        need_arg = [name for name, expect in
-                    self.opt_names_required_max_args.items() if expect != 0]
-        options = set()
-
+        for auto, handler in self._find_flags(token):
+            logger.debug('find %s, auto handle it', auto)
+            handler(self, auto)
+
+    def _flag_table(self):
+        """Return {flag: (order, flag, handler)} of the callable handlers
+        of `extra`, and the names of the options expecting arguments,
+        built again if `extra` or the options change"""
+        table = self.__dict__.get('_flags')
+        if (table is None or
+                table[0] is not self.opt_names_required_max_args):
+            handlers = {}
+            for auto, handler in self.extra.items():
+                if callable(handler):
+                    handlers[auto] = (len(handlers), auto, handler)
+            need_arg = frozenset(
+                name for name, expect in
+                self.opt_names_required_max_args.items() if expect != 0)
+            table = self._flags = (self.opt_names_required_max_args,
+                                   handlers, need_arg)
+        return table[1], table[2]
+
+    def _find_flags(self, token):
+        """Yield (flag, handler) of `extra` found in `token`, one for each
+        option of it"""
+        handlers, need_arg = self._flag_table()
+        if not handlers:
+            return
+        seen = set()
         for ele in token:
             if self.auto2dashes and ele == '--':
                 break
-            if ele.startswith('-') and ele != '-':
-                options.add(ele)
-
-        for inputted in options:
-
-            found = False
-            for auto, handler in self.extra.items():
-                if not callable(handler):
-                    continue
-
-                if auto.startswith('--') and inputted.startswith('--'):
-                    logger.debug('check %s for %s', inputted, auto)
-                    if '=' in inputted:
-                        inputted = inputted.split('=', 1)[0]
-                    if inputted == auto:
-                        found = True
+            if not ele.startswith('-') or ele == '-' or ele in seen:
+                continue
+            seen.add(ele)
+
+            if ele.startswith('--'):
+                found = handlers.get(ele.partition('=')[0])
+            elif self.stdopt:
+                # `-abc`, till the one expecting the rest as its argument.
+                # The one first in `extra` is handled
+                found = None
+                for index, letter in enumerate(ele[1:]):
+                    if index and not self.attachopt:
                         break
-
-                elif auto[1] != '-' and inputted[1] != '-':
-                    logger.debug('check %s for %s', inputted, auto)
-                    if self.stdopt:
-                        attachopt = self.attachopt
-                        break_upper = False
-                        for index, attached_name in enumerate(inputted[1:]):
-                            if not attachopt and index > 0:
-                                break
-
-                            logger.debug('check %s for %s', attached_name, auto)
-
-                            stacked_name = '-' + attached_name
-                            if stacked_name == auto:
-                                found = True
-                                logger.debug('find %s in %s', auto, inputted)
-
-                            if stacked_name in need_arg:
-                                break_upper = True
-                                break
-
-                        if found or break_upper:  # break upper loop
-                            break
-                    else:
-                        found = (inputted == auto)
-
-            if found:
-                logger.debug('find %s, auto handle it', auto)
-                handler(self, auto)
-
-    def exception_handler(self, error):
-        logger.debug('handling %r', error)
-
-        if self.option_sections:
+                    name = '-' + letter
+                    each = handlers.get(name)
+                    if each is not None and (found is None or
+                                             each[0] < found[0]):
+                        found = each
+                    if name in need_arg:
+                        break
+            else:
+                found = handlers.get(ele)
+
+            if found is not None:
+                logger.debug('find %s in %s', found[1], ele)
+                yield found[1], found[2]
+
+    def _help_text(self, kind):
+        """Return the help formatted by `helpstyle`, of the whole `doc` if
+        `kind` is 'doc', or of the "Usage" and "Options" sections if it's
+        'sections'. It's made once for each style, and again only if `doc`
+        is compiled again"""
+        if kind == 'doc':
+            sources = (self.doc,)
+        else:
+            sources = (self.usage_text, self.option_sections)
+        helps = self.__dict__.get('_helps')
+        if helps is None:
+            helps = self._helps = {}
+        key = (kind, self.helpstyle)
+        cached = helps.get(key)
+        if (cached is not None and
+                all(x is y for x, y in zip(cached[0], sources))):
+            return cached[1]
+
+        if kind == 'doc':
+            help_msg = self.doc
+        elif self.option_sections:
             help_msg = ('%s\n\n%s' %
                         (self.usage_text.rstrip(),
                          '\n'.join(self.option_sections.values())))
@@ -395,13 +989,22 @@ class Docpie(dict):
             formated_help_msg = self.help_style_dedent(help_msg)
         else:
             formated_help_msg = help_msg
+        helps[key] = (sources, formated_help_msg)
+        return formated_help_msg
 
-        args = list(error.args)
-        message = args[0]
+    def _error_message(self, message):
+        """The `message` of an error with the help message"""
+        formated_help_msg = self._help_text('sections')
         if message is not None:
             formated_help_msg = '%s\n\n%s' % (message, formated_help_msg)
+        return formated_help_msg.rstrip()  # remove `\n` because `raise` will auto add
 
-        args[0] = formated_help_msg.rstrip()  # remove `\n` because `raise` will auto add
+    def exception_handler(self, error):
+        logger.debug('handling %r', error)
+
+        args = list(error.args)
+        message = args[0]
+        args[0] = self._error_message(message)
         error = self.clone_exception(error, args)
         error.usage_text = self.usage_text
         error.option_sections = self.option_sections
@@ -454,15 +1057,7 @@ class Docpie(dict):
         otherwith(default), print the full `doc`
         """
         help_type = docpie.help
-        helpstyle = docpie.helpstyle
-        if helpstyle == 'python':
-            doc = Docpie.help_style_python(docpie.doc)
-        elif helpstyle == 'dedent':
-            doc = Docpie.help_style_dedent(docpie.doc)
-        # elif help_style == 'raw':
-        #     doc = Docpie.help_style_raw(docpie.doc)
-        else:
-            doc = docpie.doc
+        doc = docpie._help_text('doc')
 
         if help_type == 'short_brief':
             if flag.startswith('--'):
@@ -520,7 +1115,8 @@ class Docpie(dict):
 
     @staticmethod
     def help_style_dedent(docstring):
-        return textwrap.dedent(docstring)
+        from textwrap import dedent
+        return dedent(docstring)
 
     @staticmethod
     def version_handler(docpie, flag):
@@ -558,30 +1154,13 @@ class Docpie(dict):
             'version': self.version
         }
 
-        text = {
-            'doc': self.doc,
-            'usage_text': self.usage_text,
-            'option_sections': self.option_sections,
-        }
-
-        # option = [convert_2_dict(x) for x in self.options]
-
-        option = {}
-        for title, options in self.options.items():
-            option[title] = [convert_2_dict(x) for x in options]
-
-        usage = [convert_2_dict(x) for x in self.usages]
-
-        return {
+        result = self._dump_compiled()
+        result.update({
             '__version__': self._version,
             '__class__': 'Docpie',
             '__config__': config,
-            '__text__': text,
-            'option': option,
-            'usage': usage,
-            'option_names': [list(x) for x in self.opt_names],
-            'opt_names_required_max_args': self.opt_names_required_max_args
-        }
+        })
+        return result
 
     convert_2_dict = convert_to_dict = to_dict
 
@@ -618,27 +1197,32 @@ class Docpie(dict):
         self.option_name = option_name
         self.usage_name = usage_name
 
-        text = dic['__text__']
-        self.doc = text['doc']
-        self.usage_text = text['usage_text']
-        self.option_sections = text['option_sections']
-
-        self.opt_names = [set(x) for x in dic['option_names']]
-        self.opt_names_required_max_args = dic['opt_names_required_max_args']
+        self._load_compiled(dic)
         self.set_config(help=help, version=version)
-        self.options = o = {}
-        for title, options in dic['option'].items():
-            opt_ins = [convert_2_object(x, {}, self.namedoptions)
-                       for x in options]
-            o[title] = opt_ins
-
-        self.usages = [convert_2_object(x, self.options, self.namedoptions)
-                       for x in dic['usage']]
 
         return self
 
     convert_2_docpie = convert_to_docpie = from_dict
 
+    def dumps(self):
+        """Dump the compiled Docpie into compact bytes. Faster to load
+        than `to_dict` + JSON, but not readable.
+
+        pie = Docpie(__doc__)
+        with open('spec.bin', 'wb') as f:
+            f.write(pie.dumps())
+
+        Note if you changed `extra`, it will be lost, same as `to_dict`.
+        """
+        from docpie import binary
+        return binary.dumps(self)
+
+    @classmethod
+    def loads(cls, data):
+        """Convert bytes generated by `dumps` into Docpie instance"""
+        from docpie import binary
+        return binary.loads(data, cls)
+
     def set_config(self, **config):
         """Shadow all the current config."""
         reinit = False
@@ -684,6 +1268,7 @@ class Docpie(dict):
             self.namedoptions = namedoptions
         if 'extra' in config:
             self.extra.update(self._formal_extra(config.pop('extra')))
+            self._extra_changed()
 
         if config:  # should be empty
             raise ValueError(
@@ -696,7 +1281,27 @@ class Docpie(dict):
         if self.doc is not None and reinit:
             logger.warning('You changed the config that requires re-initialized'
                            ' `Docpie` object. Create a new one instead')
-            self._init()
+            if self._pending:
+                self._init_lazy()
+            else:
+                self._init()
+
+    @property
+    def extra(self):
+        """The `{flag: handler}` to handle before matching. Change it with
+        `set_config(extra=...)`, `set_auto_handler` or by assigning a new
+        dict; a change made in place is not seen by the next parse"""
+        return self._extra
+
+    @extra.setter
+    def extra(self, extra):
+        self._extra = extra
+        self._extra_changed()
+
+    def _extra_changed(self):
+        # the flags to find in argv are built from `extra`
+        self.__dict__.pop('_flags', None)
+        self.__dict__.pop('_names', None)
 
     def _formal_extra(self, extra):
         result = {}
@@ -730,6 +1335,7 @@ class Docpie(dict):
                 else:
                     logger.debug('remove %s hanlder', flag)
                     self.extra.pop(flag, None)
+        self._extra_changed()
 
     def find_flag_alias(self, flag):
         """Return alias set of a flag; return None if flag is not defined in
@@ -758,6 +1364,7 @@ class Docpie(dict):
         self.extra[flag] = handler
         for each in alias:
             self.extra[each] = handler
+        self._extra_changed()
 
     def preview(self, stream=sys.stdout):
         """A quick preview of docpie. Print all the parsed object"""
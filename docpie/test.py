@@ -4,14 +4,20 @@ import logging
 import sys
 import platform
 
-from docpie import docpie, Docpie
-from docpie.error import DocpieExit, \
+import docpie as docpie_module
+from docpie import docpie, Docpie, compile_to_module
+from docpie.error import DocpieExit, DocpieError, \
                          UnknownOptionExit, \
                          ExceptNoArgumentExit, \
                          ExpectArgumentExit, \
                          ExpectArgumentHitDoubleDashesExit, \
                          AmbiguousPrefixExit
 import json
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
 
 try:
     from io import StringIO
@@ -2721,6 +2727,1357 @@ Options:
         self.assertEqual(exception.args[0], expect)
 
 
+class CacheTest(unittest.TestCase):
+
+    doc = '''
+    Usage:
+        prog ship new <name>...
+        prog ship <name> move <x> <y> [--speed=<kn>]
+        prog [options]
+
+    Options:
+        -v, --verbose
+        --speed=<kn>  Speed in knots [default: 10].
+    '''
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def cached(self):
+        return [x for x in os.listdir(self.cache_dir) if x.endswith('.pickle')]
+
+    def test_cache_hit(self):
+        argv = 'prog ship titanic move 1 2 --speed=20'
+        expect = Docpie(self.doc).docpie(argv)
+
+        pie = Docpie(self.doc, cache_dir=self.cache_dir)
+        self.assertEqual(pie.docpie(argv), expect)
+        self.assertEqual(len(self.cached()), 1)
+
+        cached_pie = Docpie(self.doc, cache_dir=self.cache_dir)
+        self.assertEqual(cached_pie.usages, pie.usages)
+        self.assertEqual(cached_pie.options, pie.options)
+        self.assertEqual(cached_pie.docpie(argv), expect)
+        self.assertEqual(len(self.cached()), 1)
+
+        self.assertEqual(docpie(self.doc, argv, cache_dir=self.cache_dir),
+                         expect)
+
+    def test_cache_invalidate(self):
+        Docpie(self.doc, cache_dir=self.cache_dir)
+        Docpie(self.doc, cache_dir=self.cache_dir, stdopt=False)
+        self.assertEqual(len(self.cached()), 2)
+        Docpie(self.doc.replace('10', '15'), cache_dir=self.cache_dir)
+        self.assertEqual(len(self.cached()), 3)
+
+    def test_broken_cache(self):
+        Docpie(self.doc, cache_dir=self.cache_dir)
+        name, = self.cached()
+        with open(os.path.join(self.cache_dir, name), 'wb') as f:
+            f.write(b'broken')
+
+        pie = Docpie(self.doc, cache_dir=self.cache_dir)
+        self.assertEqual(pie.docpie('prog -v'),
+                         Docpie(self.doc).docpie('prog -v'))
+        # the broken one is replaced
+        self.assertEqual(Docpie(self.doc, cache_dir=self.cache_dir).usages,
+                         pie.usages)
+
+    def test_untrusted_cache(self):
+        if not hasattr(os, 'getuid'):    # no file owner/mode to check
+            return
+        from docpie import cache
+        cache_dir = os.path.join(self.cache_dir, 'new')
+        pie = Docpie(self.doc, cache_dir=cache_dir)
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o077, 0)
+        key = cache.spec_key(pie)
+        self.assertIsNotNone(cache.load(cache_dir, key))
+
+        os.chmod(os.path.join(cache_dir, 'docpie-%s.pickle' % key), 0o666)
+        self.assertIsNone(cache.load(cache_dir, key))
+        # still works, and writes a trusted one again
+        self.assertEqual(Docpie(self.doc, cache_dir=cache_dir).usages,
+                         pie.usages)
+        self.assertIsNotNone(cache.load(cache_dir, key))
+
+
+class SpecCacheTest(unittest.TestCase):
+
+    doc = '''Usage: prog [-v] [<file>...]'''
+
+    def setUp(self):
+        self.maxsize = docpie_module.spec_cache.maxsize
+        docpie_module.cache_clear()
+
+    def tearDown(self):
+        docpie_module.spec_cache.maxsize = self.maxsize
+        docpie_module.cache_clear()
+
+    def test_hit(self):
+        first = docpie(self.doc, 'prog -v a b')
+        second = docpie(self.doc, 'prog')
+        self.assertEqual(first, {'-v': True, '<file>': ['a', 'b'],
+                                 '--': False})
+        self.assertEqual(second, {'-v': False, '<file>': [], '--': False})
+        info = docpie_module.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+        # different config is a different spec
+        docpie(self.doc, 'prog -v', appearedonly=True)
+        self.assertEqual(docpie_module.cache_info().currsize, 2)
+
+    def test_shared_spec(self):
+        first = docpie(self.doc, 'prog a')
+        first.set_config(extra={'-v': lambda pie, flag: sys.exit('v')})
+        # the cached one is not affected
+        self.assertEqual(docpie(self.doc, 'prog -v'),
+                         {'-v': True, '<file>': [], '--': False})
+        self.assertRaises(SystemExit, first.docpie, 'prog -v')
+
+    def test_stateless(self):
+        doc = 'Usage: prog [<a>]...'
+        for appeared_only in (True, False):
+            first = docpie(doc, ['prog'], appearedonly=appeared_only)
+            second = docpie(doc, ['prog', 'x'], appearedonly=appeared_only)
+            self.assertEqual(
+                docpie(doc, ['prog'], appearedonly=appeared_only), first)
+            self.assertIsNot(first._spares, second._spares)
+            # the cached spec shared by them is never matched
+            self.assertIs(first.usages, second.usages)
+            self.assertEqual(
+                [x.get_value(False, False) for x in first.usages],
+                [x.get_value(False, False) for x in
+                 Docpie(doc, appearedonly=appeared_only).usages])
+        self.assertEqual(first, {'<a>': [], '--': False})
+        self.assertEqual(docpie(doc, ['prog'], appearedonly=True),
+                         {'--': False})
+
+    def test_evict_and_clear(self):
+        docpie_module.spec_cache.maxsize = 2
+        for each in ('a', 'b', 'a', 'c'):
+            docpie('Usage: prog %s' % each, 'prog %s' % each)
+        info = docpie_module.cache_info()
+        self.assertEqual((info.hits, info.evictions, info.currsize),
+                         (1, 1, 2))
+        docpie('Usage: prog a', 'prog a')
+        self.assertEqual(docpie_module.cache_info().hits, 2)
+
+        docpie_module.cache_clear()
+        self.assertEqual(docpie_module.cache_info(), (0, 0, 0, 2, 0))
+
+    def test_least_recently_used(self):
+        from docpie.cache import SpecCache
+        cache = SpecCache(3)
+        for key in 'abc':
+            cache.put(key, key.upper())
+        # `a` is used and `b` is put again, so `c` is the oldest
+        self.assertEqual(cache.get('a'), 'A')
+        cache.put('b', 'B2')
+        cache.put('d', 'D')
+        self.assertIsNone(cache.get('c'))
+        cache.put('e', 'E')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual([cache.get(x) for x in 'bde'], ['B2', 'D', 'E'])
+        self.assertEqual(cache.info(), (4, 2, 2, 3, 3))
+
+
+class LazyTest(unittest.TestCase):
+
+    doc = """Usage:
+    prog [-v] <file>
+    prog -h | --help | --version
+    prog -a<sth>
+
+Options:
+    -h, -?, --help    print help
+    -o FILE           output"""
+
+    def test_help_without_compiling(self):
+        pie = Docpie(self.doc, version='1.0', lazy=True)
+        self.assertNotIn('usages', pie.__dict__)
+        for flag in ('--help', '-?'):
+            with StdoutRedirect() as f:
+                self.assertRaises(SystemExit, pie.docpie, ['prog', flag])
+            self.assertEqual(f.read(), self.doc + '\n')
+        with StdoutRedirect() as f:
+            self.assertRaises(SystemExit, pie.docpie, 'prog --version')
+        self.assertEqual(f.read(), '1.0\n')
+        self.assertNotIn('usages', pie.__dict__)
+        self.assertEqual(pie.usage_text,
+                         Docpie(self.doc).usage_text)
+
+    def test_compile_on_demand(self):
+        pie = Docpie(self.doc, lazy=True)
+        self.assertEqual(len(pie.usages), len(Docpie(self.doc).usages))
+        self.assertFalse(pie._pending)
+
+        pie = Docpie(self.doc, lazy=True)
+        self.assertEqual(pie.docpie('prog -v file'),
+                         Docpie(self.doc).docpie('prog -v file'))
+        with StdoutRedirect():
+            self.assertRaises(SystemExit, pie.docpie, 'prog -vh')
+
+    def test_flag_expects_argument(self):
+        # `-o`/`-a` expect argument so `-o`/`-a` is not the handled flag
+        # when compiled. The lazy mode gives the same result
+        extra = {'-o': lambda pie, flag: sys.exit('o'),
+                 '-a': lambda pie, flag: sys.exit('a')}
+        for argv in ('prog -o', 'prog -a'):
+            pie = Docpie(self.doc, extra=extra, lazy=True)
+            lazy_error = self._run_error(pie, argv)
+            self.assertEqual(lazy_error,
+                             self._run_error(Docpie(self.doc, extra=extra),
+                                             argv))
+
+    def _run_error(self, pie, argv):
+        with StderrRedirect():
+            try:
+                pie.docpie(argv)
+            except SystemExit as e:
+                return str(e)
+
+
+class CodegenTest(unittest.TestCase):
+
+    doc = """Usage:
+    prog ship new <name>...
+    prog ship <name> move <x> <y> [--speed=<kn>]
+    prog mine (set|remove) <x> <y>
+    prog [options] <file>
+    prog (-h | --help | --version)
+
+Options:
+    -q, --quiet
+    --speed=<kn>    speed [default: 10]"""
+
+    def load(self, pie):
+        namespace = {}
+        exec(compile(compile_to_module(pie), '<docpie>', 'exec'), namespace)
+        return namespace
+
+    def test_same_result(self):
+        pie = Docpie(self.doc, version='1.0')
+        module = self.load(pie)
+        # `mine (set|remove)` can not be specialized, nor the ones after it
+        self.assertEqual([x.__name__ for x in module['_matchers']],
+                         ['_match_0', '_match_1'])
+
+        for argv in ('prog ship new a', 'prog ship new a b',
+                     'prog ship a move 1 2', 'prog ship a move 1 2 --speed 3',
+                     'prog mine set 1 2', 'prog mine 1 2 set', 'prog file',
+                     'prog -q file', 'prog ship'):
+            try:
+                expected = Docpie(self.doc).docpie(argv)
+            except DocpieExit:
+                with StdoutRedirect():
+                    self.assertRaises(DocpieExit, module['docpie'], argv)
+            else:
+                result = module['docpie'](argv)
+                self.assertEqual(result, expected)
+                self.assertIs(type(result), dict)
+
+        # list result is not shared
+        first = module['docpie']('prog ship new a')
+        first['<name>'].append('b')
+        self.assertEqual(module['docpie']('prog ship new a')['<name>'], ['a'])
+
+        with StdoutRedirect() as f:
+            self.assertRaises(SystemExit, module['docpie'], 'prog --version')
+        self.assertEqual(f.read(), '1.0\n')
+
+    def test_repeated_option_argument(self):
+        doc = """Usage: prog [--retry=<n>...] <x>"""
+        pie = Docpie(doc)
+        self.assertEqual(pie.opt_names_required_max_args['--retry'],
+                         float('inf'))
+        module = self.load(pie)
+        self.assertEqual(
+            module['get_pie']().opt_names_required_max_args['--retry'],
+            float('inf'))
+        for argv in ('prog x', 'prog --retry=1 x', 'prog x --retry 1 2'):
+            self.assertEqual(module['docpie'](argv),
+                             Docpie(doc).docpie(argv))
+
+    def test_not_literal(self):
+        self.assertRaises(ValueError, compile_to_module,
+                          Docpie(self.doc, version=object()))
+
+    def test_main(self):
+        from docpie.__main__ import main
+        temp_dir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(temp_dir, 'prog.py')
+            output = os.path.join(temp_dir, 'gen.py')
+            with open(source, 'w') as f:
+                f.write('"""%s"""\n' % self.doc)
+            main(['docpie', 'compile', source, '-o', output,
+                  '--appearedonly'])
+            namespace = {}
+            with open(output) as f:
+                exec(compile(f.read(), output, 'exec'), namespace)
+        finally:
+            shutil.rmtree(temp_dir)
+
+        self.assertEqual(namespace['docpie']('prog ship new a'),
+                         Docpie(self.doc, appearedonly=True).docpie(
+                             'prog ship new a'))
+
+
+class BinaryTest(unittest.TestCase):
+
+    doc = """Usage:
+    prog [options] --speed=<kn> go
+    prog --speed=<kn> stop
+    prog ship new <name>...
+    prog mine (set|remove) [<x>]
+
+Options:
+    -s, --speed=<kn>    speed [default: 3]
+    -q, --quiet
+    --color[=<when>]"""
+
+    def normalize(self, value):
+        # the order of names is not kept
+        if isinstance(value, dict):
+            result = {}
+            for key, each in value.items():
+                if key == 'names':
+                    result[key] = sorted(each)
+                elif key == 'option_names':
+                    result[key] = [sorted(x) for x in each]
+                else:
+                    result[key] = self.normalize(each)
+            return result
+        if isinstance(value, (list, tuple)):
+            return [self.normalize(x) for x in value]
+        return value
+
+    def test_round_trip(self):
+        pie = Docpie(self.doc, version='1.0', helpstyle='raw',
+                     appearedonly=True)
+        data = pie.dumps()
+        self.assertTrue(data.startswith(b'DOCPIE'))
+        self.assertLess(len(data), len(json.dumps(pie.to_dict())))
+
+        new_pie = Docpie.loads(data)
+        self.assertEqual(self.normalize(new_pie.to_dict()),
+                         self.normalize(pie.to_dict()))
+        self.assertEqual(new_pie.helpstyle, 'raw')
+        for argv in ('prog -q --speed 1 go', 'prog -s1 stop',
+                     'prog ship new a b', 'prog mine set 1',
+                     'prog --color -s 1 go', 'prog --color=auto -s1 go'):
+            self.assertEqual(new_pie.docpie(argv), pie.docpie(argv))
+
+        with StdoutRedirect() as f:
+            self.assertRaises(SystemExit, new_pie.docpie, 'prog --version')
+        self.assertEqual(f.read(), '1.0\n')
+
+    def test_shared_option(self):
+        pie = Docpie(self.doc)
+        new_pie = Docpie.loads(pie.dumps())
+        self.assertEqual(option_sharing(new_pie), option_sharing(pie))
+
+    def test_bad_data(self):
+        data = Docpie(self.doc).dumps()
+        self.assertRaises(ValueError, Docpie.loads, b'DOC')
+        self.assertRaises(ValueError, Docpie.loads, b'NOTPIE' + data[6:])
+        self.assertRaises(ValueError, Docpie.loads,
+                          data[:6] + b'\xff\xff' + data[8:])
+        # the formats before are never released
+        for version in (b'\x00\x01', b'\x00\x02'):
+            self.assertRaises(ValueError, Docpie.loads,
+                              data[:6] + version + data[8:])
+        self.assertRaises(ValueError, Docpie(self.doc, version=object()).dumps)
+
+
+class PickleTest(unittest.TestCase):
+
+    doc = BinaryTest.doc
+
+    def test_spec_only(self):
+        pie = Docpie(self.doc)
+        expected = dict(pie.docpie('prog -q --speed 1 go'))
+        # leave some matching value
+        pie.usages[0].match(pie._prepare_token('prog -q -s 1 go'), False)
+
+        new_pie = pickle.loads(pickle.dumps(pie, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(dict(new_pie), {})
+        self.assertEqual(option_sharing(new_pie), option_sharing(pie))
+
+        values = []
+
+        def walk(element):
+            if isinstance(element, list):
+                for each in element:
+                    walk(each)
+            else:
+                values.append(element.value)
+                walk(getattr(element, 'ref', None) or [])
+
+        walk(new_pie.usages)
+        self.assertTrue(values)
+        self.assertTrue(all(x in (None, False) for x in values), values)
+
+        self.assertEqual(new_pie.docpie('prog -q --speed 1 go'), expected)
+        self.assertEqual(new_pie.usages, pie.usages)
+
+    def test_protocols(self):
+        pie = Docpie(self.doc, version='1.0')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            new_pie = pickle.loads(pickle.dumps(pie, protocol))
+            self.assertEqual(new_pie.docpie('prog mine set 1'),
+                             pie.docpie('prog mine set 1'))
+            self.assertEqual(new_pie.version, '1.0')
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_import_only_needed(self):
+        unwanted = ('docpie.complete', 'docpie.bashlog', 'docpie.tracemore',
+                    'docpie.codegen', 'docpie.binary', 'logging', 'hashlib',
+                    'tempfile', 'ast', 'pprint', 'textwrap')
+        code = ('import sys, docpie; '
+                'print(" ".join(x for x in %r if x in sys.modules))' %
+                (unwanted,))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.Popen([sys.executable, '-c', code], cwd=root,
+                                   stdout=subprocess.PIPE,
+                                   universal_newlines=True)
+        out, _ = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        if sys.version_info < (3, 7):
+            return
+        self.assertEqual(out.strip(), '')
+
+    def test_lazy_attributes(self):
+        from docpie import codegen
+        self.assertIs(docpie_module.compile_to_module,
+                      codegen.compile_to_module)
+        self.assertIs(docpie_module.logger, logging.getLogger('docpie'))
+        self.assertRaises(AttributeError, getattr, docpie_module, 'nothing')
+
+    def test_lazy_regex(self):
+        from docpie.lazy import regex
+        pattern = regex(r'(?i)^a(?P<rest>.*)')
+        self.assertEqual(pattern.match('Abc').group('rest'), 'bc')
+        self.assertEqual(pattern.sub('', 'abc'), '')
+        self.assertEqual(pattern.pattern, r'(?i)^a(?P<rest>.*)')
+
+
+class SectionReTest(unittest.TestCase):
+
+    doc = """
+SYNOPSIS
+    prog [options] <file>
+
+OPTIONS
+    -q, --quiet    be quiet
+"""
+
+    class Pie(Docpie):
+        usage_name = 'SYNOPSIS'
+        option_name = 'OPTIONS'
+
+    def test_shared(self):
+        from docpie.parser import section_re_cache
+        self.Pie(self.doc)
+        before = section_re_cache.info()
+        pie = self.Pie(self.doc)
+        after = section_re_cache.info()
+        self.assertEqual(after.misses, before.misses)
+        self.assertEqual(after.hits - before.hits, 3)
+        self.assertEqual(pie.docpie('prog -q a'),
+                         {'--': False, '-q': True, '--quiet': True,
+                          '<file>': 'a'})
+
+    def test_case_sensitive(self):
+        from docpie.parser import section_re
+        self.assertIsNot(section_re('{0}', 'a', True),
+                         section_re('{0}', 'a', False))
+        self.assertIsNone(section_re('{0}', 'a', True).search('A'))
+        self.assertIsNotNone(section_re('{0}', 'a', False).search('A'))
+
+
+class TokenTest(unittest.TestCase):
+
+    def test_till_end_bracket(self):
+        from docpie.tokens import Token
+        token = Token('( a [ b ] ) ... c'.split())
+        self.assertEqual(token.next(), '(')
+        inside = token.till_end_bracket('(')
+        self.assertEqual(list(inside), ['a', '[', 'b', ']'])
+        self.assertEqual(inside.next(), 'a')
+        self.assertEqual(inside.next(), '[')
+        self.assertEqual(list(inside.till_end_bracket('[')), ['b'])
+        self.assertFalse(inside)
+        self.assertTrue(token.check_ellipsis_and_drop())
+        token.push('-b')
+        self.assertEqual(list(token), ['-b', 'c'])
+        self.assertEqual(len(token), 2)
+
+    def test_brackets_not_in_pair(self):
+        from docpie.tokens import Token
+        for each in ('( a', '( a ]', '( [ a ) ]', '[ ( ] )'):
+            token = Token(each.split())
+            start = token.next()
+            self.assertRaises(DocpieError, token.till_end_bracket, start)
+        self.assertRaises(DocpieError, Docpie, 'Usage: prog (a | [b)]')
+
+    def test_long_usage(self):
+        names = ['c%s' % x for x in range(300)]
+        pie = Docpie('Usage: prog (%s) [%s]' % (
+            ' | '.join(names), '[<x>' * 50 + ']' * 50))
+        self.assertEqual(pie.docpie('prog c299 1 2')['c299'], True)
+        self.assertEqual(pie.docpie('prog c0 1 2')['<x>'], ['1', '2'])
+
+    def test_option_names(self):
+        from docpie.tokens import OptionNames
+        names = OptionNames(('-o', '--out', '--output', '--prefix'))
+        self.assertEqual(names.prefixes('--output=x'), ('--out', '--output'))
+        self.assertEqual(names.prefixes('-ofile'), ('-o',))
+        self.assertEqual(names.prefixes('file'), ())
+        self.assertEqual(names.startswith('--o'), ['--out', '--output'])
+        self.assertEqual(names.startswith('--outp'), ['--output'])
+        self.assertEqual(names.startswith('--'),
+                         ['--out', '--output', '--prefix'])
+        self.assertEqual(names.startswith('--x'), [])
+
+    def test_option_names_cache_bounded(self):
+        pie = Docpie("""
+        Usage: prog [options] <x>...
+
+        Options:
+            -o <file>
+            --out=<file>
+        """)
+        argvs = [['prog', '-ofile%s' % x, '--out=%s' % x, 'x%s' % x]
+                 for x in range(3000)]
+        for each in pie.docpie_many(argvs):
+            self.assertTrue(each.ok)
+        names = pie._option_names()[1]
+        self.assertLessEqual(len(names._prefixes), names.cache_size)
+        self.assertEqual(names.prefixes('--out=x'), ('--out',))
+        self.assertEqual(names.prefixes('-ofile9'), ('-o',))
+
+    def test_option_names_of_spec(self):
+        pie = Docpie("""
+        Usage: prog [options]
+
+        Options:
+            --prefix=<p>
+            --prepare
+        """)
+        known, names = pie._option_names()
+        self.assertIs(pie._option_names()[1], names)
+        self.assertEqual(pie.docpie('prog --prep')['--prepare'], True)
+        self.assertNotIn('_names', pickle.loads(pickle.dumps(pie)).__dict__)
+        pie.set_config(extra={'--preview': lambda pie, flag: None})
+        self.assertIsNot(pie._option_names()[1], names)
+        self.assertEqual(
+            set(pie._option_names()[1].startswith('--prep')),
+            set(('--prepare',)))
+        self.assertIn('--preview', pie._option_names()[1].startswith('--pre'))
+
+    def test_argv_option_counts(self):
+        from docpie.tokens import Argv
+        argv = Argv(['-ofile', 'a', '--', '--out=x'], True, True, True, True,
+                    {'-o': 1, '--out': 1, '-v': 0})
+        argv.formal(False)
+        self.assertTrue(argv.has_option(('-v', '--out')))
+        self.assertFalse(argv.has_option(('-v',)))
+        # not in `known`
+        self.assertFalse(argv.has_option(('-a',)))
+
+        clone = argv.clone()
+        value = clone.dump_value()
+        self.assertEqual(clone.break_for_option(('-o',)),
+                         ('-o', 'file', 0, '-ofile'))
+        self.assertFalse(clone.has_option(('-o',)))
+        self.assertTrue(argv.has_option(('-o',)))
+        # after `--`
+        self.assertEqual(clone.break_for_option(('--out',)),
+                         (None, None, 0, '--'))
+        clone.insert(0, '-v')
+        self.assertTrue(clone.has_option(('-v',)))
+        del clone[:]
+        self.assertFalse(clone.has_option(('-v', '--out')))
+        clone.load_value(value)
+        self.assertTrue(clone.has_option(('-o',)))
+        clone.next()
+        clone.restore(argv)
+        self.assertEqual(clone, argv)
+        self.assertTrue(clone.has_option(('-o',)))
+
+    def test_argv_status(self):
+        from docpie.tokens import Argv
+        argv = Argv(['a', 'b'], True, True, True, True)
+        status = argv.status()
+        clone = argv.clone()
+        self.assertEqual(clone.status(), status)
+        value = argv.dump_value()
+        argv.insert(0, argv.next())
+        self.assertEqual(argv, ['a', 'b'])
+        self.assertNotEqual(argv.status(), status)
+        argv.load_value(value)
+        self.assertEqual(argv.status(), status)
+        clone.next()
+        self.assertNotEqual(clone.status(), status)
+        clone.restore(argv)
+        self.assertEqual(clone.status(), status)
+
+    def test_argv_undo(self):
+        from docpie.tokens import Argv
+        argv = Argv(['-o', 'a', 'b', 'c'], True, True, True, True,
+                    {'-o': 1})
+        argv.formal(False)
+        value = argv.dump_value()
+        self.assertEqual(argv.pop(0), '-o')
+        ref = argv.take(0, 1)
+        self.assertEqual((ref, argv), (['a'], ['b', 'c']))
+        inner = argv.dump_value()
+        argv.insert(1, '-o')
+        argv[0] = 'x'
+        del argv[-1]
+        self.assertEqual(argv, ['x', '-o'])
+        argv.load_value(inner)
+        self.assertEqual(argv, ['b', 'c'])
+        self.assertFalse(argv.has_option(('-o',)))
+        argv.put(0, ref)
+        argv.load_value(value)
+        self.assertEqual(argv, ['-o', 'a', 'b', 'c'])
+        self.assertTrue(argv.has_option(('-o',)))
+
+
+class ChoiceTest(unittest.TestCase):
+
+    doc = """
+    Usage:
+        prog (add|rm) (-a|-b) <x>
+        prog (go|stop) (fast|slow) <x> [<y>]
+        prog (go|stop)... <x>
+    """
+
+    def test_fold(self):
+        from docpie.element import Choice
+        pie = Docpie(self.doc)
+        # a line with `(-a|-b)` or a repeated `(...)` is still expanded
+        self.assertEqual(len(pie.usages), 4 + 1 + 2)
+        self.assertEqual([len(x.find_choices()) for x in pie.usages],
+                         [0, 0, 0, 0, 2, 0, 0])
+        self.assertEqual(pie.usages[4].find_choices()[1].choices,
+                         ('fast', 'slow'))
+
+        names = ' '.join('(a%s|b%s)' % (x, x) for x in range(40))
+        pie = Docpie('Usage: prog %s <x>' % names)
+        self.assertEqual(len(pie.usages), 1)
+        self.assertEqual(len(pie.usages[0].find_choices()), 40)
+        result = pie.docpie('prog %s 1' % ' '.join('b%s' % x
+                                                    for x in range(40)))
+        self.assertEqual(result['a0'], False)
+        self.assertEqual(result['b39'], True)
+        self.assertEqual(result['<x>'], '1')
+
+    def test_match(self):
+        pie = Docpie(self.doc)
+        self.assertEqual(
+            pie.docpie('prog stop slow 1'),
+            {'add': False, 'rm': False, '-a': False, '-b': False,
+             'go': 0, 'stop': 1, 'fast': False, 'slow': True,
+             '<x>': '1', '<y>': None, '--': False})
+        self.assertEqual(pie.docpie('prog rm -b 1')['rm'], True)
+        self.assertEqual(pie.docpie('prog stop stop 1')['stop'], 2)
+        self.assertRaises(DocpieExit, pie.docpie, 'prog go')
+
+    def test_match_expanded_order(self):
+        # the expanded `prog a <x>` is tried before `prog b <x>`, and
+        # `<x>` can take `b` before `a` matches
+        pie = Docpie('Usage: prog (a|b) <x>')
+        self.assertEqual(pie.docpie('prog b a'),
+                         {'a': True, 'b': False, '<x>': 'b', '--': False})
+        self.assertEqual(pie.docpie('prog b 1'),
+                         {'a': False, 'b': True, '<x>': '1', '--': False})
+
+    def test_fold_optional(self):
+        pie = Docpie('Usage: prog [a|b] <x>')
+        self.assertEqual(len(pie.usages), 1)
+        self.assertEqual(pie.usages[0].find_choices()[0].choices, ('a', 'b'))
+        # like the expanded `prog [a] <x>` tried before `prog [b] <x>`
+        self.assertEqual(pie.docpie('prog b'),
+                         {'a': False, 'b': False, '<x>': 'b', '--': False})
+        self.assertEqual(pie.docpie('prog b 1'),
+                         {'a': False, 'b': True, '<x>': '1', '--': False})
+
+    def test_pick_ambiguous_only(self):
+        names = ' '.join('(a%s|b%s)' % (x, x) for x in range(16))
+        pie = Docpie('Usage: prog [-v] %s [<rest>...]' % names)
+        argv = 'prog -v %s a15' % ' '.join('b%s' % x for x in range(16))
+        choices = pie.usages[0].ambiguous_choices(set(argv.split()))
+        self.assertEqual([x.choices for x in choices], [('a15', 'b15')])
+        # the other 15 are not expanded, or it tries 2 ** 16 usages
+        result = pie.docpie(argv)
+        self.assertEqual((result['b0'], result['a15'], result['b15']),
+                         (True, False, True))
+        self.assertEqual(result['<rest>'], ['a15'])
+
+    def test_round_trip(self):
+        pie = Docpie(self.doc)
+        for new_pie in (Docpie.from_dict(json.loads(json.dumps(
+                            pie.to_dict()))),
+                        Docpie.loads(pie.dumps()),
+                        pickle.loads(pickle.dumps(pie))):
+            self.assertEqual(new_pie.usages, pie.usages)
+            self.assertEqual(
+                [[x.choices for x in each.find_choices()]
+                 for each in new_pie.usages],
+                [[x.choices for x in each.find_choices()]
+                 for each in pie.usages])
+            self.assertEqual(new_pie.docpie('prog go fast 1 2'),
+                             pie.docpie('prog go fast 1 2'))
+
+
+class DispatchTest(unittest.TestCase):
+
+    doc = """
+    Usage:
+        prog ship new <name>...
+        prog ship <name> move <x> <y> [--speed=<kn>]
+        prog ship shoot <x> <y>
+        prog mine (set|remove) <x> <y> [--moored]
+        prog [go] <x>
+    """
+
+    def candidates(self, pie, argv):
+        return pie._usage_index().candidates(pie._prepare_token(argv))
+
+    def test_candidates(self):
+        pie = Docpie(self.doc)
+        self.assertEqual(self.candidates(pie, 'prog ship new a'), [0])
+        self.assertEqual(self.candidates(pie, 'prog ship a move 1 2'), [1])
+        self.assertEqual(self.candidates(pie, 'prog mine remove 1 2'), [3])
+        self.assertEqual(self.candidates(pie, 'prog 1'), [4])
+        # `--speed` may raise, so the usage is tried in order
+        self.assertEqual(self.candidates(pie, 'prog 1 --speed'), [1])
+        self.assertEqual(pie.docpie('prog ship a move 1 2')['move'], True)
+        self.assertEqual(pie.docpie('prog mine remove 1 2')['remove'], True)
+        self.assertRaises(ExpectArgumentExit, pie.docpie, 'prog 1 --speed')
+
+    def test_rebuild(self):
+        pie = Docpie(self.doc)
+        index = pie._usage_index()
+        self.assertIs(pie._usage_index(), index)
+        new_pie = Docpie.from_dict(pie.to_dict())
+        self.assertIsNot(new_pie._usage_index(), index)
+        self.assertNotIn('_index', pickle.loads(pickle.dumps(pie)).__dict__)
+        self.assertEqual(self.candidates(new_pie, 'prog ship new a'), [0])
+
+    def test_feasible(self):
+        pie = Docpie(self.doc)
+        # too many, too few arguments for `[go] <x>`
+        self.assertEqual(self.candidates(pie, 'prog go 1'), [4])
+        self.assertEqual(self.candidates(pie, 'prog go 1 2'), [])
+        self.assertEqual(self.candidates(pie, 'prog'), [])
+        # `<name>...` takes any number of them
+        self.assertEqual(self.candidates(pie, 'prog ship new a b c d'), [0])
+        # `3` may be the argument of `--speed`
+        self.assertEqual(
+            self.candidates(pie, 'prog ship a move 1 2 --speed 3'), [1])
+        # the option is not in the usage
+        self.assertEqual(self.candidates(pie, 'prog 1 --moored'), [])
+        self.assertEqual(self.candidates(pie, 'prog mine set 1 2 --moor'),
+                         [3])
+        # counted only without `--`
+        self.assertEqual(self.candidates(pie, 'prog go -- 1'), [4])
+
+    def test_pruned(self):
+        pie = Docpie(self.doc)
+        pie.docpie('prog ship a move 1 2 --speed=3')
+        self.assertEqual(pie.usages_pruned, 4)
+        self.assertRaises(SystemExit, pie.docpie, 'prog 1 --moored')
+        self.assertEqual(pie.usages_pruned, 5)
+        self.assertRaises(ExpectArgumentExit, pie.docpie, 'prog 1 --speed')
+        self.assertEqual(pie.usages_pruned, 4)
+        # by the automaton, no usage is tried
+        pie.docpie('prog ship new a')
+        self.assertEqual(pie.usages_pruned, 0)
+
+    def test_pruned_per_thread(self):
+        import threading
+        pie = Docpie(self.doc)
+        pie.docpie('prog ship a move 1 2 --speed=3')
+        pruned = []
+
+        def parse():
+            pruned.append(pie.usages_pruned)
+            self.assertRaises(SystemExit, pie.docpie, 'prog 1 --moored')
+            pruned.append(pie.usages_pruned)
+
+        thread = threading.Thread(target=parse)
+        thread.start()
+        thread.join()
+        self.assertEqual(pruned, [0, 5])
+        self.assertEqual(pie.usages_pruned, 4)
+
+
+class MemoTest(unittest.TestCase):
+
+    doc = """
+    Usage: prog [<file>...] [-a | -b] [-c | -d]
+           prog go [(x|y) [<v> [<w>...]]]... [-e | -f]
+    """
+
+    def test_same_result(self):
+        plain = Docpie(self.doc)
+        pie = Docpie(self.doc, memo=True)
+        for argv in ('prog 1 2 -b', 'prog 1 -d', 'prog', 'prog go x 1 2 -f',
+                     'prog go x 1 y 2 3'):
+            self.assertEqual(pie.docpie(argv), plain.docpie(argv))
+        self.assertRaises(SystemExit, pie.docpie, 'prog -a -b')
+
+    def test_picked_choices(self):
+        # the usages picked from a `Choice` are made during the parse
+        doc = """
+        Usage: prog (a|b) (c|d) (e|f) <x>
+               prog ((a|b) <x>)
+        """
+        plain = Docpie(doc)
+        pie = Docpie(doc, memo=True)
+        for argv in ('prog a d e b', 'prog a e c b', 'prog b c e d'):
+            self.assertEqual(pie.docpie(argv), plain.docpie(argv))
+
+    def test_skipped(self):
+        doc = """
+        Usage: prog [<file>...] x y [-a]
+               prog [<file>...] y x [-a]
+        """
+        pie = Docpie(doc, memo=True)
+        pie.docpie('prog 1 2 3 y x')
+        # `[<file>...]` of the usage before
+        self.assertGreater(pie.memo_skipped, 0)
+        self.assertEqual(pie['<file>'], ['1', '2', '3'])
+        plain = Docpie(doc)
+        plain.docpie('prog 1 2 3 y x')
+        self.assertEqual(plain.memo_skipped, 0)
+
+
+class AutomatonTest(unittest.TestCase):
+
+    doc = """
+    Usage:
+        prog ship new <name>...
+        prog ship <name> move <x> <y> [--speed=<kn>]
+        prog [options] remove <x>
+        prog [options] <file>
+        prog mine <x>... <y>
+
+    Options:
+        -q, --quiet
+        --speed=<kn>    speed [default: 10]
+    """
+
+    def interpreted(self, pie):
+        pie = pie._clone_spec()
+        pie._match_simple = lambda token: None
+        return pie
+
+    def test_same_result(self):
+        for config in ({}, {'appearedonly': True}, {'auto2dashes': False}):
+            pie = Docpie(self.doc, **config)
+            plain = self.interpreted(pie)
+            for argv in ('prog ship new a', 'prog ship new a b',
+                         'prog ship a move 1 2', 'prog set 1', 'prog file',
+                         'prog ship', 'prog ship a move 1 2 --speed 3',
+                         'prog mine 1 2', 'prog set', 'prog', 'prog a b',
+                         'prog set remove', 'prog remove set'):
+                try:
+                    expected = plain.docpie(argv)
+                except DocpieExit:
+                    with StdoutRedirect():
+                        self.assertRaises(DocpieExit, pie.docpie, argv)
+                else:
+                    self.assertEqual(pie.docpie(argv), expected)
+                    self.assertEqual(dict(pie), expected)
+
+        # list result is not shared
+        first = pie.docpie('prog ship new a')
+        first['<name>'].append('b')
+        self.assertEqual(pie.docpie('prog ship new a')['<name>'], ['a'])
+
+    def test_plans(self):
+        pie = Docpie(self.doc)
+        automaton = pie._usage_automaton()
+        # `mine <x>... <y>` is matched by `Unit.match`
+        self.assertEqual([x[0] for x in automaton.plans], [0, 1, 2, 3])
+        self.assertEqual(automaton.plans[2][1], [['remove'], None])
+        self.assertIsNone(automaton.match(['mine', '1', '2']))
+        self.assertEqual(automaton.match(['remove', 'x'])['remove'], True)
+        # the states are made on demand and reused
+        states = len(automaton._moves)
+        self.assertEqual(automaton.match(['remove', 'y'])['<x>'], ['y'])
+        self.assertEqual(len(automaton._moves), states)
+        self.assertIs(pie._usage_automaton(), automaton)
+
+        pie.set_config(appearedonly=True)
+        self.assertIsNot(pie._usage_automaton(), automaton)
+        self.assertEqual(Docpie(self.doc, optionsfirst=True)
+                         ._usage_automaton().plans, [])
+
+    def test_serialized(self):
+        pie = Docpie(self.doc)
+        plans = pie._usage_automaton().plans
+        for new_pie in (
+                Docpie.from_dict(json.loads(json.dumps(pie.to_dict()))),
+                Docpie.loads(pie.dumps()),
+                pickle.loads(pickle.dumps(pie))):
+            self.assertIn('_automaton', new_pie.__dict__)
+            automaton = new_pie._usage_automaton()
+            self.assertEqual([x[0] for x in automaton.plans],
+                             [x[0] for x in plans])
+            self.assertEqual(new_pie.docpie('prog ship a move 1 2'),
+                             pie.docpie('prog ship a move 1 2'))
+
+        # made with another config, built again
+        dic = pie.to_dict()
+        dic['__config__']['appearedonly'] = True
+        self.assertNotIn('_automaton', Docpie.from_dict(dic).__dict__)
+
+
+class ThreadTest(unittest.TestCase):
+
+    doc = """
+    Usage:
+        prog ship new <name>...
+        prog ship <name> move <x> <y> [--speed=<kn>]
+        prog mine (set|remove) <x> <y> [--moored | --drifting]
+        prog [-v...] [<file>...]
+
+    Options:
+        --speed=<kn>    speed [default: 10]
+        -v              verbose
+    """
+
+    argvs = ('prog ship new a b', 'prog ship a move 1 2 --speed=3',
+             'prog mine remove 1 2 --drifting', 'prog -vv a b c',
+             'prog mine set 1', 'prog ship a move 1 --speed', 'prog a -x')
+
+    def parse(self, pie, argv):
+        try:
+            return pie.docpie(argv)
+        except DocpieExit as e:
+            return type(e), str(e)
+
+    def stress(self, pie, argvs, times):
+        """Parse `argvs` `times` times with `pie` in threads, return the
+        results of each argv, or None if it can't run"""
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:    # python 2 without `futures`
+            return None
+
+        if hasattr(sys, 'getswitchinterval'):
+            get_interval, set_interval = (sys.getswitchinterval,
+                                          sys.setswitchinterval)
+            fastest = 1e-6
+        else:    # python 2 counts the interval in bytecode instructions
+            get_interval, set_interval = (sys.getcheckinterval,
+                                          sys.setcheckinterval)
+            fastest = 1
+        interval = get_interval()
+        set_interval(fastest)
+        try:
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(
+                    lambda argv: self.parse(pie, argv), argvs * times))
+        finally:
+            set_interval(interval)
+        return [results[index::len(argvs)] for index in range(len(argvs))]
+
+    def assertClean(self, pie, **config):
+        # the compiled spec and the copies given back are never left
+        # matched
+        fresh = [x.dump_value() for x in Docpie(self.doc, **config).usages]
+        self.assertEqual([x.dump_value() for x in pie.usages], fresh)
+        for spec in pie._spares:
+            self.assertEqual([x.dump_value() for x in spec[2]], fresh)
+
+    def test_shared_spec(self):
+        pie = Docpie(self.doc)
+        expected = [self.parse(Docpie(self.doc), x) for x in self.argvs]
+        results = self.stress(pie, self.argvs, 50)
+        if results is None:
+            return
+        for argv, each, result in zip(self.argvs, expected, results):
+            self.assertEqual(result, [each] * 50, argv)
+        # each parse matched in a copy of the spec
+        self.assertTrue(1 <= len(pie._spares) <= 8)
+        self.assertClean(pie)
+
+    def test_appeared_only(self):
+        # `[]` is kept in the result while `None` is dropped, so a copy
+        # must be the same as the first one whatever it matched before
+        argvs = ['prog', 'prog -vv a b c', 'prog ship new a',
+                 'prog mine set 1 2', 'prog', 'prog ship a move 1 2',
+                 'prog x -v', 'prog mine']
+        pie = Docpie(self.doc, appearedonly=True)
+        expected = [self.parse(Docpie(self.doc, appearedonly=True), x)
+                    for x in argvs]
+        self.assertNotIn('<file>', expected[0])
+        results = self.stress(pie, argvs, 50)
+        if results is None:
+            return
+        for argv, each, result in zip(argvs, expected, results):
+            self.assertEqual(result, [each] * 50, argv)
+        self.assertClean(pie, appearedonly=True)
+
+
+class BatchTest(unittest.TestCase):
+
+    doc = """
+    Usage:
+        prog ship new <name>...
+        prog ship <name> move <x> <y> [--speed=<kn>]
+        prog mine (set|remove) <x> <y> [--moored | --drifting]
+
+    Options:
+        -h, --help      help
+        --speed=<kn>    speed [default: 10]
+    """
+
+    def test_same_result(self):
+        pie = Docpie(self.doc, version='1.0')
+        argvs = ['prog ship new a b', 'prog ship a move 1 2 --speed=3',
+                 ['prog', 'mine', 'set', '1', '2'], 'prog mine set 1',
+                 'prog --sp', 'prog -x', 'prog ship a move 1 --speed']
+        batch = pie.docpie_many(argvs)
+        self.assertEqual([x.argv for x in batch], argvs)
+        for argv, result in zip(argvs, batch):
+            try:
+                expected = Docpie(self.doc).docpie(argv)
+            except DocpieExit as e:
+                self.assertFalse(result.ok)
+                self.assertIs(type(result.error), type(e))
+                # no help message
+                self.assertEqual(e.msg, result.error.args[0])
+            else:
+                self.assertTrue(result.ok)
+                self.assertEqual(result.value, expected)
+        self.assertEqual(batch.failed, 4)
+        self.assertEqual(batch[4].error.option, set(['--speed']))
+        self.assertEqual(batch[5].error.option, '-x')
+        self.assertGreater(batch.throughput, 0)
+        # the last result is not kept
+        self.assertEqual(dict(pie), {})
+
+    def test_appeared_only(self):
+        # the default values of the other usages depend on the options
+        # matched before
+        doc = """
+        Usage: prog <z> [options] a (a|b)
+               prog (b|a) [options]
+
+        Options:
+            -q
+            --speed=<kn>  speed [default: 10]
+        """
+        argvs = ['prog a -q', 'prog b']
+        batch = Docpie(doc, appearedonly=True).docpie_many(argvs)
+        self.assertEqual(
+            [x.value for x in batch],
+            [Docpie(doc, appearedonly=True).docpie(x) for x in argvs])
+
+    def test_flag(self):
+        pie = Docpie(self.doc, version='1.0')
+        with StdoutRedirect() as f:
+            batch = pie.docpie_many(['prog -h', 'prog --version',
+                                     'prog ship new a'])
+        self.assertEqual(f.read(), '')
+        self.assertEqual([x.flag for x in batch], ['-h', '--version', None])
+        self.assertEqual([x.ok for x in batch], [False, False, True])
+
+    def test_lazy(self):
+        pie = Docpie(self.doc, lazy=True)
+        batch = pie.docpie_many(['prog ship new a', 'prog mine'])
+        self.assertEqual(batch[0].value['<name>'], ['a'])
+        self.assertIs(type(batch[1].error), DocpieExit)
+        self.assertIsNone(batch[1].error.args[0])
+
+
+class ParallelTest(unittest.TestCase):
+
+    doc = BatchTest.doc
+
+    argvs = ['prog ship new a', 'prog ship a move 1 2 --speed=3', 'prog -x',
+             'prog mine set 1 2', 'prog -h', 'prog ship']
+
+    def summary(self, results):
+        return [(x.argv, x.value, type(x.error), x.flag) for x in results]
+
+    def test_same_result(self):
+        from docpie.parallel import parse_all
+        pie = Docpie(self.doc)
+        # a handler can not be pickled
+        pie.set_auto_handler('-h', lambda pie, flag: None)
+        argvs = self.argvs * 5
+        expected = self.summary(pie.docpie_many(argvs))
+        for processes in (1, 2):
+            self.assertEqual(
+                self.summary(parse_all(pie, argvs, processes, chunksize=4)),
+                expected)
+        unordered = self.summary(parse_all(self.doc, argvs, 2, chunksize=4,
+                                           ordered=False))
+        self.assertEqual(sorted(unordered, key=repr),
+                         sorted(expected, key=repr))
+
+    def test_error_fields(self):
+        from docpie.parallel import parse_all
+        result = list(parse_all(self.doc, ['prog -x'], 2))[0]
+        self.assertIs(type(result.error), UnknownOptionExit)
+        self.assertEqual(result.error.option, '-x')
+
+
+class TryParseTest(unittest.TestCase):
+
+    doc = BatchTest.doc
+
+    def test_same_result(self):
+        pie = Docpie(self.doc)
+        for argv in ('prog ship new a b', 'prog ship a move 1 2 --speed=3',
+                     'prog mine set 1', 'prog --sp', 'prog -x',
+                     'prog ship a move 1 --speed', 'prog ship a move 1 2 3'):
+            result = pie.try_parse(argv)
+            try:
+                expected = Docpie(self.doc).docpie(argv)
+            except DocpieExit as e:
+                self.assertFalse(result.ok)
+                self.assertIs(result.error_class, type(e))
+                self.assertEqual(result.message(), e.msg)
+                self.assertEqual(result.message(pie), str(e))
+            else:
+                self.assertTrue(result.ok)
+                self.assertIsNone(result.error_class)
+                self.assertIsNone(result.message())
+                self.assertEqual(result.value, expected)
+        self.assertEqual(dict(pie), {})
+
+    def test_error_fields(self):
+        pie = Docpie(self.doc)
+        result = pie.try_parse('prog -vx')
+        self.assertIs(result.error_class, UnknownOptionExit)
+        self.assertEqual((result.option, result.token), ('-v', '-vx'))
+        self.assertIsNone(result.furthest)
+
+        result = pie.try_parse('prog ship a move 1 2 --speed')
+        self.assertIs(result.error_class, ExpectArgumentExit)
+        self.assertEqual(result.option, set(['--speed']))
+        self.assertEqual(result.furthest, 1)
+
+        result = pie.try_parse('prog --he')
+        self.assertEqual(result.flag, '--help')
+        self.assertIsNone(result.error_class)
+
+    def test_furthest(self):
+        pie = Docpie(self.doc)
+        # the usages are expanded by the choices, and `ship new <name>...`
+        # matches all the tokens, though not in order
+        for argv, furthest in (('prog ship a move 1', 1),
+                               ('prog ship new', 0),
+                               ('prog mine set 1', 2),
+                               ('prog mine remove 1', 4),
+                               ('prog mine', 2),
+                               ('prog x', 0)):
+            result = pie.try_parse(argv)
+            self.assertIs(result.error_class, DocpieExit)
+            self.assertIsNone(result.token)
+            self.assertEqual(result.furthest, furthest)
+
+    def test_furthest_lazily(self):
+        pie = Docpie(self.doc)
+        result = pie.try_parse('prog ship a move 1')
+        self.assertIsNone(result._furthest)
+        self.assertEqual(repr(result),
+                         "<TryResult 'prog ship a move 1' "
+                         "error=DocpieExit(None)>")
+        self.assertEqual(result.furthest, 1)
+        self.assertEqual(result._furthest, 1)
+        self.assertIsNone(pie.try_parse('prog ship new a').furthest)
+        self.assertFalse(hasattr(pie.docpie_many(['prog x'])[0],
+                                 'furthest'))
+
+
+class TemplateTest(unittest.TestCase):
+
+    doc = """
+    Usage:
+        prog go <x> [--speed=<kn>] [-v...]
+        prog go <x>... [--list=<l>]
+        prog stop [<x>]
+
+    Options:
+        --speed=<kn>  speed [default: 10]
+        --list=<l>    list [default: a b]
+        -v            verbose
+        --all         all [default: yes]
+    """
+
+    def merged(self, pie, argv):
+        # merge the default values as it's done without the templates
+        plain = pie._clone_spec()
+        plain._match_simple = lambda token: None
+
+        def fill(index, values):
+            plain._add_rest_value(
+                values, plain._rest_usages(index, plain.usages))
+            plain._add_option_value(values, plain.options)
+            return values
+
+        plain._fill_template = fill
+        return plain.docpie(argv)
+
+    def test_same_result(self):
+        pie = Docpie(self.doc)
+        pie._match_simple = lambda token: None
+        for argv in ('prog go 1', 'prog go 1 --speed=3 -vv',
+                     'prog go 1 2 --list=c', 'prog stop', 'prog stop 1'):
+            self.assertEqual(pie.docpie(argv), self.merged(pie, argv))
+        self.assertEqual(pie.docpie('prog go 1 -vv')['<x>'], ['1'])
+        self.assertEqual(pie['-v'], 2)
+        self.assertEqual(pie['--list'], 'a b')
+        self.assertEqual(pie['--all'], 'yes')
+
+    def test_once(self):
+        pie = Docpie(self.doc)
+        pie.docpie('prog go 1 --speed=1')
+        templates = pie._value_templates()[0]
+        self.assertEqual(templates.count(None), 2)
+        template = templates[0]
+        pie.docpie('prog go 2 --speed=2')
+        self.assertIs(pie._value_templates()[0][0], template)
+        self.assertNotIn('_templates', pickle.loads(pickle.dumps(pie)).__dict__)
+
+    def test_not_shared(self):
+        pie = Docpie(self.doc)
+        pie.docpie('prog stop')['<x>'].append('1')
+        self.assertEqual(pie.docpie('prog stop')['<x>'], [])
+
+
+class FlagTableTest(unittest.TestCase):
+
+    doc = """
+    Usage: prog [options] [<x>...]
+
+    Options:
+        -h, --help     help
+        -o <file>      output
+        -a             a
+        -x, --extra    extra
+    """
+
+    def found(self, pie, argv):
+        return [flag for flag, _ in
+                pie._find_flags(pie._prepare_token(argv))]
+
+    def test_find(self):
+        pie = Docpie(self.doc, version='1')
+        self.assertEqual(self.found(pie, 'prog -h'), ['-h'])
+        self.assertEqual(self.found(pie, 'prog x --help'), ['--help'])
+        self.assertEqual(self.found(pie, 'prog -ah'), ['-h'])
+        # `h` is the argument of `-o`
+        self.assertEqual(self.found(pie, 'prog -aoh'), [])
+        self.assertEqual(self.found(pie, 'prog -- -h'), [])
+        self.assertEqual(self.found(pie, 'prog -a x'), [])
+
+    def test_order(self):
+        pie = Docpie(self.doc, help=False)
+        pie.set_auto_handler('-x', lambda pie, flag: None)
+        pie.set_auto_handler('-a', lambda pie, flag: None)
+        # one for each option of argv, the first one in `extra`
+        self.assertEqual(self.found(pie, 'prog -ax --extra -x'),
+                         ['-x', '--extra', '-x'])
+
+    def test_rebuild(self):
+        pie = Docpie(self.doc, help=False)
+        self.assertEqual(self.found(pie, 'prog -h'), [])
+        table = pie._flags
+        pie._flag_table()
+        self.assertIs(pie._flags, table)
+        pie.set_auto_handler('-h', lambda pie, flag: None)
+        self.assertEqual(self.found(pie, 'prog -h'), ['-h'])
+        self.assertIsNot(pie._flags, table)
+        pie.set_config(extra={'-h': None})
+        self.assertEqual(self.found(pie, 'prog -h --help'), ['--help'])
+        pie.extra = {'-a': lambda pie, flag: None}
+        self.assertEqual(self.found(pie, 'prog -h -a'), ['-a'])
+        # not compared again on each parse
+        table = pie._flags
+        self.found(pie, 'prog -h -a')
+        self.assertIs(pie._flags, table)
+
+        pie = Docpie(self.doc)
+        self.found(pie, 'prog -a')
+        self.assertIn('_flags', pie.__dict__)
+        self.assertNotIn('_flags', pickle.loads(pickle.dumps(pie)).__dict__)
+
+    def test_not_stdopt(self):
+        pie = Docpie(self.doc, stdopt=False, help=False)
+        pie.set_auto_handler('-a', lambda pie, flag: None)
+        pie.set_auto_handler('-x', lambda pie, flag: None)
+        self.assertEqual(self.found(pie, 'prog -a'), ['-a'])
+
+
+class HelpTextTest(unittest.TestCase):
+
+    doc = """
+    Usage: prog go <x>
+
+    Options:
+        -v    verbose
+    """
+
+    def error(self, pie, argv):
+        try:
+            pie.docpie(argv)
+        except DocpieExit as e:
+            return e
+        self.fail('%s should fail' % argv)
+
+    def test_cached(self):
+        pie = Docpie(self.doc)
+        first = self.error(pie, 'prog go')
+        self.assertEqual(
+            str(first), 'Usage: prog go <x>\n\nOptions:\n    -v    verbose')
+        self.assertIs(pie._help_text('sections'),
+                      pie._help_text('sections'))
+        second = self.error(pie, 'prog -x')
+        self.assertEqual(str(second),
+                         'Unknown option: -x.\n\n%s' % first)
+        self.assertEqual(second.msg, 'Unknown option: -x.')
+
+    def test_style(self):
+        pie = Docpie(self.doc)
+        python = pie._help_text('sections')
+        pie.helpstyle = 'raw'
+        self.assertNotEqual(pie._help_text('sections'), python)
+        self.assertEqual(str(self.error(pie, 'prog go')),
+                         ('%s\n\n%s' % (pie.usage_text.rstrip(),
+                                         '\n'.join(
+                                             pie.option_sections.values())
+                                         )).rstrip())
+        pie.helpstyle = 'python'
+        self.assertIs(pie._help_text('sections'), python)
+        self.assertEqual(pie._help_text('doc'),
+                         Docpie.help_style_python(self.doc))
+
+    def test_compiled_again(self):
+        pie = Docpie(self.doc)
+        pie._help_text('sections')
+        pie.doc = self.doc.replace('verbose', 'loud')
+        pie.set_config(name='prog')
+        self.assertIn('loud', str(self.error(pie, 'prog go')))
+        self.assertIn('loud', pie._help_text('doc'))
+
+
 class Writer(StringIO):
 
     if sys.hexversion >= 0x03000000:
@@ -2766,6 +4123,26 @@ class StderrRedirect(object):
         return False
 
 
+def option_sharing(pie):
+    """number each Option/ref by its first appearance"""
+    seen = {}
+    result = []
+
+    def walk(element):
+        if isinstance(element, list):
+            for each in element:
+                walk(each)
+        elif hasattr(element, 'ref'):
+            for each in (element, element.ref):
+                if each is not None:
+                    result.append(seen.setdefault(id(each), len(seen)))
+
+    for options in pie.options.values():
+        walk(options)
+    walk(pie.usages)
+    return result
+
+
 def case():
     return (
         unittest.TestLoader().loadTestsFromTestCase(BasicTest),
@@ -2773,6 +4150,26 @@ def case():
         unittest.TestLoader().loadTestsFromTestCase(APITest),
         unittest.TestLoader().loadTestsFromTestCase(NewErrorTest),
         unittest.TestLoader().loadTestsFromTestCase(IssueTest),
+        unittest.TestLoader().loadTestsFromTestCase(CacheTest),
+        unittest.TestLoader().loadTestsFromTestCase(SpecCacheTest),
+        unittest.TestLoader().loadTestsFromTestCase(LazyTest),
+        unittest.TestLoader().loadTestsFromTestCase(CodegenTest),
+        unittest.TestLoader().loadTestsFromTestCase(BinaryTest),
+        unittest.TestLoader().loadTestsFromTestCase(PickleTest),
+        unittest.TestLoader().loadTestsFromTestCase(ImportTest),
+        unittest.TestLoader().loadTestsFromTestCase(SectionReTest),
+        unittest.TestLoader().loadTestsFromTestCase(TokenTest),
+        unittest.TestLoader().loadTestsFromTestCase(ChoiceTest),
+        unittest.TestLoader().loadTestsFromTestCase(DispatchTest),
+        unittest.TestLoader().loadTestsFromTestCase(MemoTest),
+        unittest.TestLoader().loadTestsFromTestCase(AutomatonTest),
+        unittest.TestLoader().loadTestsFromTestCase(ThreadTest),
+        unittest.TestLoader().loadTestsFromTestCase(BatchTest),
+        unittest.TestLoader().loadTestsFromTestCase(ParallelTest),
+        unittest.TestLoader().loadTestsFromTestCase(TryParseTest),
+        unittest.TestLoader().loadTestsFromTestCase(TemplateTest),
+        unittest.TestLoader().loadTestsFromTestCase(FlagTableTest),
+        unittest.TestLoader().loadTestsFromTestCase(HelpTextTest),
     )
 
 
@@ -1,48 +1,245 @@
-import logging
+import itertools
+
 from docpie.error import DocpieError, UnknownOptionExit, AmbiguousPrefixExit
+from docpie.lazy import get_logger
+
+logger = get_logger('docpie.tokens')
+
+# the versions of `Argv`, never given twice
+_versions = itertools.count(1)
 
-logger = logging.getLogger('docpie.tokens')
 
+class Token(object):
+    """The tokens of a usage, read by a cursor.
 
-class Token(list):
+    `till_end_bracket` returns a `Token` sharing the tokens of this one,
+    and the pairs of brackets are found in one pass, so parsing a usage is
+    linear."""
     _brackets = {'(': ')', '[': ']'}  # , '{': '}', '<': '>'}
 
+    def __init__(self, tokens=()):
+        self._tokens = list(tokens)
+        self._pos = 0
+        self._end = len(self._tokens)
+        # tokens put back by `push`, the last one is the current
+        self._pushed = []
+        # {index of open bracket: index of close bracket or None}
+        self._pairs = None
+
+    def _sub(self, start, end):
+        token = Token.__new__(Token)
+        token._tokens = self._tokens
+        token._pos = start
+        token._end = end
+        token._pushed = []
+        token._pairs = self._pairs
+        return token
+
+    def __len__(self):
+        return len(self._pushed) + self._end - self._pos
+
+    def __bool__(self):
+        return bool(self._pushed) or self._pos < self._end
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        for each in reversed(self._pushed):
+            yield each
+        tokens = self._tokens
+        for index in range(self._pos, self._end):
+            yield tokens[index]
+
+    def __repr__(self):
+        return 'Token(%r)' % list(self)
+
     def next(self):
-        return self.pop(0) if self else None
+        if self._pushed:
+            return self._pushed.pop()
+        if self._pos < self._end:
+            self._pos += 1
+            return self._tokens[self._pos - 1]
+        return None
 
     def current(self):
-        return self[0] if self else None
+        if self._pushed:
+            return self._pushed[-1]
+        if self._pos < self._end:
+            return self._tokens[self._pos]
+        return None
+
+    def push(self, token):
+        """Put `token` back as the current one"""
+        self._pushed.append(token)
+
+    def append(self, token):
+        if self._end != len(self._tokens):
+            # shared with others, take a copy
+            self._tokens = self._tokens[self._pos:self._end]
+            self._pos, self._end = 0, len(self._tokens)
+        self._tokens.append(token)
+        self._end += 1
+        self._pairs = None
+
+    def extend(self, tokens):
+        for each in tokens:
+            self.append(each)
 
     def check_ellipsis_and_drop(self):
-        if self and self[0] == '...':
-            self.pop(0)
+        if self.current() == '...':
+            self.next()
             return True
         return False
 
+    def _pair_brackets(self):
+        brackets = self._brackets
+        ends = set(brackets.values())
+        pairs = {}
+        opened = []
+        for index, each in enumerate(self._tokens):
+            if each in brackets:
+                opened.append(index)
+            elif each in ends and opened:
+                start = opened.pop()
+                if brackets[self._tokens[start]] == each:
+                    pairs[start] = index
+                else:
+                    pairs[start] = None
+        return pairs
+
     def till_end_bracket(self, start):
-        # start bracket should not in self
-        end = self._brackets[start]
-        count = dict.fromkeys(self._brackets, 0)
-        count[start] = 1
-        element = []
-        while self:
-            this = self.pop(0)
-            for each_start, each_end in self._brackets.items():
-                count[each_start] += (this == each_start)
-                count[each_start] -= (this == each_end)
-            if this == end and all(x == 0 for x in count.values()):
-                if any(x < 0 for x in count.values()):
-                    raise DocpieError("brackets not in pair")
-                return element
-            element.append(this)
-        else:
+        """Return the tokens till the bracket closing `start`, which has
+        just been read by `next`. The close bracket is dropped"""
+        open_index = self._pos - 1
+        assert (not self._pushed and open_index >= 0 and
+                self._tokens[open_index] == start)
+        if self._pairs is None:
+            self._pairs = self._pair_brackets()
+        close_index = self._pairs.get(open_index)
+        if close_index is None or close_index >= self._end:
             raise DocpieError("brackets not in pair")
+        self._pos = close_index + 1
+        return self._sub(open_index + 1, close_index)
+
+
+class _Node(object):
+    __slots__ = ('children', 'name', 'count', 'first')
+
+    def __init__(self):
+        self.children = {}
+        # the name ending here
+        self.name = None
+        # the names in this subtree, and the first one added
+        self.count = 0
+        self.first = None
+
+
+class OptionNames(object):
+    """A trie of the option names of a spec, built once and shared by
+    the `Argv` of each parse.
+
+    `prefixes` returns the names a token starts with, e.g. `--out` for
+    `--out=x`. `startswith` returns the names an abbreviation may mean.
+    Both walk the trie by the chars of the token."""
+
+    # most `prefixes` cached, it's cleared when full
+    cache_size = 1024
+
+    def __init__(self, names=()):
+        self._root = _Node()
+        # {name: order added}
+        self._order = {}
+        # {option-like token cut to `_longest`: names it starts with}
+        self._prefixes = {}
+        self._longest = 0
+        for name in names:
+            self._add(name)
+
+    def __contains__(self, name):
+        return name in self._order
+
+    def __len__(self):
+        return len(self._order)
+
+    def _add(self, name):
+        if name in self._order:
+            return
+        self._order[name] = len(self._order)
+        node = self._root
+        for char in name:
+            node.count += 1
+            if node.first is None:
+                node.first = name
+            node = node.children.setdefault(char, _Node())
+        node.count += 1
+        if node.first is None:
+            node.first = name
+        node.name = name
+        self._longest = max(self._longest, len(name))
+
+    def prefixes(self, token):
+        if not token.startswith('-'):
+            return self._walk(token)
+        # no name is longer, or has `=` in it, so the rest never matters.
+        # This keeps the values like `--out=<each file>` out of the cache
+        key = token.partition('=')[0][:self._longest]
+        cache = self._prefixes
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        result = cache[key] = self._walk(key)
+        return result
+
+    def _walk(self, token):
+        result = []
+        node = self._root
+        for char in token:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.name is not None:
+                result.append(node.name)
+        return tuple(result)
+
+    def startswith(self, prefix):
+        """Return the names starting with `prefix`, in the order added"""
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if node.count == 1:
+            return [node.first]
+        result = []
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            if node.name is not None:
+                result.append(node.name)
+            nodes.extend(node.children.values())
+        result.sort(key=self._order.__getitem__)
+        return result
 
 
 class Argv(list):
+    """The argv to match. It counts the tokens starting with each option
+    name, so `break_for_option` knows an option is not there without
+    scanning. The counts are kept on `pop`/`insert`/`extend`, and built
+    again when a slice is replaced.
+
+    Each change is done by `_splice` and kept in an undo log, so
+    `dump_value` is a mark of the log and `load_value` undoes the changes
+    after it, which costs O(changes) instead of copying argv.
+
+    Each change gives it a new version, and `load_value`/`restore` bring
+    the version back with the tokens. So `status` is the same only if
+    the tokens are."""
 
     def __init__(self, argv, auto2dashes,
-                 stdopt, attachopt, attachvalue, known={}):
+                 stdopt, attachopt, attachvalue, known={}, names=None):
 
         super(Argv, self).__init__(argv)
         self.auto_dashes = auto2dashes
@@ -54,9 +251,19 @@ class Argv(list):
         self.attachvalue = attachvalue
         self.error = None
         self.known = known
+        # `OptionNames` of `known`, shared with the clones
+        self._names = names
+        # {option name: tokens starting with it}
+        self._counts = None
+        self._version = next(_versions)
+        # [(index, inserted tokens, removed tokens)]
+        self._log = []
+        # `MatchMemo` of the parse, if it's on
+        self.memo = None
 
     def formal(self, options_first):
         names = self.known
+        option_names = self._option_names()
         result = []
         skip = 0
         for index, each in enumerate(self):
@@ -115,8 +322,7 @@ class Argv(list):
                     else:
                         expect_args = names[option]
                 else:
-                    possible = list(
-                        filter(lambda x: x.startswith(option), names))
+                    possible = option_names.startswith(option)
                     if not possible:
                         self.error = UnknownOptionExit(
                             'Unknown option: %s.' % option,
@@ -156,8 +362,121 @@ class Argv(list):
 
         logger.debug('%s -> %s', self, result)
         self[:] = result
+        # nothing to undo before formal
+        self._log = []
+        self._option_counts()
         return None
 
+    def _option_names(self):
+        if self._names is None:
+            self._names = OptionNames(self.known)
+        return self._names
+
+    def _option_counts(self):
+        if self._counts is None:
+            counts = {}
+            prefixes = self._option_names().prefixes
+            for each in self:
+                for name in prefixes(each):
+                    counts[name] = counts.get(name, 0) + 1
+            self._counts = counts
+        return self._counts
+
+    def _splice(self, index, size, tokens=(), log=True):
+        """Replace `size` tokens from `index` with `tokens`, return the
+        removed ones"""
+        if size == 1 and not tokens:
+            removed = (super(Argv, self).pop(index),)
+        else:
+            removed = tuple(
+                super(Argv, self).__getitem__(slice(index, index + size)))
+            super(Argv, self).__setitem__(slice(index, index + size), tokens)
+        if log:
+            self._log.append((index, tuple(tokens), removed))
+        self._version = next(_versions)
+        counts = self._counts
+        if counts is not None:
+            prefixes = self._names.prefixes
+            for each in removed:
+                for name in prefixes(each):
+                    counts[name] -= 1
+            for each in tokens:
+                for name in prefixes(each):
+                    counts[name] = counts.get(name, 0) + 1
+        return removed
+
+    def has_option(self, names):
+        """Whether a token starts with one of `names`. It may be after
+        `--` though"""
+        option_names = self._option_names()
+        counts = self._option_counts()
+        for name in names:
+            if name not in option_names:
+                # not in `known`
+                if any(each.startswith(name) for each in self):
+                    return True
+            elif counts.get(name):
+                return True
+        return False
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('pop index out of range')
+        return self._splice(index, 1)[0]
+
+    def append(self, token):
+        self._splice(len(self), 0, (token,))
+
+    def extend(self, tokens):
+        self._splice(len(self), 0, tuple(tokens))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                self._splice(start, max(stop - start, 0), tuple(value))
+                return
+            tokens = list(self)
+            tokens[index] = value
+            self._splice(0, len(self), tokens)
+        else:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('list assignment index out of range')
+            self._splice(index, 1, (value,))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            self.__setitem__(index, ())
+        else:
+            self.pop(index)
+
+    # Python 2 calls these for `argv[i:j]`
+    def __setslice__(self, start, stop, value):
+        self.__setitem__(slice(start, stop), value)
+
+    def __delslice__(self, start, stop):
+        self.__delitem__(slice(start, stop))
+
+    def take(self, index, size=None):
+        """Move `size` tokens (the rest if None) from `index` to a new
+        `Argv`"""
+        stop = len(self) if size is None else min(index + size, len(self))
+        result = Argv(self._splice(index, stop - index), self.auto_dashes,
+                      self.stdopt, self.attachopt, self.attachvalue,
+                      self.known, self._names)
+        result.dashes = self.dashes
+        result.option_only = self.option_only
+        result.error = self.error
+        return result
+
+    def put(self, index, tokens):
+        """Put `tokens` back at `index`, e.g. the ones left by `take`"""
+        self._splice(index, 0, tuple(tokens))
+
     def current(self, offset=0):
         return self[offset] if len(self) > offset else None
 
@@ -182,7 +501,10 @@ class Argv(list):
                 index > dashes_index or
                 fine):
             logger.debug('insert %s into %s at %s', object, self, index)
-            return super(Argv, self).insert(index, object)
+            if index < 0:
+                index = max(index + len(self), 0)
+            self._splice(min(index, len(self)), 0, (object,))
+            return None
 
         logger.debug('%s not in %s', flag, self.known)
         # self.error = 'Unknown option: %s.' % flag
@@ -191,14 +513,22 @@ class Argv(list):
                                 inside=from_ or flag)
 
     def break_for_option(self, names):
+        if not self.has_option(names):
+            return None, None, 0, None
         auto_dashes = self.auto_dashes
         stdopt = self.stdopt
         attachvalue = self.attachvalue
+        option_names = self._names
+        if all(name in option_names for name in names):
+            prefixes = option_names.prefixes
+        else:
+            prefixes = None
         for index, option in enumerate(self):
             if option == '--' and auto_dashes:
                 return None, None, 0, option
+            found = names if prefixes is None else prefixes(option)
             for name in names:
-                if option.startswith(name):
+                if name in found and option.startswith(name):
                     value = None
                     self.pop(index)
                     # `-flag=sth` -> `-flag =sth`
@@ -242,25 +572,47 @@ class Argv(list):
 
     def clone(self):
         result = Argv(self, self.auto_dashes,
-                      self.stdopt, self.attachopt, self.attachvalue)
+                      self.stdopt, self.attachopt, self.attachvalue,
+                      self.known, self._names)
         result.dashes = self.dashes
         result.option_only = self.option_only
         result.error = self.error
-        result.known = self.known
+        result._counts = None if self._counts is None else dict(self._counts)
+        result._version = self._version
         return result
 
     def restore(self, ins):
-        self[:] = ins
+        self._splice(0, len(self), list(ins))
+        self._version = ins._version
         self.dashes = ins.dashes
         self.option_only = ins.option_only
         self.error = ins.error
 
     def status(self):
-        # return len(self)
-        return list(self)
+        """The version of the tokens, which changes when they do"""
+        return self._version
 
     def dump_value(self):
-        return list(self), self.dashes, self.option_only
+        return len(self._log), self._version, self.dashes, self.option_only
+
+    def changes(self, value):
+        """The changes made after `value` of `dump_value`, to `redo` them
+        on the same tokens"""
+        return (self._log[value[0]:],
+                (self._version, self.dashes, self.option_only))
+
+    def redo(self, changes):
+        log, state = changes
+        for index, inserted, removed in log:
+            self._splice(index, len(removed), inserted)
+        # the tokens are the same as the ones of this version
+        self._version, self.dashes, self.option_only = state
 
     def load_value(self, value):
-        self[:], self.dashes, self.option_only = value
+        size, version, self.dashes, self.option_only = value
+        log = self._log
+        assert len(log) >= size, 'undo to a mark not taken by this argv'
+        while len(log) > size:
+            index, inserted, removed = log.pop()
+            self._splice(index, len(inserted), removed, False)
+        self._version = version